@@ -0,0 +1,63 @@
+"""
+Time WeatherProcessor.get_fullset against a local replay server with one
+worker (the old sequential download) and with a pool of workers, from the
+monthly pages or from the yearly bulk CSV files. Recorded bulk CSV files in
+the fixture corpus are replayed instead of the synthetic ones.
+Run from the repository root: python -m benchmarks.bench_fullset [--source csv]
+By: Ha Phuong Le
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.fixtures import load_csvs
+from benchmarks.replay_server import ReplayServer
+from weather_processor import WeatherProcessor
+from dbcm import DBCM
+
+
+def run_fullset(server, workers, today, stations, source="html"):
+    """
+    Download the full history into a throwaway database and return the elapsed seconds and row count
+    By: Ha Phuong Le
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "weather.sqlite")
+        processor = WeatherProcessor(database, workers=workers, base_url=server.url, cache_dir=None,
+                                     stations=stations, rate=None, source=source, bulk_url=server.bulk_url)
+        processor.today = today
+
+        start = time.perf_counter()
+        processor.get_fullset()
+        elapsed = time.perf_counter() - start
+
+        with DBCM(database) as cur:
+            rows = cur.execute("select count(*) from samples").fetchone()[0]
+        DBCM.close_all()
+        return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=10, help="length of the served history")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the server waits per page")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--stations", type=int, default=1, help="number of stations crawled at once")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests the server fails")
+    parser.add_argument("--source", choices=("html", "csv"), default="html", help="download pages or bulk CSV files")
+    args = parser.parse_args()
+
+    last = (2020, 11)
+    first = (last[0] - args.years, last[1])
+    with ReplayServer(first, last, args.latency, args.failure_rate, csvs=load_csvs()) as server:
+        for workers in args.workers:
+            server.requests = server.failures = 0
+            stations = [27174 + station for station in range(args.stations)]
+            elapsed, rows = run_fullset(server, workers, datetime(*last, 15), stations, args.source)
+            print(f"workers={workers:<3} {elapsed:8.2f}s  {server.requests:5} requests  "
+                  f"{server.failures:4} failed  {rows:6} rows")
+
+
+if __name__ == "__main__":
+    main()
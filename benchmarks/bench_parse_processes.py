@@ -0,0 +1,100 @@
+"""
+Time re-ingesting a backfill of several stations from cached pages with the
+pages parsed on the parser thread and on pools of parser processes, and
+check every run saves the same rows. The cache is filled from the replay
+server once, the timed runs do not touch the network.
+Run from the repository root: python -m benchmarks.bench_parse_processes
+By: Ha Phuong Le
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.fixtures import LAST_MONTH, past_months
+from benchmarks.replay_server import ReplayServer
+from db_operations import DBOperations
+from dbcm import DBCM
+from http_client import HttpSession
+from ingest_pipeline import IngestPipeline
+from response_cache import ResponseCache
+
+
+def make_jobs(years, stations):
+    """
+    Return the (month, station_id) jobs of years of history of the stations
+    By: Ha Phuong Le
+    """
+    return [(datetime(year, month, 1), station_id)
+            for station_id in stations
+            for year, month in past_months(years * 12)]
+
+
+def ingest(directory, base_url, cache, session, jobs, stations, workers, processes):
+    """
+    Load the jobs into a new database and return the elapsed seconds and the
+    rows saved
+    By: Ha Phuong Le
+    """
+    path = os.path.join(directory, f"parse_{processes}.sqlite")
+    database = DBOperations(path)
+    database.initialize_db()
+    for station_id in stations:
+        database.add_station(station_id, f"Station {station_id}")
+
+    pipeline = IngestPipeline(database, base_url, cache, session, workers, parse_processes=processes)
+    start = time.perf_counter()
+    inserted, _ = pipeline.run(jobs=jobs)
+    elapsed = time.perf_counter() - start
+
+    with DBCM(path) as cur:
+        rows = cur.execute("select station_id, day, max_temp, min_temp, avg_temp "
+                           "from samples order by station_id, day").fetchall()
+    DBCM.close_all()
+    return elapsed, inserted, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=10, help="years of history of every station")
+    parser.add_argument("--stations", type=int, default=4, help="number of stations")
+    parser.add_argument("--workers", type=int, default=4, help="fetcher threads reading the cache")
+    parser.add_argument("--processes", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="parser processes of the runs, 0 parses on the parser thread")
+    args = parser.parse_args()
+
+    stations = [27174 + station for station in range(args.stations)]
+    jobs = make_jobs(args.years, stations)
+    first = past_months(args.years * 12)[-1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        session = HttpSession(rate=None, burst=args.workers)
+        with ReplayServer(first, LAST_MONTH) as server:
+            cache = ResponseCache(os.path.join(directory, "cache"), session=session)
+            warm = IngestPipeline(DBOperations(os.path.join(directory, "warm.sqlite")), server.url,
+                                  cache, session, args.workers)
+            warm.database.initialize_db()
+            warm.run(jobs=jobs)
+            DBCM.close_all()
+            base_url = server.url
+
+        # The server is gone: the pages of the same urls come from the cache only
+        print(f"{len(jobs)} pages of {len(stations)} stations, {os.cpu_count()} CPUs")
+        baseline = expected = None
+        for processes in args.processes:
+            cache = ResponseCache(os.path.join(directory, "cache"), session=session)
+            requests = session.stats()["requests"]
+            elapsed, inserted, rows = ingest(directory, base_url, cache, session, jobs, stations,
+                                             args.workers, processes)
+            assert session.stats()["requests"] == requests, "pages were downloaded again"
+            if expected is None:
+                expected = rows
+            assert rows == expected, f"processes={processes} saved other rows"
+
+            baseline = baseline or elapsed
+            print(f"processes={processes:<3} {elapsed:8.2f}s  {len(jobs) / elapsed:8.1f} pages/s  "
+                  f"{baseline / elapsed:5.2f}x  {inserted:7} rows")
+
+
+if __name__ == "__main__":
+    main()
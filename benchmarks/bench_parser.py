@@ -0,0 +1,57 @@
+"""
+Time parsing the fixture corpus of daily data pages with the current
+WeatherScraper against the original class, and check both read the same days.
+Run from the repository root: python -m benchmarks.bench_parser
+By: Ha Phuong Le
+"""
+import argparse
+import io
+import time
+from benchmarks import legacy_scraper
+from benchmarks.fixtures import corpus_pages
+from db_operations import day_text
+from scrape_weather import WeatherScraper
+
+
+def parse_legacy(month, page):
+    """
+    Parse a page the way the original load_data did
+    By: Ha Phuong Le
+    """
+    scraper = legacy_scraper.WeatherScraper(month)
+    scraper.feed(str(page))
+    return scraper.weather
+
+
+def parse_current(month, page):
+    """
+    Parse a page with the streaming parser, in the shape of the original to compare them
+    By: Ha Phuong Le
+    """
+    scraper = WeatherScraper(month)
+    return {day_text(record.day): {"Max": record.max, "Min": record.min, "Mean": record.mean}
+            for record in scraper.stream_records(io.BytesIO(page))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=120, help="number of sample pages")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    args = parser.parse_args()
+
+    pages = corpus_pages(args.pages)
+    results = {}
+    for label, parse in (("legacy", parse_legacy), ("current", parse_current)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[label] = [parse(month, page) for month, page in pages]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{label:<8} {best / len(pages) * 1000:7.3f} ms/page")
+
+    assert results["legacy"] == results["current"], "parsers disagree"
+
+
+if __name__ == "__main__":
+    main()
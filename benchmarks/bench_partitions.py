@@ -0,0 +1,128 @@
+"""
+Compare the single SQLite file with the layouts partitioned by station and
+by decade: ingest with a writer thread per station, range and aggregate
+queries over the whole history, and dropping a station or a decade. Every
+layout must answer the queries with the same rows.
+Run from the repository root: python -m benchmarks.bench_partitions
+By: Ha Phuong Le
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import time
+from benchmarks.fixtures import LAST_MONTH, make_months
+from db_operations import DBOperations
+from dbcm import DBCM
+from partitioned_db import PartitionedDB
+
+LAYOUTS = ("single", "station", "decade")
+
+
+def open_layout(directory, layout):
+    """
+    Return a new empty db of a layout in a directory
+    By: Ha Phuong Le
+    """
+    if layout == "single":
+        database = DBOperations(os.path.join(directory, "weather.sqlite"))
+    else:
+        database = PartitionedDB(os.path.join(directory, layout), layout)
+    database.initialize_db()
+    return database
+
+
+def ingest(database, histories):
+    """
+    Save the history of every station from a thread of its own, a year of
+    months per transaction, and return the elapsed seconds
+    By: Ha Phuong Le
+    """
+    def write(months):
+        for index in range(0, len(months), 12):
+            database.save_months(months[index:index + 12])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(histories)) as pool:
+        list(pool.map(write, histories))
+    return time.perf_counter() - start
+
+
+def timed(call, repeat):
+    """
+    Return the best elapsed seconds of repeat calls and the result of the last one
+    By: Ha Phuong Le
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def drop(database, layout, station_id, decade):
+    """
+    Remove the rows of a station, or of a decade for the decade layout, and
+    return the elapsed seconds
+    By: Ha Phuong Le
+    """
+    # Write back the logs of the ingest first, closing the files would otherwise do it
+    DBCM.close_all()
+
+    start = time.perf_counter()
+    if layout != "single":
+        database.drop_partition(database.key(station_id, decade))
+    else:
+        with DBCM(database.database) as cur:
+            cur.execute("delete from samples where station_id=?", (station_id,))
+            cur.execute("delete from monthly_stats where station_id=?", (station_id,))
+            database.bump_version(cur, rewritten=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=30, help="years of history of every station")
+    parser.add_argument("--stations", type=int, default=4, help="number of stations, one writer each")
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many query runs")
+    args = parser.parse_args()
+
+    stations = [27174 + station for station in range(args.stations)]
+    histories = [make_months(args.years, station_id=station_id) for station_id in stations]
+    first_year = LAST_MONTH[0] - args.years
+    start, end = f"{first_year}-01-01", f"{LAST_MONTH[0]}-12-31"
+    rows = sum(len(weather) for months in histories for _, weather in months)
+    print(f"{args.stations} stations, {args.years} years, {rows} rows, {os.cpu_count()} CPUs")
+    print(f"{'layout':<8} {'files':>5} {'ingest s':>9} {'range ms':>9} {'yearly ms':>10} "
+          f"{'box ms':>7} {'missing ms':>11} {'drop ms':>8}")
+
+    expected = None
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in LAYOUTS:
+            database = open_layout(directory, layout)
+            seconds = ingest(database, histories)
+
+            range_time, days = timed(lambda: [list(database.fetch_range(start, end, station_id))
+                                              for station_id in stations], args.repeat)
+            yearly_time, yearly = timed(lambda: [database.fetch_yearly_stats(first_year, LAST_MONTH[0], station_id)
+                                                 for station_id in stations], args.repeat)
+            box_time, _ = timed(lambda: [database.fetch_box_stats(first_year, LAST_MONTH[0], station_id)
+                                         for station_id in stations], args.repeat)
+            missing_time, missing = timed(lambda: [database.get_missing_months(LAST_MONTH, station_id)
+                                                   for station_id in stations], args.repeat)
+            results = (days, yearly, missing, database.check_stats())
+            if expected is None:
+                expected = results
+            assert results == expected, f"the {layout} layout answered other rows"
+
+            files = len(database.keys()) if layout != "single" else 1
+            drop_time = drop(database, layout, stations[0], first_year)
+            DBCM.close_all()
+            print(f"{layout:<8} {files:5} {seconds:9.2f} {range_time * 1000:9.1f} {yearly_time * 1000:10.2f} "
+                  f"{box_time * 1000:7.2f} {missing_time * 1000:11.2f} {drop_time * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Measure the memory the parsed days of a corpus of pages take in every output
+shape of WeatherScraper: the dict of a dict per day it used to fill, the list
+of DayRecords of parse_stream, the day and temperature arrays of
+parse_records and the records of stream_records consumed as they come. The
+results of all pages are held at once, as months waiting in the queues of
+the ingest pipeline are, and every shape must read the same days.
+Run from the repository root: python -m benchmarks.bench_records
+By: Ha Phuong Le
+"""
+import argparse
+import gc
+import io
+import sys
+import time
+import tracemalloc
+from benchmarks.fixtures import corpus_pages
+from db_operations import day_text
+from scrape_weather import WeatherScraper, month_rows, parse_records
+
+
+class DictScraper(WeatherScraper):
+    """
+    The scraper as it was: a dict of the page with a dict per day
+    By: Ha Phuong Le
+    """
+    def parse_stream(self, stream, charset="utf-8"):
+        """
+        Parse a page into a dict of 'YYYY-MM-DD' dates and {"Max", "Min", "Mean"} dicts
+        By: Ha Phuong Le
+        """
+        self.weather = {day_text(record.day): {"Max": record.max, "Min": record.min, "Mean": record.mean}
+                        for record in self.stream_records(stream, charset)}
+
+
+def parse_dicts(month, page):
+    """
+    Parse a page into the dict of dicts the scraper used to fill
+    By: Ha Phuong Le
+    """
+    scraper = DictScraper(month)
+    scraper.parse_stream(io.BytesIO(page))
+    return scraper.weather
+
+
+def parse_list(month, page):
+    """
+    Parse a page into a list of DayRecords
+    By: Ha Phuong Le
+    """
+    scraper = WeatherScraper(month)
+    scraper.parse_stream(io.BytesIO(page))
+    return scraper.weather
+
+
+def parse_arrays(month, page):
+    """
+    Parse a page into the day and temperature arrays of parse_records
+    By: Ha Phuong Le
+    """
+    return parse_records(page, month.year, month.month)[1:]
+
+
+def parse_streamed(month, page):
+    """
+    Parse a page handing out its DayRecords as they are parsed, and count them
+    By: Ha Phuong Le
+    """
+    # A consumer that writes every day as it comes keeps none of them
+    return sum(1 for _ in WeatherScraper(month).stream_records(io.BytesIO(page)))
+
+
+SHAPES = (("dicts", parse_dicts), ("records", parse_list), ("arrays", parse_arrays), ("streamed", parse_streamed))
+
+
+def days_of(label, month, result):
+    """
+    Return the (day, max, min, mean) tuples of a result, to compare the shapes
+    By: Ha Phuong Le
+    """
+    if label == "dicts":
+        return [(int(date.replace("-", "")), temps["Max"], temps["Min"], temps["Mean"])
+                for date, temps in result.items()]
+    if label == "arrays":
+        return [tuple(record) for record in month_rows(month.year, month.month, *result)]
+    return [tuple(record) for record in result]
+
+
+def traced(parse, pages):
+    """
+    Parse the pages holding every result and return the results with the
+    blocks and bytes left allocated and the peak of bytes allocated
+    By: Ha Phuong Le
+    """
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    base = tracemalloc.get_traced_memory()[0]
+    results = [parse(month, page) for month, page in pages]
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    return results, blocks, current - base, peak - base
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=120, help="number of sample pages")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many timed runs")
+    args = parser.parse_args()
+
+    pages = corpus_pages(args.pages)
+    expected = [days_of("records", month, parse_list(month, page)) for month, page in pages]
+    days = sum(len(page_days) for page_days in expected)
+    print(f"{len(pages)} pages, {days} days")
+    print(f"{'shape':<10} {'ms/page':>8} {'blocks/page':>12} {'bytes/day':>10} {'peak KiB':>9}")
+
+    for label, parse in SHAPES:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for month, page in pages:
+                parse(month, page)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results, blocks, size, peak = traced(parse, pages)
+        if label != "streamed":
+            assert [days_of(label, month, result) for (month, _), result in zip(pages, results)] == expected, \
+                f"{label} read other days"
+        else:
+            assert sum(results) == days, "streamed read other days"
+        del results
+
+        print(f"{label:<10} {best / len(pages) * 1000:8.3f} {blocks / len(pages):12.1f} "
+              f"{size / days:10.1f} {peak / 1024:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
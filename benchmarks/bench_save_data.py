@@ -0,0 +1,61 @@
+"""
+Compare the per-row insert path DBOperations.save_data used to take with the
+batched insert or ignore path, per month and for a whole download run.
+Run from the repository root: python -m benchmarks.bench_save_data
+By: Ha Phuong Le
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.fixtures import make_months
+from db_operations import DBOperations, day_number
+from dbcm import DBCM
+
+
+def save_per_row(database, mydict):
+    """
+    The original save_data: a lookup and a separate insert transaction for every day
+    By: Ha Phuong Le
+    """
+    sql = """insert or ignore into samples (station_id, day, max_temp, min_temp, avg_temp)
+    values (27174,?,?,?,?)"""
+    for day, temps in mydict.items():
+        if database.fetch_data(day) is None:
+            with DBCM(database.database) as cur:
+                cur.execute(sql, (day_number(day), temps['Max'], temps['Min'], temps['Mean']))
+
+
+def timed(label, months, save):
+    """
+    Run one insert strategy against a fresh database twice, the second time
+    with every row already stored, and print the timings
+    By: Ha Phuong Le
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = DBOperations(os.path.join(directory, "weather.sqlite"))
+        database.initialize_db()
+
+        for run in ("empty", "full"):
+            start = time.perf_counter()
+            save(database, months)
+            elapsed = time.perf_counter() - start
+            with DBCM(database.database) as cur:
+                rows = cur.execute("select count(*) from samples").fetchone()[0]
+            print(f"{label:<10} {run:<6} {elapsed:8.3f}s  {rows:6} rows")
+        DBCM.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=10, help="length of the saved history")
+    args = parser.parse_args()
+
+    months = make_months(args.years)
+    timed("per-row", months, lambda database, months: [save_per_row(database, month) for _, month in months])
+    timed("per-month", months, lambda database, months: [database.save_data(month) for _, month in months])
+    timed("whole-run", months, DBOperations.save_months)
+
+
+if __name__ == "__main__":
+    main()
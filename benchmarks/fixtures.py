@@ -0,0 +1,181 @@
+"""
+Record daily data pages and yearly bulk CSV files into a fixture corpus and
+build the synthetic databases the benchmarks run against.
+Record pages from the repository root:
+    python -m benchmarks.fixtures --months 24 [--years 2] [--station 27174] [--base-url URL]
+By: Ha Phuong Le
+"""
+import argparse
+import calendar
+import gzip
+import os
+from datetime import datetime
+from benchmarks.replay_server import month_page, month_temps
+from bulk_csv import BULK_URL, BulkCsvReader
+from db_operations import DBOperations
+from dbcm import DBCM
+from http_client import HttpSession
+from scrape_weather import BASE_URL, WeatherScraper
+
+# Recorded pages, as fixtures/<station_id>/<YYYY-MM>.html.gz, and bulk
+# CSV files, as fixtures/<station_id>/<YYYY>.csv.gz
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Latest month of the synthetic history
+LAST_MONTH = (2020, 11)
+
+
+def past_months(count, last=LAST_MONTH):
+    """
+    Return the (year, month) pairs of count months up to last, newest first
+    By: Ha Phuong Le
+    """
+    months = []
+    year, month = last
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+
+def record(months, station_id=27174, base_url=BASE_URL, directory=CORPUS_DIR, rate=1.0):
+    """
+    Download the pages of the months of a station into the corpus, politely
+    one request per second by default. Return the number of pages saved
+    By: Ha Phuong Le
+    """
+    session = HttpSession(rate=rate, burst=1)
+    os.makedirs(os.path.join(directory, str(station_id)), exist_ok=True)
+    saved = 0
+    for year, month in months:
+        url = WeatherScraper(datetime(year, month, 1), base_url, station_id=station_id).final_url
+        with session.open(url) as response:
+            body = response.read()
+        with gzip.open(os.path.join(directory, str(station_id), f"{year}-{month:02d}.html.gz"), "wb") as file:
+            file.write(body)
+        saved += 1
+    return saved
+
+
+def record_years(years, station_id=27174, bulk_url=BULK_URL, directory=CORPUS_DIR, rate=1.0):
+    """
+    Download the bulk CSV files of the years of a station into the corpus,
+    one request per second by default. Return the number of files saved
+    By: Ha Phuong Le
+    """
+    session = HttpSession(rate=rate, burst=1)
+    os.makedirs(os.path.join(directory, str(station_id)), exist_ok=True)
+    for year in years:
+        with session.open(BulkCsvReader(year, bulk_url, station_id=station_id).final_url) as response:
+            body = response.read()
+        with gzip.open(os.path.join(directory, str(station_id), f"{year}.csv.gz"), "wb") as file:
+            file.write(body)
+    return len(years)
+
+
+def load_csvs(directory=CORPUS_DIR):
+    """
+    Return the recorded bulk CSV files by (station_id, year)
+    By: Ha Phuong Le
+    """
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    for station in sorted(os.listdir(directory)):
+        if not station.isdigit():
+            continue
+        for name in sorted(os.listdir(os.path.join(directory, station))):
+            if name.endswith(".csv.gz"):
+                with gzip.open(os.path.join(directory, station, name), "rb") as file:
+                    files[int(station), int(name[:4])] = file.read()
+    return files
+
+
+def load_corpus(directory=CORPUS_DIR):
+    """
+    Return the recorded pages by (station_id, year, month)
+    By: Ha Phuong Le
+    """
+    pages = {}
+    if not os.path.isdir(directory):
+        return pages
+    for station in sorted(os.listdir(directory)):
+        if not station.isdigit():
+            continue
+        for name in sorted(os.listdir(os.path.join(directory, station))):
+            if name.endswith(".html.gz"):
+                year, month = name[:7].split("-")
+                with gzip.open(os.path.join(directory, station, name), "rb") as file:
+                    pages[int(station), int(year), int(month)] = file.read()
+    return pages
+
+
+def corpus_pages(count, station_id=27174, directory=CORPUS_DIR):
+    """
+    Return (month, page) pairs of count pages: the recorded pages of the
+    station if there are any, the synthetic pages of the replay server otherwise
+    By: Ha Phuong Le
+    """
+    recorded = sorted(((year, month), page) for (station, year, month), page in load_corpus(directory).items()
+                      if station == station_id)
+    if recorded:
+        pages = [(datetime(year, month, 1), page) for (year, month), page in reversed(recorded)]
+        return (pages * (count // len(pages) + 1))[:count]
+    return [(datetime(year, month, 1), month_page(year, month, station_id)) for year, month in past_months(count)]
+
+
+def make_months(years, last=LAST_MONTH, station_id=27174):
+    """
+    Build the (station_id, weather) months the scraper would return for a history, newest month first
+    By: Ha Phuong Le
+    """
+    months = []
+    for year, month in past_months(years * 12, last):
+        weather = {}
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            temps = month_temps(year, month, day, station_id)
+            if temps:
+                weather[f"{year}-{month:02d}-{day:02d}"] = dict(zip(("Max", "Min", "Mean"), temps))
+        months.append((station_id, weather))
+    return months
+
+
+def make_database(path, years, last=LAST_MONTH, stations=(27174,)):
+    """
+    Create a database holding a synthetic history of years up to last for
+    every station, the same data the replay server serves. Return its DBOperations
+    By: Ha Phuong Le
+    """
+    if os.path.exists(path):
+        DBCM.close_all()
+        os.remove(path)
+
+    database = DBOperations(path)
+    database.initialize_db()
+    for station_id in stations:
+        database.add_station(station_id, f"Station {station_id}")
+        database.save_months(make_months(years, last, station_id))
+    return database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--months", type=int, default=24, help="number of months up to the last one")
+    parser.add_argument("--last", default=f"{LAST_MONTH[0]}-{LAST_MONTH[1]:02d}", help="last month, YYYY-MM")
+    parser.add_argument("--years", type=int, default=0, help="number of yearly bulk CSV files up to the last one")
+    parser.add_argument("--station", type=int, default=27174)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--bulk-url", default=BULK_URL)
+    parser.add_argument("--directory", default=CORPUS_DIR)
+    args = parser.parse_args()
+
+    last = tuple(int(part) for part in args.last.split("-"))
+    saved = record(past_months(args.months, last), args.station, args.base_url, args.directory)
+    print(f"{saved} pages saved to {args.directory}")
+    if args.years:
+        saved = record_years(range(last[0] - args.years + 1, last[0] + 1), args.station, args.bulk_url, args.directory)
+        print(f"{saved} bulk CSV files saved to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Serve canned Environment Canada daily data pages and yearly bulk CSV files
+from a local HTTP server so the scraper and the bulk reader can be
+benchmarked without access to climate.weather.gc.ca.
+By: Ha Phuong Le
+"""
+import calendar
+import csv
+import io
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROW = """<tr>
+<th scope="row"><abbr title="{title}">{day:02d}</abbr></th>
+<td>{max_temp}</td>
+<td>{min_temp}</td>
+<td>{mean_temp}</td>
+<td>{heat}</td>
+<td>0.0</td>
+<td>0.0</td>
+<td>0.0</td>
+<td>0.0</td>
+<td>0</td>
+<td>&nbsp;</td>
+<td>&nbsp;</td>
+</tr>
+"""
+
+SUMMARY = """<tr>
+<th scope="row"><abbr title="{name}">{name}</abbr></th>
+<td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td>
+<td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td><td>&nbsp;</td>
+</tr>
+"""
+
+# The site menus that surround the data table on every page
+NAVIGATION = "".join(
+    f'<li class="wb-navcurr"><a href="/climate_data/topic-{topic}.html" title="Climate topic {topic}">'
+    f'Climate topic {topic}</a></li>\n' for topic in range(150))
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Daily Data Report for {month_name} {year} - Climate - Environment and Climate change Canada</title></head>
+<body>
+<header><nav id="wb-sm">
+{navigation}</nav></header>
+<main property="mainContentOfPage">
+<h1 id="wb-cont">Daily Data Report for {month_name} {year}</h1>
+<div class="table-responsive">
+<table class="table table-striped table-hover text-center table-condensed">
+<caption>Daily Data Report for {month_name} {year}</caption>
+<thead>
+<tr>
+<th scope="col">DAY</th>
+<th scope="col">Max Temp <abbr title="degrees Celsius">&deg;C</abbr></th>
+<th scope="col">Min Temp <abbr title="degrees Celsius">&deg;C</abbr></th>
+<th scope="col">Mean Temp <abbr title="degrees Celsius">&deg;C</abbr></th>
+<th scope="col">Heat Deg Days</th>
+<th scope="col">Cool Deg Days</th>
+<th scope="col">Total Rain mm</th>
+<th scope="col">Total Snow cm</th>
+<th scope="col">Total Precip mm</th>
+<th scope="col">Snow on Grnd cm</th>
+<th scope="col">Dir of Max Gust 10's deg</th>
+<th scope="col">Spd of Max Gust km/h</th>
+</tr>
+</thead>
+<tbody>
+{rows}</tbody>
+</table>
+</div>
+</main>
+<footer id="wb-info"><nav>
+{navigation}</nav></footer>
+</body>
+</html>
+"""
+
+
+def month_temps(year, month, day, station_id=27174):
+    """
+    Return deterministic (max, min, mean) temperatures for a day, or None for a missing day
+    By: Ha Phuong Le
+    """
+    seed = (station_id * 7919 + year * 372 + month * 31 + day) * 2654435761 % 4294967296
+    if seed % 29 == 0:
+        return None
+
+    season = -math.cos((month - 1 + (day - 1) / 31) / 12 * 2 * math.pi)
+    mean = round(3 + 20 * season + (seed % 100) / 10 - 5, 1)
+    spread = 4 + (seed >> 8) % 80 / 10
+    return round(mean + spread, 1), round(mean - spread, 1), mean
+
+
+def month_page(year, month, station_id=27174):
+    """
+    Render the daily data page of a month the way the Environment Canada site does
+    By: Ha Phuong Le
+    """
+    month_name = calendar.month_name[month]
+    rows = []
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        temps = month_temps(year, month, day, station_id)
+        max_temp, min_temp, mean_temp = temps if temps else ("M", "M", "M")
+        heat = round(max(0, 18 - mean_temp), 1) if temps else "M"
+        rows.append(ROW.format(title=f"{month_name} {day}, {year}", day=day,
+                               max_temp=max_temp, min_temp=min_temp,
+                               mean_temp=mean_temp, heat=heat))
+    for name in ("Sum", "Avg", "Xtrm"):
+        rows.append(SUMMARY.format(name=name))
+
+    return PAGE.format(month_name=month_name, year=year, rows="".join(rows),
+                       navigation=NAVIGATION).encode("utf-8")
+
+
+# Header of the yearly bulk CSV files of daily data
+CSV_HEADER = ("Longitude (x)", "Latitude (y)", "Station Name", "Climate ID", "Date/Time", "Year", "Month",
+              "Day", "Data Quality", "Max Temp (\u00b0C)", "Max Temp Flag", "Min Temp (\u00b0C)",
+              "Min Temp Flag", "Mean Temp (\u00b0C)", "Mean Temp Flag", "Heat Deg Days (\u00b0C)",
+              "Heat Deg Days Flag", "Total Precip (mm)", "Total Precip Flag")
+
+
+def year_csv(year, station_id=27174, first=(1, 1), last=(9999, 12)):
+    """
+    Render the bulk CSV file of daily data of a year the way the Environment
+    Canada site does: every day of the year, empty outside the months with data
+    By: Ha Phuong Le
+    """
+    text = io.StringIO()
+    writer = csv.writer(text, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+    writer.writerow(CSV_HEADER)
+    for month in range(1, 13):
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            temps = month_temps(year, month, day, station_id) if first <= (year, month) <= last else None
+            max_temp, min_temp, mean_temp = temps if temps else ("", "", "")
+            heat = round(max(0, 18 - mean_temp), 1) if temps else ""
+            writer.writerow(("-97.24", "49.92", "WINNIPEG RICHARDSON INT'L A", str(station_id),
+                             f"{year}-{month:02d}-{day:02d}", year, f"{month:02d}", f"{day:02d}", "",
+                             max_temp, "", min_temp, "", mean_temp, "", heat, "", "0.0" if temps else "", ""))
+    return "\ufeff".encode("utf-8") + text.getvalue().encode("utf-8")
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Answer daily data requests with a canned page for the requested month
+    By: Ha Phuong Le
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """
+        Serve the page of the requested month, or of the nearest month with data
+        By: Ha Phuong Le
+        """
+        server = self.server
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        bulk = parts.path.endswith("bulk_data_e.html")
+        try:
+            requested = (int(query["Year"][0]), int(query["Month"][0]))
+            station_id = int(query.get("stationID" if bulk else "StationID", ["27174"])[0])
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+
+        # The real site falls back to the closest month that has data, the
+        # bulk files cover the year asked for
+        year, month = requested if bulk else min(max(requested, server.first), server.last)
+
+        time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            failing = server.random.random() < server.failure_rate
+            if failing:
+                server.failures += 1
+
+        # A flaky upstream answers some requests with a busy error
+        if failing:
+            self.send_error(503)
+            return
+
+        # Pages never change, so the month identifies the version
+        etag = f'"{station_id}-{year}-{"csv" if bulk else f"{month:02d}"}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if bulk:
+            body = server.csvs.get((station_id, year)) or year_csv(year, station_id, server.first, server.last)
+        else:
+            body = server.pages.get((station_id, year, month)) or month_page(year, month, station_id)
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/csv; charset=utf-8" if bulk else "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """
+        Keep the benchmark output quiet
+        By: Ha Phuong Le
+        """
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the Environment Canada daily data pages and bulk CSV files
+    By: Ha Phuong Le
+    """
+    daemon_threads = True
+
+    def __init__(self, first=(1996, 10), last=(2020, 11), latency=0.0, failure_rate=0.0, pages=None,
+                 csvs=None):
+        """
+        Bind to a free local port and remember the range of months with data.
+        failure_rate is the share of requests answered with 503. pages are
+        recorded pages by (station_id, year, month) and csvs recorded bulk
+        files by (station_id, year), served instead of the synthetic ones
+        By: Ha Phuong Le
+        """
+        super().__init__(("127.0.0.1", 0), ReplayHandler)
+        self.pages = pages or {}
+        self.csvs = csvs or {}
+        self.first = first
+        self.last = last
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failures = 0
+        self.random = random.Random(0)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        Return the daily data url to hand to WeatherScraper
+        By: Ha Phuong Le
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/climate_data/daily_data_e.html"
+
+    @property
+    def bulk_url(self):
+        """
+        Return the bulk data url to hand to BulkCsvReader
+        By: Ha Phuong Le
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/climate_data/bulk_data_e.html"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,320 @@
+"""
+Run the benchmark suite: parsing the fixture corpus, saving months, the
+box and line plot data paths on synthetic databases of several history
+lengths, and get_fullset and update_weather end to end against the replay
+server. The results are saved as a JSON report that a later run can be
+compared with to catch regressions.
+Run from the repository root:
+    python -m benchmarks.suite --output report.json
+    python -m benchmarks.suite --compare report.json
+By: Ha Phuong Le
+"""
+import argparse
+import contextlib
+from datetime import datetime, timezone
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fixtures import LAST_MONTH, corpus_pages, load_corpus, make_database, make_months, past_months
+from benchmarks.replay_server import ReplayServer
+from db_operations import DBOperations
+from dbcm import DBCM
+from scrape_weather import WeatherScraper
+from weather_processor import WeatherProcessor
+
+# Version of the report layout
+REPORT_VERSION = 1
+
+# Groups of benchmarks, run in this order
+GROUPS = ("parse", "save_data", "plot_data", "get_fullset", "update_weather")
+
+
+def measure(run, repeat, setup=None):
+    """
+    Time run repeat times, calling setup untimed before each and passing
+    run what it returns, with garbage collection off like timeit. Runs
+    without setup are warmed up once first. run returns the number of items
+    it handled. What the code under test prints is dropped
+    By: Ha Phuong Le
+    """
+    times = []
+    items = 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        if setup is None:
+            run()
+
+        for _ in range(repeat):
+            state = setup() if setup else None
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                items = run(state) if setup else run()
+                times.append(time.perf_counter() - start)
+            finally:
+                gc.enable()
+
+    items = items or 1
+    return {"best": min(times), "median": statistics.median(times), "runs": len(times),
+            "items": items, "per_item": statistics.median(times) / items}
+
+
+class Suite:
+    """
+    Build the fixtures once and run the benchmarks against them
+    By: Ha Phuong Le
+    """
+    def __init__(self, directory, years, repeat, latency, fullset_years, workers):
+        """
+        Initialize the settings, the databases are built when first needed
+        By: Ha Phuong Le
+        """
+        self.directory = directory
+        self.years = years
+        self.repeat = repeat
+        self.latency = latency
+        self.fullset_years = fullset_years
+        self.workers = workers
+        self.today = datetime(*LAST_MONTH, 28)
+        self.databases = {}
+
+    def database(self, years, missing=0):
+        """
+        Return the path of a synthetic database of years of history that
+        stops missing months before the last month, creating it on first use
+        By: Ha Phuong Le
+        """
+        key = (years, missing)
+        if key not in self.databases:
+            path = os.path.join(self.directory, f"history_{years}y_{missing}m.sqlite")
+            last = past_months(missing + 1)[-1]
+            make_database(path, years, last)
+            DBCM.close_all()
+            self.databases[key] = path
+        return self.databases[key]
+
+    def copy(self, path):
+        """
+        Return a fresh copy of a database for one timed run
+        By: Ha Phuong Le
+        """
+        DBCM.close_all()
+        target = os.path.join(self.directory, "run.sqlite")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        shutil.copyfile(path, target)
+        return target
+
+    def processor(self, database, base_url=None):
+        """
+        Return a WeatherProcessor on a database, without page cache or rate
+        limit. Benchmarks that do not download leave base_url out
+        By: Ha Phuong Le
+        """
+        base_url = base_url or "http://127.0.0.1:9/"
+        processor = WeatherProcessor(database, workers=self.workers, base_url=base_url,
+                                     cache_dir=None, rate=None)
+        processor.today = self.today
+        return processor
+
+    def bench_parse(self):
+        """
+        Parse the fixture corpus with WeatherScraper, per page
+        By: Ha Phuong Le
+        """
+        pages = corpus_pages(120)
+
+        def run():
+            for month, page in pages:
+                WeatherScraper(month).parse_stream(io.BytesIO(page))
+            return len(pages)
+
+        yield "parse", measure(run, self.repeat)
+
+    def bench_save_data(self):
+        """
+        Save the last year of months one save_data call at a time into
+        databases holding the years before it, per month
+        By: Ha Phuong Le
+        """
+        months = make_months(1)
+        for years in self.years:
+            base = self.database(years, missing=12)
+
+            def run(database):
+                for station_id, weather in months:
+                    database.save_data(weather, station_id)
+                return len(months)
+
+            yield f"save_data[years={years}]", measure(run, self.repeat, lambda: DBOperations(self.copy(base)))
+
+    def bench_plot_data(self):
+        """
+        Gather the data of a box plot of the whole history, from the monthly
+        summaries and from the daily rows, and of a line plot of one month,
+        each from a cold start
+        By: Ha Phuong Le
+        """
+        first_year, last_year = LAST_MONTH[0] - max(self.years), LAST_MONTH[0]
+        for years in self.years:
+            processor = self.processor(self.database(years))
+
+            def box_stats():
+                processor.database.fetch_box_stats(first_year, last_year)
+
+            def box_data():
+                processor.datasets = {}
+                processor.boxplot_data(first_year, last_year)
+
+            def line_data():
+                processor.datasets = {}
+                processor.lineplot_data(datetime(LAST_MONTH[0] - 1, 7, 1))
+
+            yield f"boxplot_stats[years={years}]", measure(box_stats, self.repeat)
+            yield f"boxplot_data[years={years}]", measure(box_data, self.repeat)
+            yield f"lineplot_data[years={years}]", measure(line_data, self.repeat)
+            DBCM.close_all()
+
+    def bench_get_fullset(self):
+        """
+        Download the full history into an empty database end to end
+        By: Ha Phuong Le
+        """
+        first = past_months(self.fullset_years * 12)[-1]
+        with ReplayServer(first, LAST_MONTH, self.latency, pages=load_corpus()) as server:
+            def setup():
+                DBCM.close_all()
+                path = os.path.join(self.directory, "fullset.sqlite")
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                return self.processor(path, server.url)
+
+            def run(processor):
+                processor.get_fullset()
+                return self.fullset_years * 12
+
+            yield f"get_fullset[years={self.fullset_years}]", measure(run, max(1, self.repeat // 2), setup)
+
+    def bench_update_weather(self):
+        """
+        Download the last six months into databases missing them end to end
+        By: Ha Phuong Le
+        """
+        for years in self.years:
+            base = self.database(years, missing=6)
+            first = past_months(years * 12)[-1]
+            with ReplayServer(first, LAST_MONTH, self.latency, pages=load_corpus()) as server:
+                def run(processor):
+                    processor.update_weather()
+                    return 6
+
+                yield f"update_weather[years={years}]", measure(
+                    run, self.repeat, lambda: self.processor(self.copy(base), server.url))
+
+    def run(self, only=None):
+        """
+        Run the groups of benchmarks, all of them or those named in only, and
+        yield the name and measurement of every result
+        By: Ha Phuong Le
+        """
+        for group in GROUPS:
+            if not only or group in only:
+                yield from getattr(self, f"bench_{group}")()
+
+
+def git_commit():
+    """
+    Return the commit of the working tree, or None outside a git checkout
+    By: Ha Phuong Le
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """
+    Print the change of every result against a baseline report and return
+    the names that got slower by more than threshold
+    By: Ha Phuong Le
+    """
+    print(f"\nAgainst {baseline['meta'].get('commit')} of {baseline['meta'].get('created')}:")
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"  {name:<32} {'new':>8}")
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"  {name:<32} {old['median'] * 1000:10.2f} ms -> {result['median'] * 1000:10.2f} ms"
+              f"  {(ratio - 1) * 100:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 10, 30],
+                        help="history lengths of the synthetic databases")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of every benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the replay server waits per page")
+    parser.add_argument("--fullset-years", type=int, default=5, help="history length of the get_fullset run")
+    parser.add_argument("--workers", type=int, default=8, help="download workers")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, help="run these groups of benchmarks only")
+    parser.add_argument("--quick", action="store_true", help="small histories and few runs, to try the suite")
+    parser.add_argument("--output", help="save the report to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with an earlier report")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown of the median reported as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.years, args.repeat, args.fullset_years = [1, 5], 2, 1
+
+    report = {"version": REPORT_VERSION,
+              "meta": {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                       "commit": git_commit(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cpus": os.cpu_count(),
+                       "corpus_pages": len(load_corpus()),
+                       "settings": {"years": args.years, "repeat": args.repeat, "latency": args.latency,
+                                    "fullset_years": args.fullset_years, "workers": args.workers}},
+              "results": {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        suite = Suite(directory, args.years, args.repeat, args.latency, args.fullset_years, args.workers)
+        for name, result in suite.run(args.only):
+            report["results"][name] = result
+            print(f"{name:<32} median {result['median'] * 1000:10.2f} ms  best {result['best'] * 1000:10.2f} ms"
+                  f"  {result['per_item'] * 1000:8.3f} ms/item", flush=True)
+        DBCM.close_all()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Create a class to read the yearly bulk CSV files of daily data of a station from the Environment Canada website.
+By: Ha Phuong Le
+"""
+import csv
+import io
+import logging
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from metrics import METRICS
+from scrape_weather import DayRecord
+
+BULK_URL = "https://climate.weather.gc.ca/climate_data/bulk_data_e.html"
+
+# Columns read from a file, found by the start of their header
+FIELDS = ("Date/Time", "Max Temp", "Min Temp", "Mean Temp")
+
+class BulkCsvReader:
+    """
+    Download the daily data of a station for a whole year as one CSV file,
+    twelve times fewer requests than the monthly pages, and read it row by
+    row without HTML parsing
+    By: Ha Phuong Le
+    """
+    def __init__(self, year, base_url=BULK_URL, cache=None, station_id=27174, session=None):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        try:
+            self.year = year
+            self.station_id = station_id
+            self.cache = cache
+            self.session = session
+
+            # Number of days read with all three temperatures
+            self.rows = 0
+
+            values = {"format": "csv", "stationID": station_id, "Year": year, "Month": 1, "Day": 1,
+                      "timeframe": 2, "submit": "Download Data"}
+            self.final_url = f"{base_url}?{urllib.parse.urlencode(values)}"
+
+            # Files of years before the current one no longer change
+            self.closed = year < datetime.now().year
+        except Exception as exception:
+            logging.error(f"BulkCsvReader:__init__: {exception}")
+
+    @property
+    def available(self):
+        """
+        Return whether the file had any day with data
+        By: Ha Phuong Le
+        """
+        return self.rows > 0
+
+    def open(self):
+        """
+        Return the file as a binary stream: the file of the cache on disk, or
+        straight from the response of the session or of urllib
+        By: Ha Phuong Le
+        """
+        if self.cache is not None:
+            with METRICS.timer("scrape_fetch_seconds", source="cache"):
+                return self.cache.open(self.final_url, self.closed)[0]
+        if self.session is not None:
+            return self.session.open(self.final_url)
+        return urllib.request.urlopen(self.final_url)
+
+    @staticmethod
+    def columns(header):
+        """
+        Return the positions of the date and the max, min and mean temperatures in a header
+        By: Ha Phuong Le
+        """
+        positions = []
+        for field in FIELDS:
+            matches = [index for index, name in enumerate(header)
+                       if name.startswith(field) and "Flag" not in name]
+            if not matches:
+                raise ValueError(f"no {field} column in the file")
+            positions.append(matches[0])
+        return positions
+
+    def read_months(self, stream):
+        """
+        Yield (month, records) for every month of the file with data as soon
+        as its last day is read, the records being DayRecords.
+        The stream is decoded and parsed as it is read, never held whole
+        By: Ha Phuong Le
+        """
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        try:
+            reader = csv.reader(text)
+            header = next(reader, None)
+            if header is None:
+                return
+            date_column, max_column, min_column, mean_column = self.columns(header)
+
+            month, rows = None, []
+            for record in reader:
+                try:
+                    date = record[date_column]
+                    row = DayRecord(int(date[:4]) * 10000 + int(date[5:7]) * 100 + int(date[8:10]),
+                                    float(record[max_column]), float(record[min_column]),
+                                    float(record[mean_column]))
+                except (IndexError, ValueError):
+                    # Days with missing data are left out
+                    continue
+
+                day_month = row.day // 100 % 100
+                if day_month != month:
+                    if rows:
+                        yield month, rows
+                    month, rows = day_month, []
+                rows.append(row)
+                self.rows += 1
+
+            if rows:
+                yield month, rows
+        finally:
+            # The response stays open for the session to finish reading it
+            text.detach()
+            METRICS.count("rows_parsed_total", self.rows)
@@ -0,0 +1,140 @@
+"""
+Create a class to render many charts to files at once on a pool of processes.
+By: Nguyen Anh Thu Mai
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import logging
+import os
+from db_operations import DBOperations, DEFAULT_STATION
+from plot_operations import PlotOperations
+from weather_dataset import WeatherDataset
+from weather_snapshot import WeatherSnapshot, load_snapshot
+
+# Data of the worker process, set once when it starts
+_dataset = None
+_plot = None
+
+def _start_worker(dates, max_temps, min_temps, mean_temps, snapshot=None):
+    """
+    Keep the dataset of the batch in a worker process so the tasks only carry
+    chart names. With a snapshot file the worker maps it instead, sharing its
+    pages with the other workers
+    By: Nguyen Anh Thu Mai
+    """
+    global _dataset, _plot
+    if snapshot:
+        _dataset = load_snapshot(snapshot)
+    else:
+        _dataset = WeatherDataset(dates, max_temps, min_temps, mean_temps)
+    _plot = PlotOperations()
+
+def _render(task):
+    """
+    Render a chart task and return its file and render time, or None if it failed
+    By: Nguyen Anh Thu Mai
+    """
+    kind, output, args = task
+    try:
+        if kind == "box":
+            stats, from_year, to_year = args
+            return output, _plot.render_box_stats(stats, from_year, to_year, output)
+
+        year, month, title = args
+        days = _dataset.month(year, month)
+        return output, _plot.render_line_plot(days.days, days.mean, title, output)
+    except Exception as exception:
+        logging.error(f"ChartBatch:_render: {output} {exception}")
+        return output, None
+
+class ChartBatch:
+    """
+    Render box plots of year ranges and line plots of months of a station to
+    image files. The data is read from the db once and handed to every
+    worker process when it starts, or mapped by every worker from the
+    snapshot of the station, then the charts are drawn in parallel
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, database="weather.sqlite", output_dir=".", image_format="png",
+                 jobs=None, station_id=DEFAULT_STATION, snapshot_dir=None):
+        """
+        Initialize the attributes. jobs is the number of processes, all CPUs
+        by default. snapshot_dir holds the snapshots to read the days from
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            self.database = DBOperations(database) if isinstance(database, str) else database
+            self.output_dir = output_dir
+            self.image_format = image_format
+            self.jobs = max(1, jobs or os.cpu_count() or 1)
+            self.station_id = station_id
+            self.snapshot_dir = snapshot_dir
+            self.tasks = []
+        except Exception as exception:
+            logging.error(f"ChartBatch:__init__: {exception}")
+
+    def path(self, kind, name):
+        """
+        Return the file a chart is saved to
+        By: Nguyen Anh Thu Mai
+        """
+        return os.path.join(self.output_dir, f"{kind}_{self.station_id}_{name}.{self.image_format}")
+
+    def add_boxplot(self, from_year, to_year):
+        """
+        Queue a box plot of a range of years, from the monthly summaries in db
+        By: Nguyen Anh Thu Mai
+        """
+        stats = self.database.fetch_box_stats(from_year, to_year, self.station_id)
+        self.tasks.append(("box", self.path("boxplot", f"{from_year}_{to_year}"), (stats, from_year, to_year)))
+
+    def add_lineplot(self, year, month):
+        """
+        Queue a line plot of a month
+        By: Nguyen Anh Thu Mai
+        """
+        title = datetime(year, month, 1).strftime("%B, %Y")
+        self.tasks.append(("line", self.path("lineplot", f"{year}_{month:02d}"), (year, month, title)))
+
+    def add_lineplots(self, from_year, to_year):
+        """
+        Queue a line plot of every month of a range of years
+        By: Nguyen Anh Thu Mai
+        """
+        for year in range(from_year, to_year + 1):
+            for month in range(1, 13):
+                self.add_lineplot(year, month)
+
+    def run(self):
+        """
+        Render the queued charts and yield the file and render time in seconds
+        of each as it is done, None for a chart that failed
+        By: Nguyen Anh Thu Mai
+        """
+        tasks, self.tasks = self.tasks, []
+        if not tasks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # Line plots read the daily data, loaded once for the whole batch
+        years = [args[0] for kind, _, args in tasks if kind == "line"]
+        initargs = ((), (), (), ())
+        if years and self.snapshot_dir:
+            snapshot = WeatherSnapshot(self.snapshot_dir, self.database)
+            snapshot.refresh(self.station_id)
+            initargs = ((), (), (), (), snapshot.path(self.station_id))
+        elif years:
+            dataset = WeatherDataset.from_database(self.database, f"{min(years):04d}-01-01",
+                                                   f"{max(years):04d}-12-31", self.station_id)
+            initargs = (dataset.dates, dataset.max, dataset.min, dataset.mean)
+
+        jobs = min(self.jobs, len(tasks))
+        if jobs == 1:
+            _start_worker(*initargs)
+            for task in tasks:
+                yield _render(task)
+            return
+
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_start_worker, initargs=initargs) as executor:
+            for future in as_completed([executor.submit(_render, task) for task in tasks]):
+                yield future.result()
@@ -2,8 +2,95 @@
 Create a db_operations.py module with a DBOperations class inside
 By: Ha Phuong Le & Nguyen Anh Thu Mai
 """
+from bisect import bisect_right
+import calendar
+from collections import Counter
+from itertools import accumulate, groupby
+import json
 import logging
+import math
+import time
 from dbcm import DBCM
+from metrics import METRICS
+
+# The station scraped when none is given, Winnipeg Richardson International Airport
+DEFAULT_STATION = 27174
+DEFAULT_LOCATION = 'Winnipeg, MB'
+
+# The stations and their names
+STATIONS_TABLE = """create table if not exists stations
+                (station_id integer primary key not null,
+                name text not null);"""
+
+# The daily samples, also used for the shadow table a full download fills.
+# A day is the integer YYYYMMDD and the rows are stored in (station_id, day)
+# order, so range scans and latest-day lookups walk a single integer B-tree
+SAMPLES_TABLE = """create table if not exists {table}
+                (station_id integer not null references stations,
+                day integer not null,
+                max_temp real not null,
+                min_temp real not null,
+                avg_temp real not null,
+                primary key (station_id, day)) without rowid;"""
+
+# SQL turning the day of a row back into 'YYYY-MM-DD' text
+DAY_TEXT = "printf('%04d-%02d-%02d', day / 10000, day / 100 % 100, day % 100)"
+
+def day_number(text):
+    """
+    Return the YYYYMMDD day number of a 'YYYY-MM-DD' date. The month and the
+    day may lack their leading zero, as in rows saved by older versions
+    By: Ha Phuong Le
+    """
+    year, month, day = text.split("-")
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+def day_text(number):
+    """
+    Return the 'YYYY-MM-DD' date of a YYYYMMDD day number
+    By: Ha Phuong Le
+    """
+    return f"{number // 10000:04d}-{number // 100 % 100:02d}-{number % 100:02d}"
+
+def summarize(temps):
+    """
+    Return the count, sum, sum of squares, min, max and sketch of a month of
+    mean temperatures. The sketch counts every temperature in tenths of a
+    degree, the precision of the website, so it merges without losing anything
+    By: Ha Phuong Le
+    """
+    sketch = Counter(round(temp * 10) for temp in temps)
+    return (len(temps), math.fsum(temps), math.fsum(temp * temp for temp in temps),
+            min(temps), max(temps), json.dumps(sketch, sort_keys=True))
+
+def box_stats(sketch, label):
+    """
+    Return the box plot statistics matplotlib's bxp takes from a merged sketch
+    By: Nguyen Anh Thu Mai
+    """
+    values = sorted(sketch)
+    counts = list(accumulate(sketch[value] for value in values))
+    total = counts[-1] if counts else 0
+
+    def quantile(q):
+        # Linear interpolation between the closest ranks, like numpy.percentile
+        position = q * (total - 1)
+        lower = values[bisect_right(counts, math.floor(position))] / 10
+        upper = values[bisect_right(counts, math.ceil(position))] / 10
+        return lower + (upper - lower) * (position - math.floor(position))
+
+    if not total:
+        nan = float("nan")
+        return {"label": label, "med": nan, "q1": nan, "q3": nan, "whislo": nan, "whishi": nan, "fliers": []}
+
+    q1, med, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = [value / 10 for value in values if low <= value / 10 <= high]
+    fliers = [value / 10 for value in values for _ in range(sketch[value]) if not low <= value / 10 <= high]
+    return {"label": label, "med": med, "q1": q1, "q3": q3,
+            "whislo": inside[0] if inside else q1, "whishi": inside[-1] if inside else q3,
+            "fliers": fliers,
+            "mean": math.fsum(value / 10 * sketch[value] for value in values) / total}
 
 class DBOperations():
     """
@@ -20,14 +107,15 @@ class DBOperations():
         except Exception as exception:
             logging.error(f"WeatherScraper:__init__:{exception}")
 
-    def fetch_data(self, date):
+    def fetch_data(self, date, station_id=DEFAULT_STATION):
         """
         Fetch data from the database as requested by the user input
         By: Ha Phuong Le
         """
         try:
             with DBCM(self.database) as cur:
-                for row in cur.execute("select avg_temp from samples where sample_date=?", (date,)):
+                for row in cur.execute("select avg_temp from samples where station_id=? and day=?",
+                                       (station_id, day_number(date))):
                     try:
                         return row[0]
                     except Exception as exception:
@@ -35,27 +123,269 @@ class DBOperations():
         except Exception as exception:
             logging.error(f"DBOperations:fetch_data:{exception}")
 
-    def save_data(self, mydict):
+    def fetch_range(self, start, end, station_id=DEFAULT_STATION):
+        """
+        Stream the (sample_date, max_temp, min_temp, avg_temp) rows of a station
+        between two dates, both included, in date order with a single indexed
+        query. Errors are raised, so a stream cut short never looks complete
+        By: Ha Phuong Le
+        """
+        with DBCM(self.database) as cur:
+            yield from cur.execute(f"""select {DAY_TEXT}, max_temp, min_temp, avg_temp
+                                   from samples where station_id=? and day between ? and ?
+                                   order by day""", (station_id, day_number(start), day_number(end)))
+
+    def fetch_columns(self, start, end, station_id=DEFAULT_STATION):
+        """
+        Return the rows of a station between two dates as columns of dates, max, min and mean temperatures
+        By: Ha Phuong Le
+        """
+        columns = {"date": [], "max": [], "min": [], "mean": []}
+        try:
+            rows = list(self.fetch_range(start, end, station_id))
+            if rows:
+                columns = dict(zip(columns, map(list, zip(*rows))))
+        except Exception as exception:
+            logging.error(f"DBOperations:fetch_columns:{exception}")
+        return columns
+
+    def fetch_days(self, station_id=DEFAULT_STATION, after=0):
+        """
+        Return the (day, max_temp, min_temp, avg_temp) rows of a station after
+        a YYYYMMDD day in day order, with the days as numbers
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                return cur.execute("""select day, max_temp, min_temp, avg_temp from samples
+                                   where station_id=? and day > ? order by day""", (station_id, after)).fetchall()
+        except Exception as exception:
+            logging.error(f"DBOperations:fetch_days:{exception}")
+            return []
+
+    def count_days(self, station_id=DEFAULT_STATION, until=99991231):
+        """
+        Return the number of days of a station up to a YYYYMMDD day
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                return cur.execute("select count(*) from samples where station_id=? and day <= ?",
+                                   (station_id, until)).fetchone()[0]
+        except Exception as exception:
+            logging.error(f"DBOperations:count_days:{exception}")
+            return 0
+
+    def save_data(self, mydict, station_id=DEFAULT_STATION):
+        """
+        Store data into the existed db and return the number of rows inserted
+        and skipped, or None if nothing was saved
+        By: Ha Phuong Le
+        """
+        return self.save_months([(station_id, mydict)])
+
+    def save_months(self, months, checkpoints=None):
         """
-        Store data into the existed db
+        Store several (station_id, weather) months in one transaction, from one
+        or many stations. weather is a dict of days as save_data takes or an
+        iterable of (day, max, min, mean) records with YYYYMMDD day numbers,
+        as the scrapers yield. Days that are already stored are skipped by the
+        (station_id, day) primary key. With checkpoints the months
+        belong to a full download: they go to the shadow table and the
+        (station_id, year, month) checkpoints are recorded in the same transaction.
+        Return the number of rows inserted and skipped, or None if nothing was saved
         By: Ha Phuong Le
         """
         try:
-            sql = """insert into samples (sample_date, location, max_temp, min_temp, avg_temp)
+            start = time.perf_counter()
+            table = "samples" if checkpoints is None else "samples_rebuild"
+            sql = f"""insert or ignore into {table} (station_id, day, max_temp, min_temp, avg_temp)
             values (?,?,?,?,?)"""
-            for day, temps in mydict.items():
-                try:
-                    avg_temp = self.fetch_data(day)
 
-                    if avg_temp is None:
-                        data = (day, 'Winnipeg, MB', temps['Max'], temps['Min'], temps['Mean'])
+            with DBCM(self.database) as cur:
+                rows = []
+                for station_id, mydict in months:
+                    if isinstance(mydict, dict):
+                        # Days with a missing temperature are left out
+                        rows.extend((station_id, day_number(day), temps['Max'], temps['Min'], temps['Mean'])
+                                    for day, temps in mydict.items()
+                                    if {'Max', 'Min', 'Mean'} <= temps.keys())
+                    else:
+                        rows.extend((station_id, day, max_temp, min_temp, avg_temp)
+                                    for day, max_temp, min_temp, avg_temp in mydict)
+
+                cur.executemany(sql, rows)
+                inserted = max(cur.rowcount, 0)
+
+                if checkpoints is not None:
+                    cur.executemany("insert or ignore into crawl_checkpoints values (?,?,?)", checkpoints)
+                # Keep the monthly summaries in step within the same transaction
+                elif inserted:
+                    self.refresh_stats(cur, {(row[0], row[1] // 100) for row in rows})
+                    self.bump_version(cur)
+
+            METRICS.observe("db_save_seconds", time.perf_counter() - start)
+            METRICS.count("rows_inserted_total", inserted)
+            METRICS.count("rows_skipped_total", len(rows) - inserted)
+            return inserted, len(rows) - inserted
+        except Exception as exception:
+            logging.error(f"DBOperations:save_months:{exception}")
+            return None
+
+    def refresh_stats(self, cur, months):
+        """
+        Recompute the summaries of the given (station_id, YYYYMM) months from samples
+        By: Ha Phuong Le
+        """
+        for station_id, month in months:
+            temps = [row[0] for row in cur.execute(
+                """select avg_temp from samples
+                where station_id=? and day between ? and ?""",
+                (station_id, month * 100 + 1, month * 100 + 31))]
+
+            if temps:
+                cur.execute("insert or replace into monthly_stats values (?,?,?,?,?,?,?,?,?)",
+                            (station_id, month // 100, month % 100) + summarize(temps))
+            else:
+                cur.execute("delete from monthly_stats where station_id=? and year=? and month=?",
+                            (station_id, month // 100, month % 100))
+
+    def compute_stats(self, cur):
+        """
+        Yield the summary row of every month in samples, computed in one pass
+        By: Ha Phuong Le
+        """
+        rows = cur.execute("""select station_id, day / 100, avg_temp
+                           from samples order by station_id, day""")
+        for (station_id, month), group in groupby(rows, key=lambda row: row[:2]):
+            yield (station_id, month // 100, month % 100) + summarize([row[2] for row in group])
+
+    def rebuild_stats(self):
+        """
+        Rebuild the monthly summaries from samples in one pass
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                self.write_stats(cur)
+        except Exception as exception:
+            logging.error(f"DBOperations:rebuild_stats:{exception}")
+
+    def write_stats(self, cur):
+        """
+        Replace the monthly summaries with the ones of samples in the
+        transaction of cur. Errors are raised for the caller to roll back
+        By: Ha Phuong Le
+        """
+        cur.execute("delete from monthly_stats")
+        stats = list(self.compute_stats(cur))
+        cur.executemany("insert into monthly_stats values (?,?,?,?,?,?,?,?,?)", stats)
+
+    def check_stats(self):
+        """
+        Return the (station_id, year, month) summaries that disagree with samples
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                expected = {row[:3]: row[3:] for row in self.compute_stats(cur)}
+                stored = {row[:3]: row[3:] for row in cur.execute("select * from monthly_stats")}
+
+            def same(first, second):
+                return (first[0] == second[0] and first[5] == second[5]
+                        and all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(first[1:5], second[1:5])))
+
+            return sorted(key for key in expected.keys() | stored.keys()
+                          if key not in expected or key not in stored or not same(expected[key], stored[key]))
+        except Exception as exception:
+            logging.error(f"DBOperations:check_stats:{exception}")
+
+    def fetch_box_stats(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return the box plot statistics of every month of the year over a range
+        of years at a station, merged from the monthly summaries
+        By: Nguyen Anh Thu Mai
+        """
+        sketches = self.fetch_sketches(from_year, to_year, station_id)
+        return [box_stats(sketch, month) for month, sketch in sketches.items()]
+
+    def fetch_sketches(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return the sketches of the mean temperatures of every month of the
+        year over a range of years at a station, merged from the monthly summaries
+        By: Nguyen Anh Thu Mai
+        """
+        sketches = {month: Counter() for month in range(1, 13)}
+        try:
+            with DBCM(self.database) as cur:
+                for month, sketch in cur.execute("""select month, sketch from monthly_stats
+                                                 where station_id=? and year between ? and ?""",
+                                                 (station_id, from_year, to_year)):
+                    sketches[month].update({int(value): count for value, count in json.loads(sketch).items()})
+        except Exception as exception:
+            logging.error(f"DBOperations:fetch_sketches:{exception}")
+        return sketches
+
+    def fetch_yearly_stats(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return (year, days, mean, min, max, standard deviation) of the mean
+        temperatures of every year in a range at a station, from the monthly summaries
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                rows = cur.execute("""select year, sum(count), sum(sum), sum(sum_squares), min(min), max(max)
+                                   from monthly_stats where station_id=? and year between ? and ?
+                                   group by year order by year""", (station_id, from_year, to_year)).fetchall()
+
+            return [(year, count, total / count, low, high, math.sqrt(max(squares / count - (total / count) ** 2, 0)))
+                    for year, count, total, squares, low, high in rows]
+        except Exception as exception:
+            logging.error(f"DBOperations:fetch_yearly_stats:{exception}")
+            return []
+
+    def fetch_monthly_stats(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return (year, month, days, mean, min, max, standard deviation) of the
+        mean temperatures of every month in a range of years at a station, from the monthly summaries
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                rows = cur.execute("""select year, month, count, sum, sum_squares, min, max
+                                   from monthly_stats where station_id=? and year between ? and ?
+                                   order by year, month""", (station_id, from_year, to_year)).fetchall()
+
+            return [(year, month, count, total / count, low, high,
+                     math.sqrt(max(squares / count - (total / count) ** 2, 0)))
+                    for year, month, count, total, squares, low, high in rows]
+        except Exception as exception:
+            logging.error(f"DBOperations:fetch_monthly_stats:{exception}")
+            return []
+
+    def bump_version(self, cur, rewritten=False):
+        """
+        Count a change to the data in the transaction of cur, so caches of query
+        results know they are stale. rewritten counts a change that may have
+        replaced stored days rather than only added new ones
+        By: Ha Phuong Le
+        """
+        cur.execute("update meta set value=value+1 where key='data_version'")
+        if rewritten:
+            cur.execute("update meta set value=value+1 where key='rewrite_version'")
 
-                        with DBCM(self.database) as cur:
-                            cur.execute(sql, data)
-                except Exception as exception:
-                    logging.error(f"DBOperations:save_data:loop:{exception}")
+    def get_data_version(self, key="data_version"):
+        """
+        Return the number of changes made to the data so far, or with key
+        rewrite_version the number of changes that replaced stored days
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                row = cur.execute("select value from meta where key=?", (key,)).fetchone()
+                return row[0] if row else 0
         except Exception as exception:
-            logging.error(f"DBOperations:save_data:{exception}")
+            logging.error(f"DBOperations:get_data_version:{exception}")
 
     def initialize_db(self):
         """
@@ -64,16 +394,165 @@ class DBOperations():
         """
         try:
             with DBCM(self.database) as cur:
-                cur.execute("""create table if not exists samples
-                            (id integer primary key autoincrement not null,
-                            sample_date text not null,
-                            location text not null,
-                            max_temp real not null,
-                            min_temp real not null,
-                            avg_temp real not null);""")
+                cur.execute(STATIONS_TABLE)
+                cur.execute("insert or ignore into stations values (?,?)", (DEFAULT_STATION, DEFAULT_LOCATION))
+
+                # Databases keyed by date text are converted to integer days
+                columns = [row[1] for row in cur.execute("pragma table_info(samples)")]
+                if columns and "day" not in columns:
+                    self.migrate_samples(cur)
+                cur.execute(SAMPLES_TABLE.format(table="samples"))
+
+                # Summaries of the mean temperatures of every month, rebuilt
+                # from samples when they were made before stations existed
+                columns = [row[1] for row in cur.execute("pragma table_info(monthly_stats)")]
+                if columns and "station_id" not in columns:
+                    cur.execute("drop table monthly_stats")
+                cur.execute("""create table if not exists monthly_stats
+                            (station_id integer not null,
+                            year integer not null,
+                            month integer not null,
+                            count integer not null,
+                            sum real not null,
+                            sum_squares real not null,
+                            min real not null,
+                            max real not null,
+                            sketch text not null,
+                            primary key (station_id, year, month));""")
+
+                # Counters of the db, data_version goes up with every write to
+                # samples and rewrite_version with every one that replaced days
+                cur.execute("""create table if not exists meta
+                            (key text primary key not null,
+                            value integer not null);""")
+                cur.execute("insert or ignore into meta values ('data_version', 0)")
+                cur.execute("insert or ignore into meta values ('rewrite_version', 0)")
+
+                # Months a full download has finished, written with their rows
+                cur.execute("""create table if not exists crawl_checkpoints
+                            (station_id integer not null,
+                            year integer not null,
+                            month integer not null,
+                            primary key (station_id, year, month));""")
+
+                # Databases filled before the summaries existed get them now
+                if (cur.execute("select 1 from samples limit 1").fetchone()
+                        and not cur.execute("select 1 from monthly_stats limit 1").fetchone()):
+                    self.rebuild_stats()
         except Exception as exception:
             logging.error(f"DBOperations:initialize_db:{exception}")
 
+    def migrate_samples(self, cur):
+        """
+        Convert a samples table keyed by 'YYYY-MM-DD' text to integer days in
+        one pass, in a single transaction so readers keep seeing the old table
+        until it commits. The station names stored on every row move to
+        stations, rows whose date cannot be read or that repeat a day are
+        dropped, and the summaries and any unfinished full download are cleared
+        to be rebuilt. Return the number of rows converted and dropped
+        By: Ha Phuong Le
+        """
+        def convert(text):
+            try:
+                return day_number(text)
+            except (AttributeError, ValueError):
+                return None
+
+        if not cur.connection.in_transaction:
+            cur.execute("begin immediate")
+
+        # Databases created before stations existed hold the default station only
+        columns = [row[1] for row in cur.execute("pragma table_info(samples)")]
+        station = "station_id" if "station_id" in columns else str(DEFAULT_STATION)
+        if "location" in columns:
+            cur.execute(STATIONS_TABLE)
+            cur.execute(f"insert or ignore into stations select distinct {station}, location from samples")
+
+        cur.connection.create_function("day_number", 1, convert, deterministic=True)
+        total = cur.execute("select count(*) from samples").fetchone()[0]
+        cur.execute("drop table if exists samples_migrated")
+        cur.execute(SAMPLES_TABLE.format(table="samples_migrated"))
+        cur.execute(f"""insert or ignore into samples_migrated
+                    select {station}, day_number(sample_date), max_temp, min_temp, avg_temp
+                    from samples order by 1, 2""")
+        converted = max(cur.rowcount, 0)
+
+        cur.execute("drop table samples")
+        cur.execute("alter table samples_migrated rename to samples")
+        cur.execute("drop table if exists samples_rebuild")
+        cur.execute("drop table if exists crawl_checkpoints")
+        cur.execute("drop table if exists monthly_stats")
+        return converted, total - converted
+
+    def migrate(self, vacuum=True):
+        """
+        Convert the db to integer days now rather than on its next use, and
+        vacuum it to give the space of the old table back. Return the number
+        of rows converted and dropped, or None when it was already converted
+        By: Ha Phuong Le
+        """
+        counts = None
+        with DBCM(self.database) as cur:
+            columns = [row[1] for row in cur.execute("pragma table_info(samples)")]
+            if columns and "day" not in columns:
+                counts = self.migrate_samples(cur)
+
+        self.initialize_db()
+        if vacuum:
+            with DBCM(self.database) as cur:
+                cur.execute("vacuum")
+                cur.execute("pragma wal_checkpoint(truncate)")
+        return counts
+
+    def begin_rebuild(self):
+        """
+        Start a full download into the shadow table samples_rebuild, or resume
+        the one in progress. Return the (station_id, year, month) months it has finished
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                resuming = cur.execute("""select 1 from sqlite_master
+                                       where type='table' and name='samples_rebuild'""").fetchone()
+                if not resuming:
+                    cur.execute("delete from crawl_checkpoints")
+                    cur.execute(SAMPLES_TABLE.format(table="samples_rebuild"))
+
+                return set(cur.execute("select station_id, year, month from crawl_checkpoints"))
+        except Exception as exception:
+            logging.error(f"DBOperations:begin_rebuild:{exception}")
+            return set()
+
+    def finish_rebuild(self, stations=None):
+        """
+        Swap the finished shadow table in for samples and rebuild the summaries,
+        in one transaction so readers never see a half-filled samples table.
+        If stations are given only their rows are replaced, the rows of other
+        stations are carried over to the new table. Return whether the swap
+        was committed, after a failure nothing is changed
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                if not cur.connection.in_transaction:
+                    cur.execute("begin immediate")
+
+                if stations is not None:
+                    stations = tuple(stations)
+                    others = f"station_id not in ({','.join('?' * len(stations))})"
+                    cur.execute(f"delete from samples_rebuild where {others}", stations)
+                    cur.execute(f"insert into samples_rebuild select * from samples where {others}", stations)
+
+                cur.execute("drop table if exists samples")
+                cur.execute("alter table samples_rebuild rename to samples")
+                cur.execute("delete from crawl_checkpoints")
+                self.write_stats(cur)
+                self.bump_version(cur, rewritten=True)
+            return True
+        except Exception as exception:
+            logging.error(f"DBOperations:finish_rebuild:{exception}")
+            return False
+
     def purge_data(self):
         """
         Purge the table in db if exists
@@ -82,20 +561,99 @@ class DBOperations():
         try:
             with DBCM(self.database) as cur:
                 cur.execute("drop table if exists samples")
+                cur.execute("drop table if exists samples_rebuild")
+                cur.execute("drop table if exists monthly_stats")
+                cur.execute("drop table if exists crawl_checkpoints")
+                if cur.execute("select 1 from sqlite_master where type='table' and name='meta'").fetchone():
+                    self.bump_version(cur, rewritten=True)
         except Exception as exception:
             logging.error(f"DBOperations:purge_data:{exception}")
 
-    def get_latest_date(self):
+    def add_station(self, station_id, name):
+        """
+        Add a station, or rename it if it exists
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            with DBCM(self.database) as cur:
+                cur.execute("insert or replace into stations values (?,?)", (station_id, name))
+        except Exception as exception:
+            logging.error(f"DBOperations:add_station:{exception}")
+
+    def add_stations(self, station_ids):
+        """
+        Add the stations that are not in db yet, named after their id until
+        they are renamed with add_station
+        By: Nguyen Anh Thu Mai
         """
-        Return the latest date of data in db
+        try:
+            with DBCM(self.database) as cur:
+                cur.executemany("insert or ignore into stations values (?,?)",
+                                [(station_id, f"Station {station_id}") for station_id in station_ids])
+                if cur.rowcount > 0:
+                    self.bump_version(cur)
+        except Exception as exception:
+            logging.error(f"DBOperations:add_stations:{exception}")
+
+    def get_stations(self):
+        """
+        Return the (station_id, name) pairs of the stations in db
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            with DBCM(self.database) as cur:
+                return cur.execute("select station_id, name from stations order by station_id").fetchall()
+        except Exception as exception:
+            logging.error(f"DBOperations:get_stations:{exception}")
+            return []
+
+    def get_latest_date(self, station_id=DEFAULT_STATION):
+        """
+        Return the latest date of data in db for a station
         By: Ha Phuong Le
         """
         try:
             with DBCM(self.database) as cur:
-                for row in cur.execute("select max(sample_date) from samples"):
+                for row in cur.execute("select max(day) from samples where station_id=?", (station_id,)):
                     try:
-                        return row[0]
+                        return day_text(row[0]) if row[0] is not None else None
                     except Exception as exception:
                         logging.error(f"DBOperations:get_latest_date:loop:{exception}")
         except Exception as exception:
             logging.error(f"DBOperations:get_latest_date:{exception}")
+
+    def fetch_month_ends(self, station_id=DEFAULT_STATION):
+        """
+        Return the last day with data of every (year, month) of a station
+        By: Ha Phuong Le
+        """
+        with DBCM(self.database) as cur:
+            return {(year, month): last_day for year, month, last_day in cur.execute(
+                """select day / 10000, day / 100 % 100, max(day % 100)
+                from samples where station_id=? group by day / 100""", (station_id,))}
+
+    def get_missing_months(self, until, station_id=DEFAULT_STATION):
+        """
+        Return the (year, month) pairs from the first month of a station in db
+        up to until that have no data, plus the latest month if it is not
+        complete, newest first. Return None when the station has no data
+        By: Ha Phuong Le
+        """
+        try:
+            stored = self.fetch_month_ends(station_id)
+            if not stored:
+                return None
+
+            latest = max(stored)
+            year, month = min(stored)
+            missing = []
+            while (year, month) <= until:
+                last_day = stored.get((year, month))
+                if last_day is None or ((year, month) == latest and last_day < calendar.monthrange(year, month)[1]):
+                    missing.append((year, month))
+                year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+            return missing[::-1]
+        except Exception as exception:
+            logging.error(f"DBOperations:get_missing_months:{exception}")
+            return []
@@ -4,12 +4,38 @@ By: Nguyen Anh Thu Mai
 """
 import logging
 import sqlite3
+import threading
+import time
+from metrics import METRICS
+
+# Settings applied once to every pooled connection. WAL lets readers run
+# while the ingest writer commits, and busy_timeout makes writers wait for
+# each other instead of failing with "database is locked".
+PRAGMAS = (
+    "pragma journal_mode=wal",
+    "pragma synchronous=normal",
+    "pragma mmap_size=268435456",
+    "pragma cache_size=-16000",
+    "pragma busy_timeout=10000",
+)
+
+# Number of prepared statements kept per connection
+CACHED_STATEMENTS = 256
 
 class DBCM:
     """
     Create a context manager for db connection and cursor
     By: Nguyen Anh Thu Mai
     """
+    # Every thread keeps one open connection per database. Every pooled
+    # connection is listed with its database, and every database counts the
+    # times its connections were closed so threads know to reopen them
+    _local = threading.local()
+    _connections = []
+    _lock = threading.Lock()
+    _generation = 0
+    _closed = {}
+
     def __init__(self, database):
         """
         Initialize the database connection
@@ -22,26 +48,128 @@ class DBCM:
         except Exception as exception:
             logging.error(f"DBCM:__init__: {exception}")
 
+    @classmethod
+    def _pool(cls):
+        """
+        Return the connections and nesting depths of the current thread
+        By: Nguyen Anh Thu Mai
+        """
+        local = cls._local
+        if getattr(local, "generation", None) != cls._generation:
+            local.generation = cls._generation
+            local.connections = {}
+            local.depth = {}
+            local.opened = {}
+        return local
+
+    @classmethod
+    def connect(cls, database):
+        """
+        Return the pooled connection of the current thread, opening and
+        configuring it the first time it is used
+        By: Nguyen Anh Thu Mai
+        """
+        pool = cls._pool()
+        conn = pool.connections.get(database)
+        closed = cls._closed.get(database, 0)
+        if conn is None or pool.opened[database] != closed:
+            conn = sqlite3.connect(database, timeout=10,
+                                   cached_statements=CACHED_STATEMENTS,
+                                   check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+
+            pool.connections[database] = conn
+            pool.opened[database] = closed
+            pool.depth.setdefault(database, 0)
+            with cls._lock:
+                cls._connections.append((database, conn))
+        return conn
+
+    @classmethod
+    def close_all(cls):
+        """
+        Close every pooled connection, e.g. before a database file is removed
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            with cls._lock:
+                cls._generation += 1
+                for _, conn in cls._connections:
+                    conn.close()
+                cls._connections = []
+        except Exception as exception:
+            logging.error(f"DBCM:close_all: {exception}")
+
+    @classmethod
+    def close_database(cls, database):
+        """
+        Close the pooled connections of every thread to one database, e.g.
+        before its file is removed. Connections to other databases stay open
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            with cls._lock:
+                cls._closed[database] = cls._closed.get(database, 0) + 1
+                for name, conn in cls._connections:
+                    if name == database:
+                        conn.close()
+                cls._connections = [(name, conn) for name, conn in cls._connections if name != database]
+        except Exception as exception:
+            logging.error(f"DBCM:close_database: {exception}")
+
+    @classmethod
+    def close_thread(cls):
+        """
+        Close the pooled connections of the current thread, before the thread
+        ends, so threads that come and go do not leave connections behind
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            pool = cls._pool()
+            closing = list(pool.connections.values())
+            closed = {id(conn) for conn in closing}
+            with cls._lock:
+                cls._connections = [(name, conn) for name, conn in cls._connections if id(conn) not in closed]
+            for conn in closing:
+                conn.close()
+            pool.connections.clear()
+            pool.depth.clear()
+            pool.opened.clear()
+        except Exception as exception:
+            logging.error(f"DBCM:close_thread: {exception}")
+
     def __enter__(self):
         """
-        Make a db connection and return the cursor
+        Borrow the pooled db connection and return a cursor
         By: Nguyen Anh Thu Mai
         """
         try:
-            self.conn = sqlite3.connect(self.data)
+            self.conn = self.connect(self.data)
+            self._pool().depth[self.data] += 1
             self.cur = self.conn.cursor()
             return self.cur
         except Exception as exception:
             logging.error(f"DBCM:__enter__: {exception}")
 
-    def __exit__(self, *exc):
+    def __exit__(self, exc_type, *exc):
         """
-        Close db connection
+        Commit, or roll back after an error, once the outermost block ends
+        and hand the connection back to the pool
         By: Nguyen Anh Thu Mai
         """
         try:
-            self.conn.commit()
             self.cur.close()
-            self.conn.close()
+
+            depth = self._pool().depth
+            depth[self.data] -= 1
+            if depth[self.data] == 0:
+                if exc_type is None:
+                    if self.conn.in_transaction:
+                        start = time.perf_counter()
+                        self.conn.commit()
+                        METRICS.observe("db_commit_seconds", time.perf_counter() - start)
+                else:
+                    self.conn.rollback()
         except Exception as exception:
             logging.error(f"DBCM:__exit__: {exception}")
@@ -0,0 +1,205 @@
+"""
+Create a shared HTTP session for the scraper with keep-alive connections,
+rate limiting and retries.
+By: Ha Phuong Le
+"""
+from contextlib import contextmanager
+import http.client
+import logging
+import random
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+from metrics import METRICS
+
+# Responses worth trying again after a pause
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+class HttpError(Exception):
+    """
+    Raised for a response that is not a success, after any retries
+    By: Ha Phuong Le
+    """
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+class TokenBucket:
+    """
+    Let through rate requests per second on average, in bursts of up to capacity
+    By: Ha Phuong Le
+    """
+    def __init__(self, rate, capacity):
+        """
+        Initialize the attributes with a full bucket
+        By: Ha Phuong Le
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a token is available and take it
+        By: Ha Phuong Le
+        """
+        if not self.rate:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HttpSession:
+    """
+    Send GET requests over one persistent connection per thread and host,
+    no faster than the rate limit, retrying connection errors and busy
+    responses with exponential backoff and jitter
+    By: Ha Phuong Le
+    """
+    def __init__(self, rate=5.0, burst=8, retries=4, backoff=0.5, max_backoff=30.0, timeout=30.0):
+        """
+        Initialize the attributes. A rate of 0 or None turns the rate limit off
+        By: Ha Phuong Le
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = {"User-Agent": "Scrape_Weather", "Connection": "keep-alive"}
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.connections = 0
+
+    def _connection(self, scheme, netloc):
+        """
+        Return the open connection of the current thread to a host
+        By: Ha Phuong Le
+        """
+        if not hasattr(self.local, "connections"):
+            self.local.connections = {}
+
+        conn = self.local.connections.get((scheme, netloc))
+        if conn is None:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = connection_class(netloc, timeout=self.timeout)
+            self.local.connections[(scheme, netloc)] = conn
+            with self.lock:
+                self.connections += 1
+        return conn
+
+    def _drop(self, scheme, netloc):
+        """
+        Close the connection of the current thread to a host so the next request reconnects
+        By: Ha Phuong Le
+        """
+        conn = self.local.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _delay(self, attempt, retry_after=None):
+        """
+        Return how long to wait before another attempt: the server's
+        Retry-After if it gave one, exponential backoff with full jitter otherwise
+        By: Ha Phuong Le
+        """
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, int(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _request(self, url, headers):
+        """
+        Send a request with retries and return the response once its status
+        is not worth retrying
+        By: Ha Phuong Le
+        """
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    self.retried += 1
+
+            self.bucket.acquire()
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                conn = self._connection(parts.scheme, parts.netloc)
+                conn.request("GET", path or "/", headers={**self.headers, **headers})
+                response = conn.getresponse()
+                with self.lock:
+                    self.requests += 1
+            except (OSError, http.client.HTTPException) as exception:
+                # The server may have closed an idle connection
+                self._drop(parts.scheme, parts.netloc)
+                METRICS.count("http_responses_total", status="error")
+                error = exception
+            else:
+                # Time to the response headers, the body is read by the caller
+                METRICS.observe("http_request_seconds", time.perf_counter() - start)
+                METRICS.count("http_responses_total", status=response.status)
+                if response.status not in RETRY_STATUSES:
+                    return response
+                retry_after = response.getheader("Retry-After")
+                response.read()
+                error = HttpError(response.status, url)
+
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt, retry_after))
+
+        raise error
+
+    @contextmanager
+    def open(self, url, headers=None):
+        """
+        Return the response to a GET request, following redirects. Success and
+        304 responses are returned, other statuses raise HttpError. What is
+        left of the body is read when the block ends so the connection can be reused
+        By: Ha Phuong Le
+        """
+        for _ in range(5):
+            response = self._request(url, headers or {})
+            if response.status not in REDIRECT_STATUSES:
+                break
+            response.read()
+            url = urljoin(url, response.getheader("Location"))
+
+        try:
+            if response.status >= 400:
+                raise HttpError(response.status, url)
+            yield response
+        finally:
+            try:
+                response.read()
+                if response.will_close:
+                    parts = urlsplit(url)
+                    self._drop(parts.scheme, parts.netloc)
+            except (OSError, http.client.HTTPException) as exception:
+                logging.error(f"HttpSession:open: {exception}")
+                parts = urlsplit(url)
+                self._drop(parts.scheme, parts.netloc)
+
+    def stats(self):
+        """
+        Return the request counters of the session
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            return {"requests": self.requests, "retries": self.retried, "connections": self.connections}
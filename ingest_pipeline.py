@@ -0,0 +1,521 @@
+"""
+Create a staged pipeline that downloads, parses and saves months of weather
+data at the same time.
+By: Ha Phuong Le
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import http.client
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from dateutil.relativedelta import relativedelta
+from bulk_csv import BULK_URL, BulkCsvReader
+from dbcm import DBCM
+from metrics import METRICS
+from scrape_weather import BASE_URL, WeatherScraper, month_rows, parse_records
+
+# Stages of the pipeline, in order
+STAGES = ("fetch", "parse", "write")
+
+# Where months come from: the monthly HTML pages or the yearly bulk CSV files
+SOURCES = ("html", "csv")
+
+# Marks the end of the items of a queue
+DONE = object()
+
+# Pages of a station failing in a row before its history walk is given up
+MAX_FAILURES = 32
+
+def _parse_month(body, year, month):
+    """
+    Parse the page of a month in a worker process and return the seconds it
+    took with the records of parse_records
+    By: Ha Phuong Le
+    """
+    started = time.perf_counter()
+    records = parse_records(body, year, month)
+    return (time.perf_counter() - started, *records)
+
+class StageError(Exception):
+    """
+    Raised when a stage of the pipeline failed and the run was stopped
+    By: Ha Phuong Le
+    """
+
+class IngestPipeline:
+    """
+    Download pages on a pool of fetcher threads, parse them on a parser
+    thread and save them from a single writer thread that batches months
+    into transactions. The stages are connected by bounded queues, so a slow
+    stage holds the others back instead of letting pages pile up in memory.
+    In history mode every station is walked back from a month until a page
+    has no data of its own, which stops the fetchers for that station. With
+    parse_processes the pages are parsed on a pool of processes instead,
+    for backfills where parsing keeps one core busy. With the csv source the
+    fetchers download a bulk CSV file per year and station and stream its
+    months straight to the writer, there is no parse stage
+    By: Ha Phuong Le
+    """
+    def __init__(self, database, base_url=BASE_URL, cache=None, session=None, workers=8,
+                 batch_months=12, retry_rounds=3, queue_size=None, parse_processes=0,
+                 source="html", bulk_url=BULK_URL):
+        """
+        Initialize the attributes. queue_size is the number of pages or months
+        a queue holds, twice the number of workers by default. parse_processes
+        is the number of parser processes, 0 parses on the parser thread
+        By: Ha Phuong Le
+        """
+        try:
+            if source not in SOURCES:
+                raise ValueError(f"unknown source {source}, expected one of {', '.join(SOURCES)}")
+            self.database = database
+            self.base_url = base_url
+            self.source = source
+            self.bulk_url = bulk_url
+            self.cache = cache
+            self.session = session
+            self.workers = max(1, workers)
+            self.batch_months = batch_months
+            self.retry_rounds = retry_rounds
+            self.parse_processes = max(0, parse_processes)
+            self.queue_size = queue_size or 2 * max(self.workers, self.parse_processes)
+
+            self.lock = threading.Condition()
+            self.stop = threading.Event()
+            self.stats = {}
+        except Exception as exception:
+            logging.error(f"IngestPipeline:__init__: {exception}")
+
+    def run(self, start=None, stations=(), skip=(), jobs=None, checkpoints=False):
+        """
+        Download, parse and save months and return the number of rows inserted
+        and skipped. Months given up after the retries are listed in
+        self.given_up and stations whose walk stopped on failures in
+        self.stopped, a run is complete only when both are empty. Raise
+        StageError when a stage failed. Either walk the history of stations back from start,
+        leaving out the (station_id, year, month) months in skip, or load the
+        (month, station_id) jobs given. With checkpoints the months go to the
+        shadow table of a full download with their checkpoints. With the csv
+        source history is walked back and jobs are loaded a year at a time
+        By: Ha Phuong Le
+        """
+        # Jobs are (month, station_id, attempt), the first month of the year for csv
+        bulk = self.source == "csv"
+        if bulk and jobs is not None:
+            jobs = list(dict.fromkeys((month.replace(month=1, day=1), station_id) for month, station_id in jobs))
+        self.jobs = deque((month, station_id, 0) for month, station_id in jobs or ())
+        self.retries = deque()
+        self.start = start
+        self.skip = skip
+        self.active = [] if jobs is not None else list(stations)
+        self.steps = {station_id: 0 for station_id in self.active}
+        self.turn = 0
+        self.in_flight = 0
+        self.failures = {}
+        self.given_up = []
+        self.stopped = []
+        self.checkpoints = checkpoints
+        self.counts = [0, 0]
+        self.errors = []
+        self.stop.clear()
+        self.stats = {stage: {"items": 0, "busy": 0.0, "threads": 0} for stage in STAGES}
+        self.stats["fetch"]["threads"] = self.workers
+        self.stats["parse"]["threads"] = 0 if bulk else self.parse_processes or 1
+        self.stats["write"]["threads"] = 1
+        self.units = {"fetch": "years" if bulk else "months", "parse": "months", "write": "months"}
+
+        self.pages = queue.Queue(self.queue_size)
+        self.months = queue.Queue(self.queue_size)
+        self.fetchers = self.workers
+
+        threads = [threading.Thread(target=self.guard, args=(self.fetch,), name=f"fetch-{number}")
+                   for number in range(self.workers)]
+        if not bulk:
+            threads.append(threading.Thread(target=self.guard, args=(self.parse,), name="parse"))
+        threads.append(threading.Thread(target=self.guard, args=(self.write,), name="write"))
+
+        self.started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            # Interrupted: let the stages finish the item in hand and leave
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+            for stage, stats in self.stats.items():
+                METRICS.count("pipeline_items_total", stats["items"], stage=stage)
+                METRICS.count("pipeline_busy_seconds_total", stats["busy"], stage=stage)
+
+        if self.errors:
+            raise StageError("; ".join(self.errors))
+        return tuple(self.counts)
+
+    @property
+    def complete(self):
+        """
+        Return whether the last run downloaded every month it was given
+        By: Ha Phuong Le
+        """
+        return not self.given_up and not self.stopped
+
+    def guard(self, stage):
+        """
+        Run a stage and stop the whole pipeline if it fails
+        By: Ha Phuong Le
+        """
+        try:
+            stage()
+        except Exception as exception:
+            logging.error(f"IngestPipeline:{stage.__name__}: {exception}")
+            with self.lock:
+                self.errors.append(f"{stage.__name__}: {exception}")
+                self.lock.notify_all()
+            self.stop.set()
+        finally:
+            # The stage threads end with the run, their db connections with them
+            DBCM.close_thread()
+
+    def put(self, items, item):
+        """
+        Put an item on a queue, waiting while it is full unless the pipeline stops
+        By: Ha Phuong Le
+        """
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, items, timeout=None):
+        """
+        Take an item from a queue, waiting up to timeout. Return None on
+        timeout and DONE when the pipeline stops
+        By: Ha Phuong Le
+        """
+        waited = 0.0
+        while not self.stop.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                waited += 0.1
+                if timeout is not None and waited >= timeout:
+                    return None
+        return DONE
+
+    def record(self, stage, started, items=1):
+        """
+        Count the items done by a stage and the time they took
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            self.stats[stage]["items"] += items
+            self.stats[stage]["busy"] += time.perf_counter() - started
+
+    def next_job(self):
+        """
+        Return the next month to download, or None when all are done. New
+        months of the active stations come first, in turns, then the months
+        to try again. Waits while months in flight may still add work
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            while not self.stop.is_set() and not self.errors:
+                if self.jobs:
+                    job = self.jobs.popleft()
+                elif self.active:
+                    station_id = self.active[self.turn % len(self.active)]
+                    self.turn += 1
+                    if self.source == "csv":
+                        # A year is done once its last month is, the writer saves months in order
+                        month = datetime(self.start.year - self.steps[station_id], 1, 1)
+                        last = 12 if month.year < self.start.year else self.start.month
+                        done = (station_id, month.year, last) in self.skip
+                    else:
+                        month = self.start - relativedelta(months=self.steps[station_id])
+                        done = (station_id, month.year, month.month) in self.skip
+                    self.steps[station_id] += 1
+                    if done:
+                        continue
+                    job = (month, station_id, 0)
+                elif self.retries:
+                    job = self.retries.popleft()
+                elif self.in_flight:
+                    self.lock.wait(0.5)
+                    continue
+                else:
+                    return None
+
+                self.in_flight += 1
+                return job
+            return None
+
+    def finish(self, job, failed=False):
+        """
+        Mark a month as done, queueing it to be tried again if it failed. A
+        station whose pages keep failing is not walked back any further
+        By: Ha Phuong Le
+        """
+        month, station_id, attempt = job
+        with self.lock:
+            self.in_flight -= 1
+            failures = self.failures.get(station_id, 0) + 1 if failed else 0
+            self.failures[station_id] = failures
+            if failures >= MAX_FAILURES and station_id in self.active:
+                self.active.remove(station_id)
+                self.stopped.append(station_id)
+                logging.error(f"IngestPipeline:finish: station {station_id} stopped after {failures} failed pages")
+            if failed:
+                if attempt < self.retry_rounds:
+                    self.retries.append((month, station_id, attempt + 1))
+                else:
+                    self.given_up.append((station_id, month))
+                    logging.error(f"IngestPipeline:finish: station {station_id} {month:%Y-%m} could not be downloaded")
+            self.lock.notify_all()
+
+    def end_history(self, station_id):
+        """
+        Stop walking back the history of a station
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            if station_id in self.active:
+                self.active.remove(station_id)
+            self.lock.notify_all()
+
+    def fetch(self):
+        """
+        Stage 1: download the pages of months and queue them for parsing
+        By: Ha Phuong Le
+        """
+        try:
+            while True:
+                job = self.next_job()
+                if job is None:
+                    break
+
+                if self.source == "csv":
+                    if not self.fetch_year(job):
+                        break
+                    continue
+
+                month, station_id, _ = job
+                started = time.perf_counter()
+                scraper = WeatherScraper(month, self.base_url, self.cache, station_id, self.session)
+                try:
+                    if self.parse_processes:
+                        body = scraper.fetch_page()
+                        self.record("fetch", started)
+                        if not self.put(self.pages, (job, scraper, body)):
+                            break
+                        continue
+
+                    # The parser reads the open page as it arrives, the
+                    # connection is used again once it is done
+                    with scraper.open_page() as page:
+                        self.record("fetch", started)
+                        parsed = threading.Event()
+                        if not self.put(self.pages, (job, scraper, page, parsed)):
+                            break
+                        while not parsed.wait(0.1) and not self.stop.is_set():
+                            pass
+                except Exception as exception:
+                    METRICS.count("pages_total", result="failed")
+                    logging.error(f"IngestPipeline:fetch: {scraper.final_url} {exception}")
+                    self.finish(job, failed=True)
+        finally:
+            # The last fetcher to stop ends the queue of pages, or of months
+            # when there is no parse stage
+            with self.lock:
+                self.fetchers -= 1
+                last = self.fetchers == 0
+            if last:
+                self.put(self.months if self.source == "csv" else self.pages, DONE)
+
+    def fetch_year(self, job):
+        """
+        Stage 1 for the csv source: stream the bulk CSV file of a year and
+        queue its months for the writer as they are read. A failed download
+        is tried again as a whole, the months already saved are skipped by
+        the db. Return False when the pipeline stops
+        By: Ha Phuong Le
+        """
+        month, station_id, _ = job
+        started = time.perf_counter()
+        reader = BulkCsvReader(month.year, self.bulk_url, self.cache, station_id, self.session)
+        try:
+            with reader.open() as stream:
+                for number, rows in reader.read_months(stream):
+                    if not self.put(self.months, (station_id, month.year, number, rows)):
+                        return False
+        except Exception as exception:
+            METRICS.count("pages_total", result="failed")
+            logging.error(f"IngestPipeline:fetch_year: {reader.final_url} {exception}")
+            self.finish(job, failed=True)
+            return True
+        self.record("fetch", started)
+
+        if reader.available:
+            METRICS.count("pages_total", result="ok")
+        else:
+            # A year without data ends the history of the station, unless it
+            # is the year the walk starts from and has no data yet
+            METRICS.count("pages_total", result="unavailable")
+            if self.start is None or month.year < self.start.year:
+                self.end_history(station_id)
+        self.finish(job)
+        return True
+
+    def parse(self):
+        """
+        Stage 2: parse the pages and queue the months that have data for the
+        writer. Pages are read from the open response, or from the file of
+        the cache, and parsed as their chunks arrive
+        By: Ha Phuong Le
+        """
+        try:
+            if self.parse_processes:
+                self.parse_in_processes()
+                return
+
+            while True:
+                item = self.get(self.pages)
+                if item is DONE:
+                    break
+
+                job, scraper, (stream, charset), parsed = item
+                started = time.perf_counter()
+                try:
+                    scraper.parse_stream(stream, charset)
+                except (OSError, http.client.HTTPException) as exception:
+                    # The connection broke while the page was read
+                    METRICS.count("pages_total", result="failed")
+                    logging.error(f"IngestPipeline:parse: {scraper.final_url} {exception}")
+                    self.finish(job, failed=True)
+                    continue
+                finally:
+                    parsed.set()
+                self.record("parse", started)
+                self.parsed(job, scraper.available_date, scraper.weather)
+        finally:
+            self.put(self.months, DONE)
+
+    def parse_in_processes(self):
+        """
+        Stage 2 on a pool of processes: send the bytes of the pages to the
+        workers, two pages per process at most, and pass on the rows they
+        return in the order the pages came
+        By: Ha Phuong Le
+        """
+        # The stage threads are already running, so workers are spawned instead of forked
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.parse_processes, mp_context=context) as executor:
+            pending = deque()
+            done = False
+            while pending or not done:
+                while not done and len(pending) < 2 * self.parse_processes:
+                    if pending:
+                        # Do not wait for pages while parsed ones are ready to collect
+                        try:
+                            item = self.pages.get_nowait()
+                        except queue.Empty:
+                            break
+                    else:
+                        item = self.get(self.pages)
+                    if item is DONE:
+                        done = True
+                        break
+
+                    job, scraper, body = item
+                    month = job[0]
+                    METRICS.count("bytes_read_total", len(body))
+                    pending.append((job, executor.submit(_parse_month, body, month.year, month.month)))
+
+                if pending:
+                    job, future = pending.popleft()
+                    seconds, available, days, temps = future.result()
+                    METRICS.observe("parse_seconds", seconds)
+                    METRICS.count("rows_parsed_total", len(days))
+                    # Count the time the worker spent on the page
+                    self.record("parse", time.perf_counter() - seconds)
+                    month = job[0]
+                    self.parsed(job, available, month_rows(month.year, month.month, days, temps))
+
+    def parsed(self, job, available, weather):
+        """
+        Queue a parsed month for the writer if its page had data of its own,
+        or end the history of its station
+        By: Ha Phuong Le
+        """
+        month, station_id, _ = job
+        if available:
+            METRICS.count("pages_total", result="ok")
+            self.put(self.months, (station_id, month.year, month.month, weather))
+        else:
+            # The site showed another month: the history of the station ends here
+            METRICS.count("pages_total", result="unavailable")
+            self.end_history(station_id)
+        self.finish(job)
+
+    def write(self):
+        """
+        Stage 3: save the months in batches, one transaction per batch, and
+        save a partial batch when no month came for a second
+        By: Ha Phuong Le
+        """
+        batch, checkpoints = [], []
+        while True:
+            item = self.get(self.months, timeout=1.0)
+            if item is not None and item is not DONE:
+                station_id, year, month, weather = item
+                batch.append((station_id, weather))
+                checkpoints.append((station_id, year, month))
+                if len(batch) < self.batch_months:
+                    continue
+
+            if batch:
+                started = time.perf_counter()
+                counts = self.database.save_months(batch, checkpoints if self.checkpoints else None)
+                if counts is None:
+                    # Going on would leave months missing that look downloaded
+                    raise RuntimeError(f"{len(batch)} months could not be saved")
+                inserted, skipped = counts
+                with self.lock:
+                    self.counts[0] += inserted
+                    self.counts[1] += skipped
+                self.record("write", started, len(batch))
+                batch, checkpoints = [], []
+
+            if item is DONE:
+                break
+
+    def report(self):
+        """
+        Return the months handled per second by every stage over the time it
+        was busy, and how busy its threads were over the run
+        By: Ha Phuong Le
+        """
+        lines = []
+        elapsed = max(getattr(self, "elapsed", 0.0), 1e-9)
+        units = getattr(self, "units", {})
+        for stage in STAGES:
+            stats = self.stats.get(stage, {"items": 0, "busy": 0.0, "threads": 1})
+            if not stats["threads"]:
+                continue
+            unit = units.get(stage, "months")
+            rate = stats["items"] / stats["busy"] if stats["busy"] else 0.0
+            busy = stats["busy"] / (elapsed * max(stats["threads"], 1))
+            lines.append(f"{stage:<6} {stats['items']:6} {unit:<6}  {rate:9.1f} {unit}/s busy  "
+                         f"{busy:6.1%} of {stats['threads']} thread(s)")
+        return lines
@@ -0,0 +1,287 @@
+"""
+Create counters, latency histograms and a profiler to see where the time
+of a scrape, parse and store run goes.
+By: Ha Phuong Le
+"""
+from bisect import bisect_left
+import cProfile
+from contextlib import contextmanager
+import json
+import logging
+import math
+import pstats
+import threading
+import time
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    """
+    Count observed values in fixed buckets and keep their sum
+    By: Ha Phuong Le
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Count a value
+        By: Ha Phuong Le
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket holding the q quantile
+        By: Ha Phuong Le
+        """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return math.nan
+
+    def cumulative(self):
+        """
+        Return (upper bound, number of values up to it) of every bucket
+        By: Ha Phuong Le
+        """
+        seen, result = 0, []
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+class Metrics:
+    """
+    Hold named counters and histograms, optionally labelled, and export
+    them as Prometheus text or JSON. Collectors add the counters other
+    objects already keep, such as the cache hit and miss counts
+    By: Ha Phuong Le
+    """
+    def __init__(self):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        """
+        Return the key of a metric with labels
+        By: Ha Phuong Le
+        """
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name, value=1, **labels):
+        """
+        Add value to a counter
+        By: Ha Phuong Le
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to a histogram
+        By: Ha Phuong Le
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the seconds a block takes in a histogram
+        By: Ha Phuong Le
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collect(self, prefix, stats):
+        """
+        Export the numbers returned by stats() as prefix_<name> gauges
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            self.collectors[prefix] = stats
+
+    def reset(self):
+        """
+        Forget every metric and collector
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.collectors = {}
+
+    def gauges(self):
+        """
+        Return the current values of the collectors by name
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            collectors = list(self.collectors.items())
+
+        values = {}
+        for prefix, stats in collectors:
+            try:
+                for name, value in stats().items():
+                    if isinstance(value, (int, float)):
+                        values[f"{prefix}_{name}"] = value
+            except Exception as exception:
+                logging.error(f"Metrics:gauges: {exception}")
+        return values
+
+    def to_json(self):
+        """
+        Return a summary of the metrics as a dictionary that can be saved as JSON
+        By: Ha Phuong Le
+        """
+        def label(name, labels):
+            return name + "".join(f"[{value}]" for _, value in labels)
+
+        with self.lock:
+            counters = {label(*key): value for key, value in sorted(self.counters.items())}
+            histograms = {label(*key): {"count": histogram.count,
+                                        "sum": histogram.sum,
+                                        "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                                        "p50": histogram.quantile(0.5),
+                                        "p90": histogram.quantile(0.9),
+                                        "p99": histogram.quantile(0.99)}
+                          for key, histogram in sorted(self.histograms.items())}
+
+        # JSON has no infinity, the last bucket is reported as null
+        for summary in histograms.values():
+            for quantile in ("p50", "p90", "p99"):
+                if not math.isfinite(summary[quantile]):
+                    summary[quantile] = None
+        return {"counters": counters, "histograms": histograms, "gauges": self.gauges()}
+
+    def to_prometheus(self):
+        """
+        Return the metrics in the Prometheus text format
+        By: Ha Phuong Le
+        """
+        def labels_text(labels, extra=()):
+            pairs = [f'{name}="{value}"' for name, value in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, histogram.cumulative(), histogram.sum, histogram.count)
+                                for key, histogram in self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{labels_text(labels)} {value}")
+
+        for (name, labels), buckets, total, count in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, seen in buckets:
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(f"{name}_bucket{labels_text(labels, [('le', le)])} {seen}")
+            lines.append(f"{name}_sum{labels_text(labels)} {total}")
+            lines.append(f"{name}_count{labels_text(labels)} {count}")
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Save the metrics to a file, as Prometheus text for a .prom or .txt file and as JSON otherwise
+        By: Ha Phuong Le
+        """
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                if path.endswith((".prom", ".txt")):
+                    file.write(self.to_prometheus())
+                else:
+                    json.dump(self.to_json(), file, indent=2)
+        except Exception as exception:
+            logging.error(f"Metrics:write: {exception}")
+
+class Profiler:
+    """
+    Profile the calling thread and every thread started while it runs with
+    cProfile, and merge the results, since the downloads run on worker threads
+    By: Ha Phuong Le
+    """
+    def __init__(self):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def start_thread(self, *args):
+        """
+        Start a profile in a new thread on its first call
+        By: Ha Phuong Le
+        """
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        """
+        Start profiling
+        By: Ha Phuong Le
+        """
+        threading.setprofile(self.start_thread)
+        self.start_thread()
+
+    def stop(self, path=None, top=25, stream=None):
+        """
+        Stop profiling, save the merged stats to path if given and print the
+        top functions by cumulative time to stream
+        By: Ha Phuong Le
+        """
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        profiles[0].disable()
+
+        stats = pstats.Stats(*profiles, stream=stream)
+        if path:
+            stats.dump_stats(path)
+        if stream is not None:
+            stats.sort_stats("cumulative").print_stats(top)
+        return stats
+
+# Metrics of the current run
+METRICS = Metrics()
@@ -0,0 +1,451 @@
+"""
+Create a PartitionedDB class that keeps the daily samples in one SQLite file per station or per decade.
+By: Ha Phuong Le
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+import logging
+import os
+import threading
+from db_operations import DBOperations, DEFAULT_STATION, DEFAULT_LOCATION, STATIONS_TABLE, day_number
+from dbcm import DBCM
+
+# Ways of splitting the samples: a file per station, or a file per decade of all stations
+SCHEMES = ("station", "decade")
+
+# The file of the catalog in the directory of a partitioned db
+CATALOG = "catalog.sqlite"
+
+class PartitionedDB(DBOperations):
+    """
+    Store the daily samples in a directory of SQLite files, one per station
+    or one per decade, listed in a small catalog file that also holds the
+    stations and the data versions. Every partition is a db of its own with
+    samples, monthly_stats and crawl_checkpoints, so writes to different
+    partitions commit at the same time instead of queuing on one writer
+    lock, and dropping a station or a decade removes its file. Queries over
+    several partitions run on a thread pool and their results are merged in
+    order. A month of a station always falls in one partition, so the
+    monthly summaries never need to be combined across files
+    By: Ha Phuong Le
+    """
+    def __init__(self, directory, scheme="station", threads=4):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        try:
+            if scheme not in SCHEMES:
+                raise ValueError(f"unknown partition scheme {scheme!r}")
+            self.directory = directory
+            self.scheme = scheme
+            self.threads = max(1, threads)
+
+            # The catalog takes the place of the single file for the stations and versions
+            self.database = os.path.join(directory, CATALOG)
+
+            # DBOperations of the partitions opened so far and the keys known to be in the catalog
+            self.partitions = {}
+            self.listed = set()
+            self.lock = threading.Lock()
+
+            # Threads querying the partitions, started by the first query over several
+            self.pool = None
+        except Exception as exception:
+            logging.error(f"PartitionedDB:__init__:{exception}")
+
+    def key(self, station_id, year):
+        """
+        Return the key of the partition holding a year of a station
+        By: Ha Phuong Le
+        """
+        if self.scheme == "station":
+            return f"station_{station_id}"
+        return f"decade_{year // 10 * 10}"
+
+    def path(self, key):
+        """
+        Return the file of a partition
+        By: Ha Phuong Le
+        """
+        return os.path.join(self.directory, f"{key}.sqlite")
+
+    def partition(self, key):
+        """
+        Return the DBOperations of a partition
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            if key not in self.partitions:
+                self.partitions[key] = DBOperations(self.path(key))
+            return self.partitions[key]
+
+    def add_partition(self, station_id, year):
+        """
+        Return the DBOperations of the partition of a year of a station,
+        creating its file and listing it in the catalog if it is new. A
+        partition created during a full download gets its shadow table too
+        By: Ha Phuong Le
+        """
+        key = self.key(station_id, year)
+        partition = self.partition(key)
+        if key in self.listed:
+            return partition
+
+        with DBCM(self.database) as cur:
+            rebuilding = cur.execute("select value from meta where key='rebuilding'").fetchone()[0]
+        # The file is ready before readers find it in the catalog
+        partition.initialize_db()
+        if rebuilding:
+            partition.begin_rebuild()
+        with DBCM(self.database) as cur:
+            cur.execute("insert or ignore into partitions values (?,?,?,?)",
+                        (key, self.scheme, station_id if self.scheme == "station" else None,
+                         year // 10 * 10 if self.scheme == "decade" else None))
+        self.listed.add(key)
+        return partition
+
+    def keys(self, station_id=None, from_year=None, to_year=None):
+        """
+        Return the keys of the partitions in the catalog that may hold a
+        station between two years, in time order. None matches every station or year
+        By: Ha Phuong Le
+        """
+        with DBCM(self.database) as cur:
+            if self.scheme == "station":
+                rows = cur.execute("""select key from partitions
+                                   where ? is null or station_id=? order by station_id""",
+                                   (station_id, station_id))
+            else:
+                rows = cur.execute("""select key from partitions
+                                   where decade between ? and ? order by decade""",
+                                   (-1 if from_year is None else from_year // 10 * 10,
+                                    9999 if to_year is None else to_year))
+            return [row[0] for row in rows]
+
+    def run(self, calls):
+        """
+        Run functions on the thread pool, or on this thread when there is
+        only one, and return their results in order
+        By: Ha Phuong Le
+        """
+        if len(calls) < 2:
+            return [call() for call in calls]
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="partition")
+        return [future.result() for future in [self.pool.submit(call) for call in calls]]
+
+    def fan_out(self, keys, call):
+        """
+        Call a function with the DBOperations of every partition of keys and
+        return the results in key order
+        By: Ha Phuong Le
+        """
+        return self.run([partial(call, self.partition(key)) for key in keys])
+
+    def initialize_db(self):
+        """
+        Initialize the catalog and every partition listed in it
+        By: Ha Phuong Le
+        """
+        schemes = set()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with DBCM(self.database) as cur:
+                cur.execute(STATIONS_TABLE)
+                cur.execute("insert or ignore into stations values (?,?)", (DEFAULT_STATION, DEFAULT_LOCATION))
+
+                # The partitions and the station or the decade each one holds
+                cur.execute("""create table if not exists partitions
+                            (key text primary key not null,
+                            scheme text not null,
+                            station_id integer,
+                            decade integer);""")
+                schemes = {row[0] for row in cur.execute("select distinct scheme from partitions")}
+
+                # The data versions of all partitions, and whether a full download is under way
+                cur.execute("""create table if not exists meta
+                            (key text primary key not null,
+                            value integer not null);""")
+                cur.execute("insert or ignore into meta values ('data_version', 0)")
+                cur.execute("insert or ignore into meta values ('rewrite_version', 0)")
+                cur.execute("insert or ignore into meta values ('rebuilding', 0)")
+
+            if not schemes - {self.scheme}:
+                keys = self.keys()
+                self.fan_out(keys, lambda partition: partition.initialize_db())
+                self.listed.update(keys)
+        except Exception as exception:
+            logging.error(f"PartitionedDB:initialize_db:{exception}")
+
+        # Opened with another scheme, rows would be saved to the wrong files
+        if schemes - {self.scheme}:
+            raise ValueError(f"{self.directory} is partitioned by {', '.join(sorted(schemes))}")
+
+    def save_months(self, months, checkpoints=None):
+        """
+        Store several (station_id, weather) months, each in the partition of
+        its station or decade. The months of a partition are saved in one
+        transaction of its file, the partitions at the same time. Return the
+        number of rows inserted and skipped, or None if a partition could not be saved
+        By: Ha Phuong Le
+        """
+        try:
+            batches = {}
+            for index, (station_id, weather) in enumerate(months):
+                if checkpoints is not None:
+                    year = checkpoints[index][1]
+                else:
+                    # A month without days has nothing to save
+                    first = next(iter(weather), None)
+                    if first is None:
+                        continue
+                    year = (day_number(first) if isinstance(first, str) else first[0]) // 10000
+
+                partition = self.add_partition(station_id, year)
+                batch, done = batches.setdefault(partition, ([], []))
+                batch.append((station_id, weather))
+                if checkpoints is not None:
+                    done.append(checkpoints[index])
+
+            counts = self.run([partial(partition.save_months, batch, done if checkpoints is not None else None)
+                               for partition, (batch, done) in batches.items()])
+            if None in counts:
+                return None
+            inserted = sum(count[0] for count in counts)
+            if inserted and checkpoints is None:
+                with DBCM(self.database) as cur:
+                    self.bump_version(cur)
+            return inserted, sum(count[1] for count in counts)
+        except Exception as exception:
+            logging.error(f"PartitionedDB:save_months:{exception}")
+            return None
+
+    def fetch_data(self, date, station_id=DEFAULT_STATION):
+        """
+        Fetch the mean temperature of a day of a station from its partition
+        By: Ha Phuong Le
+        """
+        try:
+            year = day_number(date) // 10000
+            for key in self.keys(station_id, year, year):
+                value = self.partition(key).fetch_data(date, station_id)
+                if value is not None:
+                    return value
+        except Exception as exception:
+            logging.error(f"PartitionedDB:fetch_data:{exception}")
+
+    def fetch_range(self, start, end, station_id=DEFAULT_STATION):
+        """
+        Stream the (sample_date, max_temp, min_temp, avg_temp) rows of a station
+        between two dates in date order, from one partition after the other,
+        so only the rows being read are held. Errors are raised, so a stream
+        cut short never looks complete
+        By: Ha Phuong Le
+        """
+        for key in self.keys(station_id, day_number(start) // 10000, day_number(end) // 10000):
+            yield from self.partition(key).fetch_range(start, end, station_id)
+
+    def fetch_days(self, station_id=DEFAULT_STATION, after=0):
+        """
+        Return the (day, max_temp, min_temp, avg_temp) rows of a station after
+        a YYYYMMDD day in day order, from its partitions
+        By: Ha Phuong Le
+        """
+        try:
+            keys = self.keys(station_id, after // 10000, None)
+            return list(chain.from_iterable(
+                self.fan_out(keys, lambda partition: partition.fetch_days(station_id, after))))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:fetch_days:{exception}")
+            return []
+
+    def count_days(self, station_id=DEFAULT_STATION, until=99991231):
+        """
+        Return the number of days of a station up to a YYYYMMDD day, from its partitions
+        By: Ha Phuong Le
+        """
+        try:
+            keys = self.keys(station_id, None, until // 10000)
+            return sum(self.fan_out(keys, lambda partition: partition.count_days(station_id, until)))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:count_days:{exception}")
+            return 0
+
+    def rebuild_stats(self):
+        """
+        Rebuild the monthly summaries of every partition
+        By: Ha Phuong Le
+        """
+        try:
+            self.fan_out(self.keys(), lambda partition: partition.rebuild_stats())
+        except Exception as exception:
+            logging.error(f"PartitionedDB:rebuild_stats:{exception}")
+
+    def check_stats(self):
+        """
+        Return the (station_id, year, month) summaries that disagree with samples in any partition
+        By: Ha Phuong Le
+        """
+        try:
+            return sorted(chain.from_iterable(
+                self.fan_out(self.keys(), lambda partition: partition.check_stats() or [])))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:check_stats:{exception}")
+
+    def fetch_sketches(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return the sketches of the mean temperatures of every month of the
+        year over a range of years at a station, merged across its partitions
+        By: Nguyen Anh Thu Mai
+        """
+        sketches = {month: Counter() for month in range(1, 13)}
+        try:
+            keys = self.keys(station_id, from_year, to_year)
+            for result in self.fan_out(keys, lambda partition: partition.fetch_sketches(from_year, to_year, station_id)):
+                for month, sketch in result.items():
+                    sketches[month].update(sketch)
+        except Exception as exception:
+            logging.error(f"PartitionedDB:fetch_sketches:{exception}")
+        return sketches
+
+    def fetch_yearly_stats(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return the statistics of every year in a range at a station, read
+        from its partitions, a year being whole in one of them
+        By: Ha Phuong Le
+        """
+        try:
+            keys = self.keys(station_id, from_year, to_year)
+            return list(chain.from_iterable(self.fan_out(
+                keys, lambda partition: partition.fetch_yearly_stats(from_year, to_year, station_id))))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:fetch_yearly_stats:{exception}")
+            return []
+
+    def fetch_monthly_stats(self, from_year, to_year, station_id=DEFAULT_STATION):
+        """
+        Return the statistics of every month in a range of years at a station, read from its partitions
+        By: Ha Phuong Le
+        """
+        try:
+            keys = self.keys(station_id, from_year, to_year)
+            return list(chain.from_iterable(self.fan_out(
+                keys, lambda partition: partition.fetch_monthly_stats(from_year, to_year, station_id))))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:fetch_monthly_stats:{exception}")
+            return []
+
+    def begin_rebuild(self):
+        """
+        Start a full download into the shadow tables of every partition, or
+        resume the one in progress. Partitions created by the download start
+        theirs when they are added. Return the months it has finished
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                cur.execute("update meta set value=1 where key='rebuilding'")
+            return set().union(*self.fan_out(self.keys(), lambda partition: partition.begin_rebuild()))
+        except Exception as exception:
+            logging.error(f"PartitionedDB:begin_rebuild:{exception}")
+            return set()
+
+    def finish_rebuild(self, stations=None):
+        """
+        Swap the finished shadow table in for samples in every partition, only
+        for the rows of the given stations if there are. Each partition swaps
+        in one transaction of its own. Return whether every partition swapped;
+        otherwise the download stays in progress and partitions that did not
+        swap keep their data
+        By: Ha Phuong Le
+        """
+        try:
+            swapped = all(self.fan_out(self.keys(), lambda partition: partition.finish_rebuild(stations)))
+            with DBCM(self.database) as cur:
+                if swapped:
+                    cur.execute("update meta set value=0 where key='rebuilding'")
+                self.bump_version(cur, rewritten=True)
+            return swapped
+        except Exception as exception:
+            logging.error(f"PartitionedDB:finish_rebuild:{exception}")
+            return False
+
+    def drop_partition(self, key):
+        """
+        Remove a partition from the catalog and delete its file. Return
+        whether it existed. The pooled connections of every thread to its
+        file are closed first, connections to the other files stay open
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                dropped = cur.execute("delete from partitions where key=?", (key,)).rowcount > 0
+                if dropped:
+                    self.bump_version(cur, rewritten=True)
+
+            DBCM.close_database(self.path(key))
+            with self.lock:
+                self.partitions.pop(key, None)
+                self.listed.discard(key)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path(key) + suffix):
+                    os.remove(self.path(key) + suffix)
+            return dropped
+        except Exception as exception:
+            logging.error(f"PartitionedDB:drop_partition:{exception}")
+            return False
+
+    def purge_data(self):
+        """
+        Drop every partition
+        By: Ha Phuong Le
+        """
+        try:
+            for key in self.keys():
+                self.drop_partition(key)
+            with DBCM(self.database) as cur:
+                cur.execute("update meta set value=0 where key='rebuilding'")
+        except Exception as exception:
+            logging.error(f"PartitionedDB:purge_data:{exception}")
+
+    def get_partitions(self):
+        """
+        Return the key, station or decade and size in bytes of every partition
+        By: Ha Phuong Le
+        """
+        try:
+            with DBCM(self.database) as cur:
+                rows = cur.execute("""select key, coalesce(station_id, decade) from partitions
+                                   order by station_id, decade""").fetchall()
+            return [(key, value, sum(os.path.getsize(self.path(key) + suffix)
+                                     for suffix in ("", "-wal") if os.path.exists(self.path(key) + suffix)))
+                    for key, value in rows]
+        except Exception as exception:
+            logging.error(f"PartitionedDB:get_partitions:{exception}")
+            return []
+
+    def get_latest_date(self, station_id=DEFAULT_STATION):
+        """
+        Return the latest date of data of a station in any of its partitions
+        By: Ha Phuong Le
+        """
+        try:
+            dates = self.fan_out(self.keys(station_id), lambda partition: partition.get_latest_date(station_id))
+            return max((date for date in dates if date is not None), default=None)
+        except Exception as exception:
+            logging.error(f"PartitionedDB:get_latest_date:{exception}")
+
+    def fetch_month_ends(self, station_id=DEFAULT_STATION):
+        """
+        Return the last day with data of every (year, month) of a station, merged from its partitions
+        By: Ha Phuong Le
+        """
+        stored = {}
+        for result in self.fan_out(self.keys(station_id), lambda partition: partition.fetch_month_ends(station_id)):
+            stored.update(result)
+        return stored
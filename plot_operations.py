@@ -3,6 +3,9 @@ Create a plot_operations.py module with a PlotOperations class inside.
 By: Ha Phuong Le & Nguyen Anh Thu Mai
 """
 import logging
+import time
+from matplotlib.cbook import boxplot_stats
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 
 class PlotOperations:
@@ -20,49 +23,113 @@ class PlotOperations:
         except Exception as exception:
             logging.error(f"PlotOperations:__init__:{exception}")
 
-    def display_box_plot(self, mydict, from_year, to_year):
+    def draw_box(self, axes, from_year, to_year):
         """
-        Display a box plot for mean temperatures in a range of years
+        Set the title and labels of a box plot on its axes
+        By: Nguyen Anh Thu Mai
+        """
+        self.title = f'Monthly Temperature Distribution for: {from_year} to {to_year}'
+        location = 'center'
+        font_dict = {'fontsize': 14, 'fontweight': 8.2,
+                    'verticalalignment': 'baseline',
+                    'horizontalalignment': location}
+        axes.set_title(self.title, fontdict=font_dict, loc=location)
+        axes.set_ylabel('Temperature (Celsius)')
+        axes.set_xlabel('Month')
+
+    def draw_line(self, axes, dates, means, month):
+        """
+        Draw a line plot of mean temperature in a month on its axes
+        By: Ha Phuong Le
+        """
+        self.label = 'Temperature (Celsius)'
+
+        axes.plot(dates, means)
+        axes.set_xlabel('Day')
+        axes.set_ylabel(self.label)
+        axes.set_title('Daily Temperature Distribution for: ' + month)
+
+    def display_box_plot(self, mydict, from_year, to_year, output=None):
+        """
+        Display a box plot for mean temperatures in a range of years, given
+        one list or array of temperatures per month, or save it to output.
+        The statistics are computed here and drawn by display_box_stats
         By: Nguyen Anh Thu Mai
         """
         try:
-            self.title = f'Monthly Temperature Distribution for: {from_year} to {to_year}'
-            location = 'center'
-            font_dict = {'fontsize': 14, 'fontweight': 8.2,
-                        'verticalalignment': 'baseline',
-                        'horizontalalignment': location}
-            plt.title(self.title, fontdict=font_dict, loc=location)
-            plt.ylabel('Temperature (Celsius)')
-            plt.xlabel('Month')
+            # mean temperatures in a range of years, as a dict of months or a list of arrays
+            means = list(mydict.values()) if hasattr(mydict, "values") else list(mydict)
+            stats = boxplot_stats(means, labels=range(1, len(means) + 1))
+            self.display_box_stats(stats, from_year, to_year, output)
 
-            # mean temperatures in a range of years
-            means = []
+        except Exception as exception:
+            logging.error(f"PlotOperations:display_box_plot: {exception}")
 
-            for value in mydict.values():
-                try:
-                    means.append(value)
-                except Exception as exception:
-                    logging.error(f"PlotOperations:display_box_plot:loop: {exception}")
+    def display_box_stats(self, stats, from_year, to_year, output=None):
+        """
+        Display a box plot for mean temperatures in a range of years from
+        precomputed statistics, one dictionary per month, or save it to output
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            figure = plt.figure()
+            axes = figure.subplots()
+            self.draw_box(axes, from_year, to_year)
 
             # Create the box plot
-            plt.boxplot(means)
-            plt.show()
+            axes.bxp(stats)
+            self.finish(figure, output)
 
         except Exception as exception:
-            logging.error(f"PlotOperations:display_box_plot: {exception}")
+            logging.error(f"PlotOperations:display_box_stats: {exception}")
 
-    def display_line_plot(self, dates, means, month):
+    def display_line_plot(self, dates, means, month, output=None):
         """
-        Display a line plot of mean temperature in a particular month
+        Display a line plot of mean temperature in a particular month, given
+        the days and temperatures as lists or arrays, or save it to output
         By: Ha Phuong Le
         """
         try:
-            self.label = 'Temperature (Celsius)'
-
-            plt.plot(dates, means)
-            plt.xlabel('Day')
-            plt.ylabel(self.label)
-            plt.title('Daily Temperature Distribution for: ' + month)
-            plt.show()
+            figure = plt.figure()
+            self.draw_line(figure.subplots(), dates, means, month)
+            self.finish(figure, output)
         except Exception as exception:
             logging.error(f"PlotOperations:display_line_plot: {exception}")
+
+    def finish(self, figure, output):
+        """
+        Show the chart, or save it to the output file, then close its figure
+        By: Nguyen Anh Thu Mai
+        """
+        if output is None:
+            plt.show()
+        else:
+            figure.savefig(output)
+        plt.close(figure)
+
+    def render_box_stats(self, stats, from_year, to_year, output):
+        """
+        Save a box plot from precomputed statistics to a PNG, SVG or PDF file
+        and return the seconds it took. The chart is drawn on its own Figure
+        without pyplot, so charts can be rendered headless and in parallel
+        By: Nguyen Anh Thu Mai
+        """
+        start = time.perf_counter()
+        figure = Figure()
+        axes = figure.subplots()
+        self.draw_box(axes, from_year, to_year)
+        axes.bxp(stats)
+        figure.savefig(output)
+        return time.perf_counter() - start
+
+    def render_line_plot(self, dates, means, month, output):
+        """
+        Save a line plot of a month to a PNG, SVG or PDF file and return the
+        seconds it took, drawn on its own Figure without pyplot
+        By: Ha Phuong Le
+        """
+        start = time.perf_counter()
+        figure = Figure()
+        self.draw_line(figure.subplots(), dates, means, month)
+        figure.savefig(output)
+        return time.perf_counter() - start
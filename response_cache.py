@@ -0,0 +1,230 @@
+"""
+Create an on-disk cache of the daily data pages downloaded by WeatherScraper.
+By: Ha Phuong Le
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# Bytes of a download written to disk at a time
+CHUNK_SIZE = 64 * 1024
+
+class ResponseCache:
+    """
+    Keep downloaded pages on disk keyed by url. Pages of closed months are kept
+    for good, the others expire after a ttl and are then revalidated with
+    their ETag/Last-Modified. The least recently used pages are evicted once
+    the cache grows past its size limit
+    By: Ha Phuong Le
+    """
+    def __init__(self, directory="http_cache", max_bytes=256 * 1024 * 1024, ttl=3600, session=None):
+        """
+        Initialize the attributes and index the pages already on disk. Pages are
+        downloaded through the HttpSession if one is given, with urllib otherwise
+        By: Ha Phuong Le
+        """
+        try:
+            self.directory = directory
+            self.session = session
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+
+            self.hits = 0
+            self.misses = 0
+            self.revalidations = 0
+            self.evictions = 0
+
+            # Page sizes by key, least recently used first
+            self.entries = OrderedDict()
+            self.size = 0
+            self.lock = threading.Lock()
+
+            os.makedirs(directory, exist_ok=True)
+            pages = [name[:-5] for name in os.listdir(directory) if name.endswith(".json")]
+            for key in sorted(pages, key=lambda key: os.path.getmtime(self._path(key, ".json"))):
+                try:
+                    size = os.path.getsize(self._path(key, ".body"))
+                    self.entries[key] = size
+                    self.size += size
+                except OSError:
+                    os.remove(self._path(key, ".json"))
+        except Exception as exception:
+            logging.error(f"ResponseCache:__init__: {exception}")
+
+    def _path(self, key, suffix):
+        """
+        Return the file of a cached page
+        By: Ha Phuong Le
+        """
+        return os.path.join(self.directory, key + suffix)
+
+    def _read(self, key):
+        """
+        Return the metadata of a cached page with its body opened as a binary
+        file, or None if it is not cached
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            with open(self._path(key, ".json"), encoding="utf-8") as file:
+                meta = json.load(file)
+            body = open(self._path(key, ".body"), "rb")
+            os.utime(self._path(key, ".json"))
+            return meta, body
+        except OSError:
+            return None
+
+    def _write(self, key, meta, temp=None):
+        """
+        Store the metadata of a page and the body downloaded to temp, if
+        there is a new one, atomically and evict old pages past the size limit
+        By: Ha Phuong Le
+        """
+        if temp is not None:
+            size = os.path.getsize(temp)
+            os.replace(temp, self._path(key, ".body"))
+
+        meta_temp = self._path(key, f".json.{threading.get_ident()}.tmp")
+        with open(meta_temp, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(meta_temp, self._path(key, ".json"))
+
+        with self.lock:
+            if temp is not None:
+                self.size += size - self.entries.pop(key, 0)
+                self.entries[key] = size
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+                for suffix in (".json", ".body"):
+                    try:
+                        os.remove(self._path(old_key, suffix))
+                    except OSError:
+                        pass
+
+    def open(self, url, permanent=False):
+        """
+        Return the body of a page as a binary file on disk with the charset
+        of the page, from the cache when it is still fresh and from the
+        website otherwise. Downloads are streamed to disk, a body is never
+        held in memory whole. Permanent pages never expire
+        By: Ha Phuong Le
+        """
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        cached = self._read(key)
+
+        headers = {}
+        if cached:
+            meta, body = cached
+            if meta["permanent"] or time.time() - meta["fetched"] < self.ttl:
+                with self.lock:
+                    self.hits += 1
+                return body, meta.get("charset")
+
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            status, response_headers, temp = self._download(url, headers, key)
+        except Exception:
+            if cached:
+                cached[1].close()
+            raise
+
+        if status == 304 and cached:
+            # The page has not changed since it was cached. A page cached
+            # while its month was open is kept for good once the month closes
+            os.remove(temp)
+            temp = None
+            meta, body = cached
+            meta["fetched"] = time.time()
+            meta["permanent"] = permanent
+            meta["etag"] = response_headers.get("ETag") or meta.get("etag")
+            meta["last_modified"] = response_headers.get("Last-Modified") or meta.get("last_modified")
+            with self.lock:
+                self.revalidations += 1
+        else:
+            if cached:
+                cached[1].close()
+            # Opened before it is stored, so an eviction cannot take it away
+            body = open(temp, "rb")
+            meta = {"url": url,
+                    "etag": response_headers.get("ETag"),
+                    "last_modified": response_headers.get("Last-Modified"),
+                    "charset": response_headers.get_content_charset(),
+                    "fetched": time.time(),
+                    "permanent": permanent}
+            with self.lock:
+                self.misses += 1
+
+        self._write(key, meta, temp)
+        return body, meta.get("charset")
+
+    def fetch(self, url, permanent=False):
+        """
+        Return the body of a page as bytes, see open
+        By: Ha Phuong Le
+        """
+        body, _ = self.open(url, permanent)
+        with body:
+            return body.read()
+
+    def _download(self, url, headers, key):
+        """
+        Download a page into a temporary file of the cache, in chunks. Return
+        the status, the headers and the file
+        By: Ha Phuong Le
+        """
+        temp = self._path(key, f".body.{threading.get_ident()}.tmp")
+        try:
+            if self.session is not None:
+                with self.session.open(url, headers) as response, open(temp, "wb") as file:
+                    shutil.copyfileobj(response, file, CHUNK_SIZE)
+                    return response.status, response.headers, temp
+
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response, \
+                        open(temp, "wb") as file:
+                    shutil.copyfileobj(response, file, CHUNK_SIZE)
+                    return response.status, response.headers, temp
+            except urllib.error.HTTPError as error:
+                if error.code != 304:
+                    raise
+                open(temp, "wb").close()
+                return error.code, error.headers, temp
+        except Exception:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    def stats(self):
+        """
+        Return the hit and miss counters of the cache
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            requests = self.hits + self.revalidations + self.misses
+            return {"hits": self.hits,
+                    "revalidations": self.revalidations,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": (self.hits + self.revalidations) / requests if requests else 0.0,
+                    "pages": len(self.entries),
+                    "bytes": self.size}
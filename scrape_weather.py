@@ -1,18 +1,41 @@
 """
-Create a class to scrape Winnipeg weather data from the Environment Canada website.
+Create a class to scrape weather data of a station from the Environment Canada website.
 By: Ha Phuong Le
 """
+from array import array
+from collections import namedtuple
 from html.parser import HTMLParser
+import calendar
+import codecs
+from contextlib import ExitStack, contextmanager
+import io
+import time
 import urllib.request
 from datetime import datetime
 import logging
+from metrics import METRICS
+
+BASE_URL = "https://climate.weather.gc.ca/climate_data/daily_data_e.html"
+
+# Bytes read from the response and fed to the parser at a time
+CHUNK_SIZE = 64 * 1024
+
+# Parser states, from outside the data table down to a temperature cell
+OUTSIDE, TABLE, ROW, DATE, CELL = range(5)
+
+# Month numbers by name, to read the date title of the first row
+MONTHS = {name: number for number, name in enumerate(calendar.month_name) if name}
+
+# A parsed day: the YYYYMMDD day number and the max, min and mean temperatures.
+# A tuple of four fields takes about a quarter of the memory of a dict per day
+DayRecord = namedtuple("DayRecord", ("day", "max", "min", "mean"))
 
 class WeatherScraper(HTMLParser):
     """
     Use the Python HTMLParser class to scrape weather data from the website
     By: Ha Phuong Le
     """
-    def __init__(self, input_time):
+    def __init__(self, input_time, base_url=BASE_URL, cache=None, station_id=27174, session=None):
         """
         Initialize the attributes
         By: Ha Phuong Le
@@ -23,26 +46,42 @@ class WeatherScraper(HTMLParser):
             self.year = input_time.strftime("%Y")
             self.month = input_time.strftime("%m")
 
-            # a dictionary of weather data
-            self.weather = {}
+            # the days of the page as DayRecords, filled by parse_stream
+            self.weather = []
+
+            # the days parsed from the last chunk, not yet handed out by stream_records
+            self.pending = []
+
+            # the number of days parsed from the page
+            self.rows = 0
 
             # a flag to indicate whether the date has available data
             self.available_date = True
 
-            start_url = "https://climate.weather.gc.ca/climate_data/daily_data_e.html?StationID=27174&timeframe=2&StartYear=1840&EndYear=2020&Day=1&"
+            self.station_id = station_id
+
+            start_url = f"{base_url}?StationID={station_id}&timeframe=2&StartYear=1840&EndYear=2020&Day=1&"
             values = {"Year": input_time.strftime("%Y"), "Month": input_time.strftime("%-m")}
             self.final_url = start_url + urllib.parse.urlencode(values) + "#"
 
-            self.date = ""
-            self.is_body = False
-            self.is_tr = False
-            self.is_th = False
-            self.is_date = False
-            self.is_weather = False
-            self.valid_date = False
-            self.i = 1
-            self.missing_data = False
+            # Pages of months before the previous one no longer change
+            now = datetime.now()
+            previous = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+            self.closed = (input_time.year, input_time.month) < previous
+
+            # the day number of the day before the first of the month
+            self.base_day = input_time.year * 10000 + input_time.month * 100
+            self.cache = cache
+            self.session = session
+
+            self.state = OUTSIDE
             self.first_check = True
+            self.done = False
+
+            # the day, temperatures and cell text of the current row
+            self.day = None
+            self.temps = []
+            self.text = []
         except Exception as exception:
             logging.error(f"WeatherScraper:__init__: {exception}")
 
@@ -52,34 +91,25 @@ class WeatherScraper(HTMLParser):
         By: Ha Phuong Le
         """
         try:
-            if tag == "tbody":
-                self.is_body = True
-
-            if self.is_body and tag == "tr":
-                self.is_tr = True
-
-            if self.is_tr and tag == "th":
-                self.is_th = True
-
-            if self.is_th and tag == "abbr":
-                self.is_date = True
-                self.valid_date = True
-
-            if self.is_tr and tag == "td" and self.i <= 3:
-                self.is_weather = True
-
-            # process available_date
-            if self.valid_date and self.first_check:
-                for attr in attrs:
-                    try:
-                        if "title" in attr:
-                            actual_date = datetime.strptime(attr[1], "%B %d, %Y")
-                            self.available_date = actual_date.strftime("%Y") == self.year and actual_date.strftime("%m") == self.month
-                    except Exception as exception:
-                        logging.error(f"WeatherScraper:handle_starttag:loop: {exception}")
-
-                self.first_check = False
-
+            state = self.state
+            if state == ROW:
+                if tag == "td":
+                    # Only the Max, Min and Mean cells of a dated row are read
+                    if self.day is not None and len(self.temps) < 3:
+                        self.state = CELL
+                        self.text = []
+                elif tag == "abbr":
+                    self.state = DATE
+                    self.text = []
+                    if self.first_check:
+                        self.check_date(attrs)
+            elif state == TABLE:
+                if tag == "tr":
+                    self.state = ROW
+                    self.day = None
+                    self.temps = []
+            elif state == OUTSIDE and tag == "tbody":
+                self.state = TABLE
         except Exception as exception:
             logging.error(f"WeatherScraper:handle_starttag: {exception}")
 
@@ -89,23 +119,26 @@ class WeatherScraper(HTMLParser):
         By: Ha Phuong Le
         """
         try:
-            if tag == "tbody":
-                self.is_body = False
-
-            if tag == "tr":
-                self.is_tr = False
-                self.valid_date = False
-                self.i = 1
-
-            if tag == "th":
-                self.is_th = False
-
-            if tag == "abbr":
-                self.is_date = False
-
-            if tag == "td":
-                self.i += 1
-                self.is_weather = False
+            state = self.state
+            if state == CELL and tag == "td":
+                try:
+                    self.temps.append(float("".join(self.text)))
+                except ValueError:
+                    # Days with missing data are left out
+                    self.day = None
+                self.state = ROW
+            elif state == DATE and tag == "abbr":
+                text = "".join(self.text).strip()
+                self.day = int(text) if text.isdigit() else None
+                self.state = ROW
+            elif state != OUTSIDE and tag == "tr":
+                if self.day is not None and len(self.temps) == 3:
+                    self.pending.append(DayRecord(self.base_day + self.day, *self.temps))
+                    self.rows += 1
+                self.state = TABLE
+            elif state == TABLE and tag == "tbody":
+                self.state = OUTSIDE
+                self.done = not self.first_check
         except Exception as exception:
             logging.error(f"WeatherScraper:handle_endtag: {exception}")
 
@@ -114,52 +147,158 @@ class WeatherScraper(HTMLParser):
         Process data that needs to be used
         By: Ha Phuong Le
         """
-        try:
-            if self.is_date:
-                if self.missing_data:
-                    del self.weather[self.date]
-                    self.missing_data = False
+        if self.state >= DATE:
+            self.text.append(data)
 
-                # Check if the data is a date
+    def check_date(self, attrs):
+        """
+        Check that the first row of the table belongs to the requested month,
+        the website shows the closest month with data otherwise
+        By: Ha Phuong Le
+        """
+        for name, value in attrs:
+            if name == "title":
                 try:
-                    int(data)
-
-                    self.date = self.year + "-" + self.month + "-" + data
-                    self.weather[self.date] = {}
+                    month_name, _, year = value.replace(",", "").split()
+                    self.available_date = year == self.year and MONTHS.get(month_name) == int(self.month)
                 except ValueError:
-                    self.valid_date = False
-
-            if self.is_weather and self.valid_date:
-                if self.i == 1:
-                    try:
-                        self.weather[self.date]["Max"] = float(data)
-                    except ValueError:
-                        self.missing_data = True
-
-                if not self.missing_data and self.i == 2:
-                    try:
-                        self.weather[self.date]["Min"] = float(data)
-                    except ValueError:
-                        self.missing_data = True
-
-                if not self.missing_data and self.i == 3:
-                    try:
-                        self.weather[self.date]["Mean"] = float(data)
-                    except ValueError:
-                        self.missing_data = True
+                    pass
 
-        except Exception as exception:
-            logging.error(f"WeatherScraper:handle_data: {exception}")
+        self.first_check = False
+
+    def stream_records(self, stream, charset="utf-8"):
+        """
+        Decode a page and feed it to the parser in chunks as it is read,
+        yielding the DayRecords of every chunk as soon as it is parsed, so a
+        consumer can start before the page is read and the scraper keeps
+        none of them. Only the tbody sections are fed, and reading stops
+        after the data table. The time spent reading and parsing is recorded separately
+        By: Ha Phuong Le
+        """
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        pending = ""
+        inside = False
+        read_time = parse_time = size = 0
+        while not self.done:
+            start = time.perf_counter()
+            chunk = stream.read(CHUNK_SIZE)
+            read_time += time.perf_counter() - start
+            size += len(chunk)
+
+            start = time.perf_counter()
+            pending += decoder.decode(chunk, final=not chunk)
+            while not self.done:
+                if not inside:
+                    start_tag = pending.find("<tbody")
+                    if start_tag < 0:
+                        # Keep a few characters in case the tag spans two chunks
+                        pending = pending[-5:]
+                        break
+                    pending = pending[start_tag:]
+                    inside = True
+
+                end = pending.find("</tbody>")
+                if end < 0:
+                    self.feed(pending)
+                    pending = ""
+                    break
+
+                self.feed(pending[:end + 8])
+                pending = pending[end + 8:]
+                inside = False
+            parse_time += time.perf_counter() - start
+
+            records, self.pending = self.pending, []
+            yield from records
+
+            if not chunk:
+                break
+
+        self.close()
+        yield from self.pending
+        self.pending = []
+        METRICS.observe("scrape_read_seconds", read_time)
+        METRICS.observe("parse_seconds", parse_time)
+        METRICS.count("bytes_read_total", size)
+        METRICS.count("rows_parsed_total", self.rows)
+
+    def parse_stream(self, stream, charset="utf-8"):
+        """
+        Parse a whole page into the list of DayRecords of self.weather
+        By: Ha Phuong Le
+        """
+        self.weather = list(self.stream_records(stream, charset))
+
+    @contextmanager
+    def open_page(self):
+        """
+        Open the page and yield it as a binary stream with its charset: the
+        file of the cache, or the live response of the session or of urllib,
+        whose body is read as it arrives. The time to open the page is
+        recorded, reading it is left to the caller
+        By: Ha Phuong Le
+        """
+        with ExitStack() as stack:
+            if self.cache is not None:
+                with METRICS.timer("scrape_fetch_seconds", source="cache"):
+                    body, charset = self.cache.open(self.final_url, self.closed)
+                stack.enter_context(body)
+                yield body, charset or "utf-8"
+                return
+
+            with METRICS.timer("scrape_fetch_seconds", source="network"):
+                if self.session is not None:
+                    response = stack.enter_context(self.session.open(self.final_url))
+                else:
+                    response = stack.enter_context(urllib.request.urlopen(self.final_url))
+            yield response, response.headers.get_content_charset() or "utf-8"
 
     def load_data(self):
         """
-        Scrape weather data from given page
+        Download and parse the page at once, decoding it with the charset of
+        the response and parsing every chunk as soon as it is read
         By: Ha Phuong Le
         """
-        try:
+        with self.open_page() as (stream, charset):
+            self.parse_stream(stream, charset)
+
+    def fetch_page(self):
+        """
+        Download the whole page without parsing it and return its bytes, for
+        parsing in another process
+        By: Ha Phuong Le
+        """
+        if self.cache is not None:
+            with METRICS.timer("scrape_fetch_seconds", source="cache"):
+                return self.cache.fetch(self.final_url, self.closed)
+
+        with METRICS.timer("scrape_fetch_seconds", source="network"):
+            if self.session is not None:
+                with self.session.open(self.final_url) as response:
+                    return response.read()
             with urllib.request.urlopen(self.final_url) as response:
-                html = str(response.read())
+                return response.read()
 
-            self.feed(html)
-        except Exception as exception:
-            logging.error(f"WeatherScraper:load_data: {exception}")
+def parse_records(body, year, month):
+    """
+    Parse the page of a month in a worker process. Return whether the page
+    has data of its own with the day and temperature arrays of records, which
+    pickle as a few flat buffers instead of a dict per day
+    By: Ha Phuong Le
+    """
+    scraper = WeatherScraper(datetime(year, month, 1))
+    days, temps = array("B"), array("d")
+    # Fill the columns as the days are parsed, no record outlives its row
+    for record in scraper.stream_records(io.BytesIO(body)):
+        days.append(record.day % 100)
+        temps.extend(record[1:])
+    return scraper.available_date, days, temps
+
+def month_rows(year, month, days, temps):
+    """
+    Turn the arrays of parse_records back into DayRecords
+    By: Ha Phuong Le
+    """
+    base_day = year * 10000 + month * 100
+    return [DayRecord(base_day + day, temps[3 * index], temps[3 * index + 1], temps[3 * index + 2])
+            for index, day in enumerate(days)]
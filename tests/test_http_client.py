@@ -0,0 +1,150 @@
+"""
+Test that busy responses of a flaky website are retried by the session and the pipeline.
+By: Ha Phuong Le
+"""
+from datetime import datetime
+import os
+import tempfile
+import unittest
+from benchmarks.replay_server import ReplayServer
+from dbcm import DBCM
+from http_client import HttpError, HttpSession
+from weather_processor import WeatherProcessor
+
+# Days with data in the replay pages of January to November 2020, a few days are missing
+DAYS = 325
+
+class TestHttpSession(unittest.TestCase):
+    """
+    Download the months of a replay server that answers some requests with 503
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Start a replay server that fails a third of the requests
+        By: Ha Phuong Le
+        """
+        self.server = ReplayServer((2020, 1), (2020, 11), failure_rate=0.3).__enter__()
+
+    def tearDown(self):
+        """
+        Stop the server
+        By: Ha Phuong Le
+        """
+        self.server.__exit__(None, None, None)
+
+    def url(self, month):
+        """
+        Return the url of a month of 2020
+        By: Ha Phuong Le
+        """
+        return f"{self.server.url}?StationID=27174&Year=2020&Month={month}"
+
+    def test_retries_with_backoff(self):
+        """
+        Every month is downloaded and each busy response was retried once
+        By: Ha Phuong Le
+        """
+        session = HttpSession(rate=None, backoff=0.01, retries=8)
+        for month in range(1, 12):
+            with session.open(self.url(month)) as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn(b"<table", response.read())
+
+        stats = session.stats()
+        self.assertGreater(self.server.failures, 0)
+        self.assertEqual(stats["retries"], self.server.failures)
+        self.assertEqual(stats["requests"], self.server.requests)
+
+    def test_delay(self):
+        """
+        The backoff grows with the attempts up to its limit, and a
+        Retry-After of the server is honoured
+        By: Ha Phuong Le
+        """
+        session = HttpSession(rate=None, backoff=1.0, max_backoff=4.0)
+        for attempt in range(6):
+            self.assertLessEqual(session._delay(attempt), min(4.0, 2 ** attempt))
+        self.assertEqual(session._delay(0, "3"), 3)
+        self.assertEqual(session._delay(0, "60"), 4.0)
+
+    def test_gives_up(self):
+        """
+        A page that keeps failing raises HttpError once the retries are used up
+        By: Ha Phuong Le
+        """
+        self.server.failure_rate = 1.0
+        session = HttpSession(rate=None, backoff=0.01, retries=2)
+        with self.assertRaises(HttpError) as raised:
+            with session.open(self.url(1)):
+                pass
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(session.stats()["retries"], 2)
+
+class TestRetryRounds(unittest.TestCase):
+    """
+    Months that fail every retry of the session are queued and fetched again
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Start a replay server that fails half of the requests and create a temporary db
+        By: Ha Phuong Le
+        """
+        self.server = ReplayServer((2020, 1), (2020, 11), failure_rate=0.5).__enter__()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """
+        Stop the server, close the pooled connections and remove the db
+        By: Ha Phuong Le
+        """
+        self.server.__exit__(None, None, None)
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def processor(self, retry_rounds):
+        """
+        Return a processor of the replay server whose session does not retry,
+        so failed months are only fetched again in retry rounds
+        By: Ha Phuong Le
+        """
+        processor = WeatherProcessor(os.path.join(self.directory.name, "weather.sqlite"), workers=1,
+                                     base_url=self.server.url, cache_dir=None, rate=None)
+        processor.today = datetime(2020, 11, 15)
+        processor.session.retries = 0
+        processor.retry_rounds = retry_rounds
+        return processor
+
+    def days(self, processor):
+        """
+        Return the number of days saved in db
+        By: Ha Phuong Le
+        """
+        with DBCM(processor.database.database) as cur:
+            return cur.execute("select count(*) from samples").fetchone()[0]
+
+    def test_retry_rounds_recover(self):
+        """
+        Enough retry rounds get every month of 2020 in spite of the failures
+        By: Ha Phuong Le
+        """
+        processor = self.processor(retry_rounds=10)
+        self.assertEqual(processor.get_fullset(), (DAYS, 0))
+        self.assertTrue(processor.complete)
+        self.assertGreater(self.server.failures, 0)
+        self.assertEqual(self.days(processor), DAYS)
+
+    def test_without_retry_rounds(self):
+        """
+        Without retry rounds the failed months are given up on
+        By: Ha Phuong Le
+        """
+        processor = self.processor(retry_rounds=0)
+        processor.get_fullset()
+        self.assertFalse(processor.complete)
+        self.assertEqual(len(processor.given_up), self.server.failures)
+
+if __name__ == "__main__":
+    unittest.main()
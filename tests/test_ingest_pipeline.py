@@ -0,0 +1,130 @@
+"""
+Test that the ingest pipeline reports the months it could not download.
+By: Ha Phuong Le
+"""
+from datetime import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+from benchmarks.replay_server import ReplayServer
+from db_operations import DBOperations
+from dbcm import DBCM
+from http_client import HttpSession
+from ingest_pipeline import IngestPipeline, MAX_FAILURES
+import weather_cli
+
+# Days with data in the replay pages of January to November 2020
+DAYS = 325
+
+class TestIncomplete(unittest.TestCase):
+    """
+    Run the pipeline and the command line against a replay server that fails requests
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Start a replay server and create a temporary db
+        By: Ha Phuong Le
+        """
+        self.server = ReplayServer((2020, 1), (2020, 11)).__enter__()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "weather.sqlite")
+        self.database = DBOperations(self.path)
+        self.database.initialize_db()
+
+    def tearDown(self):
+        """
+        Stop the server, close the pooled connections and remove the db
+        By: Ha Phuong Le
+        """
+        self.server.__exit__(None, None, None)
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def run_pipeline(self, failure_rate):
+        """
+        Download 2020 one month at a time, giving up on a month at its first
+        failure, and return the pipeline with its counts
+        By: Ha Phuong Le
+        """
+        self.server.failure_rate = failure_rate
+        pipeline = IngestPipeline(self.database, self.server.url, session=HttpSession(rate=None, retries=0),
+                                  workers=1, retry_rounds=0)
+        return pipeline, pipeline.run(datetime(2020, 11, 15), [27174])
+
+    def saved(self):
+        """
+        Return the (year, month) months saved in db
+        By: Ha Phuong Le
+        """
+        with DBCM(self.path) as cur:
+            return set(cur.execute("select year, month from monthly_stats"))
+
+    def test_complete(self):
+        """
+        Every month is saved and the throughput of every stage is reported
+        By: Ha Phuong Le
+        """
+        pipeline, counts = self.run_pipeline(0.0)
+        self.assertEqual(counts, (DAYS, 0))
+        self.assertTrue(pipeline.complete)
+        self.assertEqual(len(self.saved()), 11)
+        self.assertEqual([line.split()[0] for line in pipeline.report()], ["fetch", "parse", "write"])
+
+    def test_given_up(self):
+        """
+        The months that failed are given up on and the others are saved
+        By: Ha Phuong Le
+        """
+        pipeline, _ = self.run_pipeline(0.5)
+        self.assertFalse(pipeline.complete)
+        self.assertEqual(pipeline.stopped, [])
+        self.assertEqual(len(pipeline.given_up), self.server.failures)
+
+        given_up = {(month.year, month.month) for _, month in pipeline.given_up}
+        self.assertEqual(self.saved(), {(2020, month) for month in range(1, 12)} - given_up)
+
+    def test_stopped(self):
+        """
+        A station whose pages keep failing is not walked back any further
+        By: Ha Phuong Le
+        """
+        pipeline, counts = self.run_pipeline(1.0)
+        self.assertFalse(pipeline.complete)
+        self.assertEqual(pipeline.stopped, [27174])
+        self.assertEqual(len(pipeline.given_up), MAX_FAILURES)
+        self.assertEqual(self.server.requests, MAX_FAILURES)
+        self.assertEqual(counts, (0, 0))
+
+    def main(self, command, failure_rate):
+        """
+        Run a command of the command line against the server and return its exit code
+        By: Ha Phuong Le
+        """
+        make = weather_cli.make_processor
+
+        def make_processor(args):
+            processor = make(args)
+            processor.today = datetime(2020, 11, 15)
+            processor.session.retries = 0
+            processor.retry_rounds = 0
+            return processor
+
+        self.server.failure_rate = failure_rate
+        with mock.patch.object(weather_cli, "make_processor", make_processor):
+            return weather_cli.main(["--database", self.path, "--base-url", self.server.url, "--no-cache",
+                                     "--rate", "0", "--workers", "1", command])
+
+    def test_exit_codes(self):
+        """
+        A download or update that could not get every month exits with INCOMPLETE
+        By: Ha Phuong Le
+        """
+        self.assertEqual(self.main("update", 1.0), weather_cli.INCOMPLETE)
+        self.assertEqual(self.main("download", 1.0), weather_cli.INCOMPLETE)
+        self.assertEqual(self.main("download", 0.0), weather_cli.OK)
+        self.assertEqual(self.main("update", 0.0), weather_cli.OK)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Test the conversion of a db saved by the first version, with text dates, to integer days.
+By: Ha Phuong Le
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from db_operations import DEFAULT_STATION, DBOperations
+from dbcm import DBCM
+
+# Rows as the first version saved them: (sample_date, location, max_temp, min_temp, avg_temp)
+BASELINE_ROWS = [
+    ("2020-10-30", "Winnipeg, MB", 5.0, -1.0, 2.0),
+    ("2020-10-31", "Winnipeg, MB", 4.0, -2.0, 1.0),
+    ("2020-11-1", "Winnipeg, MB", 3.0, -3.0, 0.0),
+    # The same day saved again with a zero-padded date
+    ("2020-11-01", "Winnipeg, MB", 3.0, -3.0, 0.0),
+    ("2020-11-2", "Winnipeg, MB", 1.0, -5.0, -2.0),
+    ("2020-11-x", "Winnipeg, MB", 0.0, 0.0, 0.0),
+    ("Sum", "Winnipeg, MB", 0.0, 0.0, 0.0),
+]
+
+class TestMigrate(unittest.TestCase):
+    """
+    Convert a baseline db and check its days and summaries
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Create a db with the schema and rows of the first version
+        By: Ha Phuong Le
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "weather.sqlite")
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("""create table samples
+                         (id integer primary key autoincrement not null,
+                         sample_date text not null,
+                         location text not null,
+                         max_temp real not null,
+                         min_temp real not null,
+                         avg_temp real not null);""")
+            conn.executemany("""insert into samples (sample_date, location, max_temp, min_temp, avg_temp)
+                             values (?,?,?,?,?)""", BASELINE_ROWS)
+        conn.close()
+        self.database = DBOperations(self.path)
+
+    def tearDown(self):
+        """
+        Close the pooled connections and remove the db
+        By: Ha Phuong Le
+        """
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def test_migrate(self):
+        """
+        Unpadded dates are converted, repeated days and unreadable dates dropped
+        and the summaries rebuilt from the converted days
+        By: Ha Phuong Le
+        """
+        self.assertEqual(self.database.migrate(vacuum=False), (4, 3))
+        self.assertEqual(self.database.get_latest_date(), "2020-11-02")
+        self.assertEqual(self.database.get_stations(), [(DEFAULT_STATION, "Winnipeg, MB")])
+        self.assertEqual(self.database.check_stats(), [])
+
+        stats = self.database.fetch_monthly_stats(2020, 2020)
+        self.assertEqual([row[:3] for row in stats], [(2020, 10, 2), (2020, 11, 2)])
+        for row, expected in zip(stats, [(1.5, 1.0, 2.0, 0.5), (-1.0, -2.0, 0.0, 1.0)]):
+            for value, wanted in zip(row[3:], expected):
+                self.assertAlmostEqual(value, wanted)
+
+        # A converted db is left as it is
+        self.assertIsNone(self.database.migrate(vacuum=False))
+
+if __name__ == "__main__":
+    unittest.main()
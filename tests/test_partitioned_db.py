@@ -0,0 +1,97 @@
+"""
+Test the db partitioned by decade against a single SQLite file.
+By: Ha Phuong Le
+"""
+import os
+import tempfile
+import threading
+import unittest
+from db_operations import DBOperations
+from dbcm import DBCM
+from partitioned_db import PartitionedDB
+from scrape_weather import DayRecord
+
+# Three decades of the first days of every January
+MONTHS = [(27174, [DayRecord(year * 10000 + 100 + day, 1.0, -1.0, float(year % 10)) for day in (1, 2)])
+          for year in range(1995, 2021)]
+
+class TestPartitionedDB(unittest.TestCase):
+    """
+    Save the same months in a partitioned db and in a single file
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Fill both dbs
+        By: Ha Phuong Le
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.single = DBOperations(os.path.join(self.directory.name, "weather.sqlite"))
+        self.database = PartitionedDB(os.path.join(self.directory.name, "decades"), "decade")
+        for database in (self.single, self.database):
+            database.initialize_db()
+            database.save_months(MONTHS)
+
+    def tearDown(self):
+        """
+        Close the pooled connections and remove the dbs
+        By: Ha Phuong Le
+        """
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def test_fetch_range_streams_partitions_in_order(self):
+        """
+        The rows are those of the single file, and a partition is only
+        opened once the rows of the one before it are read
+        By: Ha Phuong Le
+        """
+        self.assertEqual(list(self.database.fetch_range("1995-01-01", "2020-12-31")),
+                         list(self.single.fetch_range("1995-01-01", "2020-12-31")))
+
+        opened = []
+        partition = self.database.partition
+        self.database.partition = lambda key: opened.append(key) or partition(key)
+        rows = self.database.fetch_range("1995-01-01", "2020-12-31")
+        self.assertEqual(next(rows)[0], "1995-01-01")
+        self.assertEqual(opened, ["decade_1990"])
+        self.assertEqual(len(list(rows)), 2 * 26 - 1)
+        self.assertEqual(opened, ["decade_1990", "decade_2000", "decade_2010", "decade_2020"])
+
+    def test_drop_keeps_connections_of_other_threads(self):
+        """
+        Dropping a partition leaves open the connections other threads are
+        reading the other partitions with
+        By: Ha Phuong Le
+        """
+        opened, dropped = threading.Event(), threading.Event()
+        results = []
+
+        def reader():
+            try:
+                with DBCM(self.database.path("decade_2000")) as cur:
+                    rows = cur.execute("select day from samples order by day")
+                    results.append(next(rows)[0])
+                    opened.set()
+                    dropped.wait(5)
+                    results.append(len(list(rows)))
+                results.append(self.database.get_latest_date())
+            except Exception as exception:
+                results.append(exception)
+            finally:
+                opened.set()
+                DBCM.close_thread()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        opened.wait(5)
+        self.assertTrue(self.database.drop_partition("decade_1990"))
+        dropped.set()
+        thread.join()
+
+        self.assertEqual(results, [20000101, 2 * 10 - 1, "2020-01-02"])
+        self.assertFalse(os.path.exists(self.database.path("decade_1990")))
+        self.assertEqual(len(list(self.database.fetch_range("1995-01-01", "2020-12-31"))), 2 * 21)
+
+if __name__ == "__main__":
+    unittest.main()
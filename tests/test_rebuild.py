@@ -0,0 +1,166 @@
+"""
+Test that a full download replaces the data of its stations only when it is complete.
+By: Ha Phuong Le
+"""
+from datetime import datetime
+import os
+import tempfile
+import unittest
+from benchmarks.replay_server import ReplayServer
+from db_operations import DBOperations
+from dbcm import DBCM
+from scrape_weather import DayRecord
+from weather_processor import WeatherProcessor
+
+# Days with data in the replay pages of January to November 2020
+DAYS = 325
+
+def month(station_id, year, number, mean):
+    """
+    Return a (station_id, records) month of three days with the given mean
+    By: Ha Phuong Le
+    """
+    base = year * 10000 + number * 100
+    return station_id, [DayRecord(base + day, mean + 5, mean - 5, mean) for day in (1, 2, 3)]
+
+class TestFinishRebuild(unittest.TestCase):
+    """
+    Swap shadow tables into a temporary db
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Create a db with a month of two stations and start a full download
+        of the first one with a new month
+        By: Ha Phuong Le
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = DBOperations(os.path.join(self.directory.name, "weather.sqlite"))
+        self.database.initialize_db()
+        self.database.save_months([month(27174, 2020, 1, 1.0), month(51097, 2020, 1, 2.0)])
+
+        self.assertEqual(self.database.begin_rebuild(), set())
+        self.database.save_months([month(27174, 2020, 2, 3.0)], [(27174, 2020, 2)])
+
+    def tearDown(self):
+        """
+        Close the pooled connections and remove the db
+        By: Ha Phuong Le
+        """
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def months(self):
+        """
+        Return the (station_id, year, month, days) summaries of the db
+        By: Ha Phuong Le
+        """
+        with DBCM(self.database.database) as cur:
+            return cur.execute("""select station_id, year, month, count from monthly_stats
+                               order by station_id, year, month""").fetchall()
+
+    def test_swap_keeps_other_stations(self):
+        """
+        The downloaded station is replaced and the other one kept
+        By: Ha Phuong Le
+        """
+        version = self.database.get_data_version("rewrite_version")
+        self.assertTrue(self.database.finish_rebuild([27174]))
+        self.assertEqual(self.months(), [(27174, 2020, 2, 3), (51097, 2020, 1, 3)])
+        self.assertEqual(self.database.check_stats(), [])
+        self.assertEqual(self.database.get_data_version("rewrite_version"), version + 1)
+        self.assertEqual(self.database.begin_rebuild(), set())
+
+    def test_failed_swap_changes_nothing(self):
+        """
+        When the summaries cannot be rebuilt the swap is rolled back and the
+        download can be resumed from its checkpoints
+        By: Ha Phuong Le
+        """
+        def fail(cur):
+            raise RuntimeError("disk full")
+
+        version = self.database.get_data_version("rewrite_version")
+        self.database.write_stats = fail
+        self.assertFalse(self.database.finish_rebuild([27174]))
+
+        self.assertEqual(self.months(), [(27174, 2020, 1, 3), (51097, 2020, 1, 3)])
+        self.assertEqual(self.database.get_data_version("rewrite_version"), version)
+        self.assertEqual(self.database.begin_rebuild(), {(27174, 2020, 2)})
+
+class TestResume(unittest.TestCase):
+    """
+    Interrupt a full download on a flaky replay server and resume it
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Create a temporary db with a complete download of 2020
+        By: Ha Phuong Le
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "weather.sqlite")
+        with ReplayServer((2020, 1), (2020, 11)) as server:
+            self.assertEqual(self.processor(server).get_fullset(), (DAYS, 0))
+
+    def tearDown(self):
+        """
+        Close the pooled connections and remove the db
+        By: Ha Phuong Le
+        """
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def processor(self, server):
+        """
+        Return a processor of the replay server that gives up on a month at
+        its first failure, one month at a time so the failures are repeatable
+        By: Ha Phuong Le
+        """
+        processor = WeatherProcessor(self.path, workers=1, base_url=server.url, cache_dir=None, rate=None)
+        processor.today = datetime(2020, 11, 15)
+        processor.session.retries = 0
+        processor.retry_rounds = 0
+        return processor
+
+    def count(self, table):
+        """
+        Return the number of rows of a table, or None if it does not exist
+        By: Ha Phuong Le
+        """
+        with DBCM(self.path) as cur:
+            if not cur.execute("select 1 from sqlite_master where type='table' and name=?", (table,)).fetchone():
+                return None
+            return cur.execute(f"select count(*) from {table}").fetchone()[0]
+
+    def test_resume(self):
+        """
+        An incomplete download keeps the current data and the months it saved,
+        the next one downloads only the other months and swaps the data in
+        By: Ha Phuong Le
+        """
+        with ReplayServer((2020, 1), (2020, 11), failure_rate=0.5) as server:
+            processor = self.processor(server)
+            processor.get_fullset()
+        self.assertFalse(processor.complete)
+        self.assertEqual(self.count("samples"), DAYS)
+
+        finished = DBOperations(self.path).begin_rebuild()
+        self.assertTrue(finished)
+        self.assertEqual(self.count("crawl_checkpoints"), len(finished))
+        self.assertLess(self.count("samples_rebuild"), DAYS)
+
+        with ReplayServer((2020, 1), (2020, 11)) as server:
+            processor = self.processor(server)
+            inserted, _ = processor.get_fullset()
+            # The unfinished months and the page past the end of the history
+            self.assertEqual(server.requests, 12 - len(finished))
+        self.assertTrue(processor.complete)
+        self.assertLess(inserted, DAYS)
+
+        self.assertEqual(self.count("samples"), DAYS)
+        self.assertIsNone(self.count("samples_rebuild"))
+        self.assertEqual(self.count("crawl_checkpoints"), 0)
+
+if __name__ == "__main__":
+    unittest.main()
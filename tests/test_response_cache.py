@@ -0,0 +1,82 @@
+"""
+Test the on-disk page cache against the replay server.
+By: Ha Phuong Le
+"""
+from datetime import datetime
+import os
+import tempfile
+import unittest
+from benchmarks.replay_server import ReplayServer
+from bulk_csv import BulkCsvReader
+from response_cache import ResponseCache
+from scrape_weather import WeatherScraper
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Cache pages of the replay server in a temporary directory
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Start the replay server and open an empty cache whose pages expire at once
+        By: Ha Phuong Le
+        """
+        self.server = ReplayServer((2020, 1), (2020, 11)).__enter__()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.directory.name, ttl=0)
+        self.url = WeatherScraper(datetime(2020, 10, 1), self.server.url).final_url
+
+    def tearDown(self):
+        """
+        Stop the server and remove the cache
+        By: Ha Phuong Le
+        """
+        self.server.__exit__(None, None, None)
+        self.directory.cleanup()
+
+    def test_revalidated_page_becomes_permanent(self):
+        """
+        A page cached while its month was open is revalidated once its month
+        closes, and then kept without asking the server again
+        By: Ha Phuong Le
+        """
+        body = self.cache.fetch(self.url, permanent=False)
+        self.assertEqual(self.cache.fetch(self.url, permanent=True), body)
+        self.assertEqual(self.cache.stats()["revalidations"], 1)
+
+        requests = self.server.requests
+        self.assertEqual(self.cache.fetch(self.url, permanent=True), body)
+        self.assertEqual(self.server.requests, requests)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_open_reads_from_disk(self):
+        """
+        A page is handed out as the file of the cache with its charset
+        By: Ha Phuong Le
+        """
+        body, charset = self.cache.open(self.url)
+        with body:
+            self.assertEqual(os.path.dirname(body.name), self.directory.name)
+            self.assertEqual(charset, "utf-8")
+            page = body.read()
+        self.assertIn(b"<tbody", page)
+        self.assertEqual(self.cache.fetch(self.url), page)
+
+    def test_bulk_file_streams_from_cache(self):
+        """
+        A cached yearly CSV file is read from disk by the bulk reader, with
+        the same days as straight from the server
+        By: Ha Phuong Le
+        """
+        reader = BulkCsvReader(2020, self.server.bulk_url, self.cache)
+        with reader.open() as stream:
+            self.assertEqual(os.path.dirname(stream.name), self.directory.name)
+            months = list(reader.read_months(stream))
+        self.assertEqual([month for month, _ in months], list(range(1, 12)))
+
+        direct = BulkCsvReader(2020, self.server.bulk_url)
+        with direct.open() as stream:
+            self.assertEqual(months, list(direct.read_months(stream)))
+
+if __name__ == "__main__":
+    unittest.main()
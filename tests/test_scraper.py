@@ -0,0 +1,57 @@
+"""
+Test that WeatherScraper parses pages read straight from the response.
+By: Ha Phuong Le
+"""
+from datetime import datetime
+import io
+import tempfile
+import unittest
+from benchmarks.replay_server import ReplayServer
+from http_client import HttpSession
+from response_cache import ResponseCache
+from scrape_weather import WeatherScraper
+
+class TestScraper(unittest.TestCase):
+    """
+    Load a month of the replay server in every way a page is read
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Start the replay server
+        By: Ha Phuong Le
+        """
+        self.server = ReplayServer((2020, 1), (2020, 11)).__enter__()
+        self.month = datetime(2020, 10, 1)
+
+    def tearDown(self):
+        """
+        Stop the server
+        By: Ha Phuong Le
+        """
+        self.server.__exit__(None, None, None)
+
+    def test_load_data(self):
+        """
+        Pages read from the response of the session, of urllib or from the
+        cache give the days of the downloaded page
+        By: Ha Phuong Le
+        """
+        page = WeatherScraper(self.month, self.server.url).fetch_page()
+        expected = WeatherScraper(self.month)
+        expected.parse_stream(io.BytesIO(page))
+        self.assertEqual(len(expected.weather), 31)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for cache, session in ((None, HttpSession(rate=None)), (None, None),
+                                   (ResponseCache(directory), None)):
+                scraper = WeatherScraper(self.month, self.server.url, cache, session=session)
+                with scraper.open_page() as (_, charset):
+                    self.assertEqual(charset, "utf-8")
+                scraper = WeatherScraper(self.month, self.server.url, cache, session=session)
+                scraper.load_data()
+                self.assertTrue(scraper.available_date)
+                self.assertEqual(scraper.weather, expected.weather)
+
+if __name__ == "__main__":
+    unittest.main()
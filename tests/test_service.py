@@ -0,0 +1,123 @@
+"""
+Test how the query service answers when the db fails.
+By: Ha Phuong Le
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from db_operations import DBOperations
+from dbcm import DBCM
+from scrape_weather import DayRecord
+from weather_service import WeatherService
+
+class TestService(unittest.TestCase):
+    """
+    Query a service over a temporary db with two years of days
+    By: Ha Phuong Le
+    """
+    def setUp(self):
+        """
+        Fill a db and start the service on a free port
+        By: Ha Phuong Le
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = DBOperations(os.path.join(self.directory.name, "weather.sqlite"))
+        self.database.initialize_db()
+        self.database.save_months([(27174, [DayRecord(year * 10000 + month * 100 + day, 1.0, -1.0, 0.0)
+                                            for day in range(1, 29)])
+                                   for year in (2019, 2020) for month in range(1, 13)])
+
+        self.service = WeatherService(self.database, port=0, threads=1)
+        self.thread = threading.Thread(target=self.service.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        """
+        Stop the service and remove the db
+        By: Ha Phuong Le
+        """
+        self.service.shutdown()
+        self.thread.join()
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def get(self, path):
+        """
+        Return the status and the body of a GET request
+        By: Ha Phuong Le
+        """
+        try:
+            with urllib.request.urlopen(self.service.url + path) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def fail_after(self, rows):
+        """
+        Make fetch_range fail after yielding some rows
+        By: Ha Phuong Le
+        """
+        fetch_range = self.database.fetch_range
+
+        def failing(*args):
+            for count, row in enumerate(fetch_range(*args)):
+                if count == rows:
+                    raise RuntimeError("disk I/O error")
+                yield row
+        self.database.fetch_range = failing
+
+    def test_stream(self):
+        """
+        A long range is streamed whole
+        By: Ha Phuong Le
+        """
+        status, body = self.get("/daily?start=2019-01-01&end=2020-12-31")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), 2 * 12 * 28)
+
+    def test_failed_stream_is_cut_short(self):
+        """
+        A failure in the middle of a stream ends the connection without the
+        last chunk, and without an error response inside the body
+        By: Ha Phuong Le
+        """
+        self.fail_after(600)
+        host, port = self.service.server.server_address[:2]
+        with socket.create_connection((host, port)) as conn:
+            conn.sendall(b"GET /daily?start=2019-01-01&end=2020-12-31 HTTP/1.1\r\n"
+                         b"Host: localhost\r\nConnection: close\r\n\r\n")
+            data = b"".join(iter(lambda: conn.recv(65536), b""))
+
+        headers, _, body = data.partition(b"\r\n\r\n")
+        self.assertTrue(headers.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b'"date": "2019-01-01"', body)
+        self.assertNotIn(b"HTTP/1.1 500", body)
+        self.assertFalse(body.endswith(b"0\r\n\r\n"))
+
+    def test_failure_before_the_answer(self):
+        """
+        A failure before anything is sent is answered with 500
+        By: Ha Phuong Le
+        """
+        self.fail_after(10)
+        status, body = self.get("/daily?start=2020-01-01&end=2020-02-28")
+        self.assertEqual(status, 500)
+        self.assertEqual(json.loads(body), {"error": "internal error"})
+
+    def test_fetch_range_raises(self):
+        """
+        fetch_range raises db errors instead of ending the rows early
+        By: Ha Phuong Le
+        """
+        with DBCM(self.database.database) as cur:
+            cur.execute("drop table samples")
+        with self.assertRaises(Exception):
+            list(self.database.fetch_range("2020-01-01", "2020-12-31"))
+
+if __name__ == "__main__":
+    unittest.main()
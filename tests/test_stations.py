@@ -0,0 +1,67 @@
+"""
+Test that every station a processor downloads is listed.
+By: Nguyen Anh Thu Mai
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.request
+from dbcm import DBCM
+from weather_processor import WeatherProcessor
+from weather_service import WeatherService
+
+class TestStations(unittest.TestCase):
+    """
+    List the stations of a processor in db and over HTTP
+    By: Nguyen Anh Thu Mai
+    """
+    def setUp(self):
+        """
+        Create a processor of two stations on an empty db
+        By: Nguyen Anh Thu Mai
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "weather.sqlite")
+        self.processor = WeatherProcessor(self.path, cache_dir=None, stations=(27174, 51097))
+
+    def tearDown(self):
+        """
+        Close the pooled connections and remove the db
+        By: Nguyen Anh Thu Mai
+        """
+        DBCM.close_all()
+        self.directory.cleanup()
+
+    def test_second_station_is_listed(self):
+        """
+        A station other than the default one is listed with a name of its id,
+        and a name given later is kept
+        By: Nguyen Anh Thu Mai
+        """
+        database = self.processor.database
+        self.assertEqual(database.get_stations(), [(27174, "Winnipeg, MB"), (51097, "Station 51097")])
+
+        database.add_station(51097, "Winnipeg A CS")
+        WeatherProcessor(self.path, cache_dir=None, stations=(51097,))
+        self.assertEqual(database.get_stations(), [(27174, "Winnipeg, MB"), (51097, "Winnipeg A CS")])
+
+    def test_service_lists_second_station(self):
+        """
+        GET /stations lists the second station
+        By: Nguyen Anh Thu Mai
+        """
+        service = WeatherService(self.path, port=0, threads=1)
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with urllib.request.urlopen(f"{service.url}/stations") as response:
+                stations = json.load(response)
+        finally:
+            service.shutdown()
+            thread.join()
+        self.assertEqual([station["station"] for station in stations], [27174, 51097])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,351 @@
+"""
+Create a command-line interface to download, update, plot, export and serve
+the weather data without prompts, for cron jobs and schedulers.
+By: Ha Phuong Le
+"""
+import argparse
+from datetime import datetime
+import logging
+import os
+import sys
+import time
+
+# Exit codes, argparse exits with 2 on bad arguments
+OK, FAILED, INCOMPLETE = 0, 1, 3
+
+def year_range(text):
+    """
+    Parse a YYYY-YYYY year range
+    By: Ha Phuong Le
+    """
+    try:
+        from_year, to_year = (int(year) for year in text.split("-"))
+        if from_year > to_year:
+            raise ValueError
+        return from_year, to_year
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a year range as YYYY-YYYY, got {text!r}")
+
+def month_year(text):
+    """
+    Parse a MM-YYYY month, or a YYYY year or YYYY-YYYY year range for all their months
+    By: Ha Phuong Le
+    """
+    try:
+        if len(text) == 7 and text[2] == "-":
+            return [datetime.strptime(text, "%m-%Y")]
+        from_year, to_year = year_range(text) if "-" in text else (int(text), int(text))
+        return [datetime(year, month, 1) for year in range(from_year, to_year + 1) for month in range(1, 13)]
+    except (ValueError, argparse.ArgumentTypeError):
+        raise argparse.ArgumentTypeError(f"expected a month as MM-YYYY or years as YYYY or YYYY-YYYY, got {text!r}")
+
+def open_database(args):
+    """
+    Return the db the options describe: the path of a SQLite file, or a
+    PartitionedDB of the directory with --partition-by
+    By: Ha Phuong Le
+    """
+    if not args.partition_by:
+        return args.database
+
+    from partitioned_db import PartitionedDB
+
+    database = PartitionedDB(args.database, args.partition_by)
+    database.initialize_db()
+    return database
+
+def make_processor(args):
+    """
+    Create the WeatherProcessor the options describe
+    By: Ha Phuong Le
+    """
+    from weather_processor import WeatherProcessor
+
+    options = {"base_url": args.base_url} if args.base_url else {}
+    if args.bulk_url:
+        options["bulk_url"] = args.bulk_url
+    return WeatherProcessor(open_database(args), workers=args.workers,
+                            cache_dir=None if args.no_cache else args.cache_dir,
+                            stations=args.station, rate=args.rate, parse_processes=args.parse_processes,
+                            source=args.source, snapshot_dir=args.snapshot_dir, **options)
+
+def use_backend(args):
+    """
+    Draw charts without a display unless they are shown on screen
+    By: Nguyen Anh Thu Mai
+    """
+    import matplotlib
+
+    if not args.show:
+        matplotlib.use("Agg")
+        os.makedirs(args.output_dir, exist_ok=True)
+
+def render(args, ranges=(), months=()):
+    """
+    Render box plots of year ranges and line plots of months on a pool of
+    processes and print the render time of each
+    By: Nguyen Anh Thu Mai
+    """
+    from chart_batch import ChartBatch
+
+    batch = ChartBatch(open_database(args), args.output_dir, args.format, args.jobs, args.station[0], args.snapshot_dir)
+    for from_year, to_year in ranges:
+        batch.add_boxplot(from_year, to_year)
+    for month in months:
+        batch.add_lineplot(month.year, month.month)
+
+    start = time.perf_counter()
+    charts = failed = 0
+    for output, seconds in batch.run():
+        charts += 1
+        if seconds is None:
+            failed += 1
+            print(f"{output}  failed", file=sys.stderr)
+        else:
+            print(f"{output}  {seconds * 1000:.0f} ms")
+
+    elapsed = time.perf_counter() - start
+    print(f"{charts - failed} charts rendered in {elapsed:.2f} s", file=sys.stderr)
+    return FAILED if failed else OK
+
+def finished(processor, counts):
+    """
+    Return the exit code of a download: FAILED if it stopped on an error,
+    INCOMPLETE if months could not be downloaded
+    By: Ha Phuong Le
+    """
+    if counts is None:
+        return FAILED
+    return OK if processor.complete else INCOMPLETE
+
+def download(args):
+    """
+    Download the full history of the stations
+    By: Ha Phuong Le
+    """
+    processor = make_processor(args)
+    return finished(processor, processor.get_fullset())
+
+def update(args):
+    """
+    Download the months missing from the db
+    By: Ha Phuong Le
+    """
+    processor = make_processor(args)
+    return finished(processor, processor.update_weather())
+
+def boxplot(args):
+    """
+    Draw a box plot for every year range
+    By: Nguyen Anh Thu Mai
+    """
+    use_backend(args)
+    if not args.show:
+        return render(args, ranges=args.ranges)
+
+    processor = make_processor(args)
+    for from_year, to_year in args.ranges:
+        stats = processor.database.fetch_box_stats(from_year, to_year, args.station[0])
+        processor.plot.display_box_stats(stats, from_year, to_year)
+    return OK
+
+def lineplot(args):
+    """
+    Draw a line plot for every month
+    By: Ha Phuong Le
+    """
+    use_backend(args)
+    months = [month for months in args.months for month in months]
+    if not args.show:
+        return render(args, months=months)
+
+    processor = make_processor(args)
+    for month in months:
+        dates, means = processor.lineplot_data(month, args.station[0])
+        processor.plot.display_line_plot(dates, means, month.strftime("%B, %Y"))
+    return OK
+
+def export(args):
+    """
+    Write the daily samples between two dates, of the given stations or all
+    of them, to a file or to one file per year
+    By: Nguyen Anh Thu Mai
+    """
+    from weather_export import WeatherExporter
+
+    files = WeatherExporter(open_database(args)).export(args.output, args.format, args.start, args.end,
+                                                        args.station, args.by_year)
+    for path, rows in files.items():
+        print(f"{path or '-'}  {rows} rows", file=sys.stderr)
+    return OK
+
+def serve(args):
+    """
+    Answer JSON queries on the db over HTTP until interrupted
+    By: Ha Phuong Le
+    """
+    from weather_service import WeatherService
+
+    service = WeatherService(open_database(args), args.host, args.port, args.threads, args.cache_size)
+    print(f"Serving {args.database} on {service.url}", file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return OK
+
+def snapshot(args):
+    """
+    Write or update the snapshots of the stations
+    By: Nguyen Anh Thu Mai
+    """
+    from weather_snapshot import WeatherSnapshot
+
+    snapshots = WeatherSnapshot(args.snapshot_dir or "snapshots", open_database(args))
+    for station_id in args.station:
+        days = snapshots.write(station_id) if args.rewrite else snapshots.update(station_id)
+        print(f"{snapshots.path(station_id)}  {days} days written", file=sys.stderr)
+    return OK
+
+def migrate(args):
+    """
+    Convert a db keyed by date text to integer days in one pass and vacuum it
+    By: Ha Phuong Le
+    """
+    from db_operations import DBOperations
+
+    if args.partition_by:
+        raise ValueError("migrate converts a single SQLite file, partitions always store integer days")
+    if not os.path.exists(args.database):
+        raise FileNotFoundError(f"no database at {args.database}")
+
+    size = os.path.getsize(args.database)
+    counts = DBOperations(args.database).migrate(vacuum=not args.no_vacuum)
+    if counts is None:
+        print(f"{args.database} already stores integer days", file=sys.stderr)
+    else:
+        print(f"{counts[0]} rows converted, {counts[1]} dropped", file=sys.stderr)
+    print(f"{size // 1024} KiB -> {os.path.getsize(args.database) // 1024} KiB", file=sys.stderr)
+    return OK
+
+def partitions(args):
+    """
+    List the partitions of a partitioned db, after dropping the given ones
+    By: Ha Phuong Le
+    """
+    if not args.partition_by:
+        raise ValueError("partitions needs --partition-by")
+
+    database = open_database(args)
+    for key in args.drop or ():
+        if not database.drop_partition(key):
+            raise ValueError(f"no partition {key}")
+        print(f"{key}  dropped", file=sys.stderr)
+    for key, value, size in database.get_partitions():
+        print(f"{key}  {value}  {size // 1024} KiB")
+    return OK
+
+def make_parser():
+    """
+    Build the argument parser with a subcommand per task
+    By: Ha Phuong Le
+    """
+    parser = argparse.ArgumentParser(prog="weather_cli", description=__doc__.split("By:")[0].strip())
+    parser.add_argument("--database", default="weather.sqlite",
+                        help="SQLite file, or directory with --partition-by (default: %(default)s)")
+    parser.add_argument("--partition-by", choices=("station", "decade"),
+                        help="keep the samples in a SQLite file per station or per decade under --database")
+    parser.add_argument("--station", type=int, action="append",
+                        help="station id, repeat for several stations (default: 27174)")
+    parser.add_argument("--workers", type=int, default=8, help="months downloaded at the same time")
+    parser.add_argument("--parse-processes", type=int, default=0, metavar="N",
+                        help="parse pages on N processes, for large backfills (default: on one thread)")
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second, 0 for no limit")
+    parser.add_argument("--source", choices=("html", "csv"), default="html",
+                        help="download monthly pages or yearly bulk CSV files (default: %(default)s)")
+    parser.add_argument("--base-url", help="daily data page of the website or of a mirror")
+    parser.add_argument("--bulk-url", help="bulk data download of the website or of a mirror")
+    parser.add_argument("--cache-dir", default="http_cache", help="directory of the page cache")
+    parser.add_argument("--no-cache", action="store_true", help="do not cache downloaded pages")
+    parser.add_argument("--snapshot-dir", metavar="DIR",
+                        help="keep memory-mapped snapshots of the stations here, updated after ingest and read by plots")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="save the timings and counters of the run, as Prometheus text for .prom, JSON otherwise")
+    parser.add_argument("--profile", metavar="FILE", help="profile the run with cProfile and save the stats")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("download", help="download the full history")
+    command.set_defaults(run=download)
+
+    command = commands.add_parser("update", help="download the months missing from the db")
+    command.set_defaults(run=update)
+
+    for name, run, value, help_text in (("boxplot", boxplot, year_range, "YYYY-YYYY year ranges"),
+                                        ("lineplot", lineplot, month_year, "MM-YYYY months, or YYYY and YYYY-YYYY for every month")):
+        command = commands.add_parser(name, help=f"draw a {name} per argument")
+        command.add_argument("ranges" if name == "boxplot" else "months", type=value, nargs="+",
+                             metavar="RANGE" if name == "boxplot" else "MONTH", help=help_text)
+        command.add_argument("--output-dir", default=".", help="directory the charts are saved to")
+        command.add_argument("--format", choices=("png", "svg", "pdf"), default="png")
+        command.add_argument("--show", action="store_true", help="show the charts instead of saving them")
+        command.add_argument("--jobs", type=int, help="processes rendering charts (default: all CPUs)")
+        command.set_defaults(run=run)
+
+    command = commands.add_parser("export", help="write daily samples to CSV, NDJSON, Parquet or Arrow")
+    command.add_argument("--start", help="first date, YYYY-MM-DD")
+    command.add_argument("--end", help="last date, YYYY-MM-DD")
+    command.add_argument("--format", choices=("csv", "ndjson", "parquet", "arrow"), default="csv")
+    command.add_argument("--by-year", action="store_true", help="write OUTPUT/year=YYYY/samples.<format> files")
+    command.add_argument("-o", "--output", help="file, or directory with --by-year (default: standard output)")
+    command.set_defaults(run=export)
+
+    command = commands.add_parser("serve", help="answer JSON queries over HTTP")
+    command.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    command.add_argument("--port", type=int, default=8080, help="port to listen on (default: %(default)s)")
+    command.add_argument("--threads", type=int, default=8, help="requests answered at the same time")
+    command.add_argument("--cache-size", type=int, default=512, help="query results kept in memory, 0 for none")
+    command.set_defaults(run=serve)
+
+    command = commands.add_parser("snapshot", help="write the memory-mapped snapshots of the stations")
+    command.add_argument("--rewrite", action="store_true", help="rewrite the files instead of appending new days")
+    command.set_defaults(run=snapshot)
+
+    command = commands.add_parser("migrate", help="convert an older db to integer days and vacuum it")
+    command.add_argument("--no-vacuum", action="store_true", help="leave the space of the old table in the file")
+    command.set_defaults(run=migrate)
+
+    command = commands.add_parser("partitions", help="list the partitions of a partitioned db")
+    command.add_argument("--drop", action="append", metavar="KEY", help="drop a partition first, repeat for several")
+    command.set_defaults(run=partitions)
+
+    return parser
+
+def main(argv=None):
+    """
+    Run a command and return its exit code
+    By: Ha Phuong Le
+    """
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(filename="errors.log", level=logging.ERROR)
+    # Exports cover every station unless some are given
+    if args.command != "export":
+        args.station = args.station or [27174]
+    from metrics import METRICS, Profiler
+
+    profiler = Profiler() if args.profile else None
+    if profiler:
+        profiler.start()
+    try:
+        return args.run(args)
+    except Exception as exception:
+        logging.error(f"weather_cli:{args.command}: {exception}")
+        print(f"weather_cli: {exception}", file=sys.stderr)
+        return FAILED
+    finally:
+        if profiler:
+            profiler.stop(args.profile, stream=sys.stderr)
+        if args.metrics:
+            METRICS.write(args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
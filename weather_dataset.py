@@ -0,0 +1,167 @@
+"""
+Create a columnar in-memory dataset of the weather data for analytics and plotting.
+By: Nguyen Anh Thu Mai
+"""
+import logging
+import numpy as np
+from db_operations import DEFAULT_STATION
+
+# Columns of temperatures held by the dataset
+COLUMNS = ("max", "min", "mean")
+
+class WeatherDataset:
+    """
+    Hold the dates and the max, min and mean temperatures as NumPy arrays
+    sorted by date, with vectorized slicing and grouped aggregates
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, dates, max_temps, min_temps, mean_temps):
+        """
+        Initialize the arrays, sorting them by date if needed
+        By: Nguyen Anh Thu Mai
+        """
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.max = np.asarray(max_temps, dtype=np.float64)
+        self.min = np.asarray(min_temps, dtype=np.float64)
+        self.mean = np.asarray(mean_temps, dtype=np.float64)
+
+        if len(self.dates) > 1 and np.any(self.dates[1:] < self.dates[:-1]):
+            order = np.argsort(self.dates, kind="stable")
+            self.dates = self.dates[order]
+            for column in COLUMNS:
+                setattr(self, column, getattr(self, column)[order])
+
+    @classmethod
+    def from_database(cls, database, start="0000-01-01", end="9999-12-31", station_id=DEFAULT_STATION):
+        """
+        Load the rows of a station between two dates from DBOperations in one bulk read
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            columns = database.fetch_columns(start, end, station_id)
+            return cls(columns["date"], columns["max"], columns["min"], columns["mean"])
+        except Exception as exception:
+            logging.error(f"WeatherDataset:from_database: {exception}")
+            return cls([], [], [], [])
+
+    @classmethod
+    def views(cls, dates, max_temps, min_temps, mean_temps):
+        """
+        Wrap arrays already sorted by date, such as views of a memory-mapped
+        snapshot, without copying or checking them
+        By: Nguyen Anh Thu Mai
+        """
+        dataset = cls.__new__(cls)
+        dataset.dates, dataset.max, dataset.min, dataset.mean = dates, max_temps, min_temps, mean_temps
+        return dataset
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _take(self, index):
+        """
+        Return a dataset of the rows selected by a slice or a mask
+        By: Nguyen Anh Thu Mai
+        """
+        return WeatherDataset(self.dates[index], self.max[index], self.min[index], self.mean[index])
+
+    def between(self, start, end):
+        """
+        Return the rows between two dates, both included, as views of the arrays
+        By: Nguyen Anh Thu Mai
+        """
+        first = np.searchsorted(self.dates, np.datetime64(start, "D"), side="left")
+        last = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right")
+        return self._take(slice(first, last))
+
+    def year(self, year):
+        """
+        Return the rows of a year
+        By: Nguyen Anh Thu Mai
+        """
+        return self.between(f"{year:04d}-01-01", f"{year:04d}-12-31")
+
+    def month(self, year, month):
+        """
+        Return the rows of a month of a year
+        By: Nguyen Anh Thu Mai
+        """
+        start = np.datetime64(f"{year:04d}-{month:02d}", "M")
+        return self.between(start.astype("datetime64[D]"), (start + 1).astype("datetime64[D]") - 1)
+
+    @property
+    def years(self):
+        """
+        Return the year of every row
+        By: Nguyen Anh Thu Mai
+        """
+        return self.dates.astype("datetime64[Y]").astype(np.int64) + 1970
+
+    @property
+    def months(self):
+        """
+        Return the month of the year, 1 to 12, of every row
+        By: Nguyen Anh Thu Mai
+        """
+        return self.dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+    @property
+    def days(self):
+        """
+        Return the day of the month of every row
+        By: Nguyen Anh Thu Mai
+        """
+        return (self.dates - self.dates.astype("datetime64[M]")).astype(np.int64) + 1
+
+    def by_month(self, column="mean"):
+        """
+        Return a column split into twelve arrays, one per month of the year
+        By: Nguyen Anh Thu Mai
+        """
+        values = getattr(self, column)
+        months = self.months
+        order = np.argsort(months, kind="stable")
+        bounds = np.searchsorted(months[order], np.arange(1, 14))
+        return [values[order[bounds[i]:bounds[i + 1]]] for i in range(12)]
+
+    def monthly_mean(self, column="mean"):
+        """
+        Return the first day of every (year, month) with data and the mean of a column in it
+        By: Nguyen Anh Thu Mai
+        """
+        periods = self.dates.astype("datetime64[M]")
+        starts, groups = np.unique(periods, return_inverse=True)
+        sums = np.bincount(groups, weights=getattr(self, column), minlength=len(starts))
+        counts = np.bincount(groups, minlength=len(starts))
+        return starts.astype("datetime64[D]"), sums / np.maximum(counts, 1)
+
+    def percentiles(self, q=(25, 50, 75), column="mean"):
+        """
+        Return the percentiles of a column for every month of the year as a 12 x len(q) array
+        By: Nguyen Anh Thu Mai
+        """
+        return np.array([np.percentile(values, q) if len(values) else np.full(len(q), np.nan)
+                         for values in self.by_month(column)])
+
+    def anomalies(self, column="mean"):
+        """
+        Return the difference of every row to the average of its month of the year
+        By: Nguyen Anh Thu Mai
+        """
+        values = getattr(self, column)
+        months = self.months - 1
+        sums = np.bincount(months, weights=values, minlength=12)
+        counts = np.bincount(months, minlength=12)
+        return values - (sums / np.maximum(counts, 1))[months]
+
+    def rolling(self, window, column="mean"):
+        """
+        Return the mean of a column over a rolling window of rows, NaN until the window is full
+        By: Nguyen Anh Thu Mai
+        """
+        values = getattr(self, column)
+        result = np.full(len(values), np.nan)
+        if 0 < window <= len(values):
+            sums = np.cumsum(np.concatenate(([0.0], values)))
+            result[window - 1:] = (sums[window:] - sums[:-window]) / window
+        return result
@@ -0,0 +1,262 @@
+"""
+Create a class to export the daily samples to CSV, NDJSON, Parquet or Arrow files.
+By: Nguyen Anh Thu Mai
+"""
+import csv
+from datetime import date
+import heapq
+from itertools import islice
+import json
+import logging
+from operator import itemgetter
+import os
+import sys
+from db_operations import DAY_TEXT, day_number
+from dbcm import DBCM
+
+# Columns written by every format, in order
+COLUMNS = ("station_id", "sample_date", "max_temp", "min_temp", "avg_temp")
+
+# File extension of every format
+EXTENSIONS = {"csv": "csv", "ndjson": "ndjson", "parquet": "parquet", "arrow": "arrow"}
+
+# Rows read from the db and written at a time
+CHUNK_ROWS = 10000
+
+# Order of the exported rows, by date then station
+ROW_ORDER = itemgetter(1, 0)
+
+class CsvWriter:
+    """
+    Write rows to a CSV file with a header
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, file):
+        """
+        Initialize the attributes and write the header
+        By: Nguyen Anh Thu Mai
+        """
+        self.file = file
+        self.writer = csv.writer(file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        """
+        Write a chunk of rows
+        By: Nguyen Anh Thu Mai
+        """
+        self.writer.writerows(rows)
+
+    def close(self):
+        """
+        Close the file unless it is standard output
+        By: Nguyen Anh Thu Mai
+        """
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class NdjsonWriter:
+    """
+    Write rows to a file as one JSON object per line
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, file):
+        """
+        Initialize the attributes
+        By: Nguyen Anh Thu Mai
+        """
+        self.file = file
+
+    def write(self, rows):
+        """
+        Write a chunk of rows
+        By: Nguyen Anh Thu Mai
+        """
+        self.file.write("".join(json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in rows))
+
+    def close(self):
+        """
+        Close the file unless it is standard output
+        By: Nguyen Anh Thu Mai
+        """
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class ArrowWriter:
+    """
+    Write rows to a Parquet or Arrow IPC file one record batch per chunk.
+    pyarrow is only needed for these formats
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, path, file_format):
+        """
+        Open the file with the schema of the samples
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(f"pyarrow is required to export {file_format}, install it with 'pip install pyarrow'")
+
+        self.pa = pa
+        self.schema = pa.schema([("station_id", pa.int32()), ("sample_date", pa.date32()),
+                                 ("max_temp", pa.float64()), ("min_temp", pa.float64()),
+                                 ("avg_temp", pa.float64())])
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        """
+        Write a chunk of rows as one record batch
+        By: Nguyen Anh Thu Mai
+        """
+        station_ids, dates, max_temps, min_temps, avg_temps = zip(*rows)
+        columns = (station_ids, [date.fromisoformat(day) for day in dates], max_temps, min_temps, avg_temps)
+        self.writer.write_batch(self.pa.record_batch(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        """
+        Write the footer and close the file
+        By: Nguyen Anh Thu Mai
+        """
+        self.writer.close()
+
+class WeatherExporter:
+    """
+    Stream the daily samples of the db, optionally between two dates and for
+    some stations, to a file or to one file per year. Rows are read and
+    written in chunks so memory stays the same however long the history is.
+    The db is a SQLite file or a PartitionedDB, whose files are read at once
+    and merged in order
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, database="weather.sqlite", chunk_rows=CHUNK_ROWS):
+        """
+        Initialize the attributes
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            self.database = database
+            self.chunk_rows = chunk_rows
+        except Exception as exception:
+            logging.error(f"WeatherExporter:__init__: {exception}")
+
+    def read_chunks(self, start=None, end=None, stations=None):
+        """
+        Yield the rows of samples in chunks, in date then station order. Every
+        station is read in the order of the primary key and the stations are
+        merged, so SQLite never has to sort the table
+        By: Nguyen Anh Thu Mai
+        """
+        conditions, params = ["station_id=?"], []
+        if start:
+            conditions.append("day >= ?")
+            params.append(day_number(start))
+        if end:
+            conditions.append("day <= ?")
+            params.append(day_number(end))
+
+        sql = f"""select station_id, {DAY_TEXT}, max_temp, min_temp, avg_temp from samples
+               where {' and '.join(conditions)} order by day"""
+        if isinstance(self.database, str):
+            files = [self.database]
+        else:
+            files = [self.database.path(key) for key in self.database.keys()]
+
+        rows = heapq.merge(*(self.read_file(database, sql, params, stations) for database in files), key=ROW_ORDER)
+        while True:
+            chunk = list(islice(rows, self.chunk_rows))
+            if not chunk:
+                break
+            yield chunk
+
+    def read_file(self, database, sql, params, stations=None):
+        """
+        Yield the rows of a query on a SQLite file for every station, or for
+        the given stations, in date then station order
+        By: Nguyen Anh Thu Mai
+        """
+        with DBCM(database) as cur:
+            stations = stations or list(self.list_stations(cur))
+            cursors = [cur.connection.execute(sql, (station_id, *params)) for station_id in stations]
+            try:
+                yield from heapq.merge(*cursors, key=ROW_ORDER)
+            finally:
+                for station_cursor in cursors:
+                    station_cursor.close()
+
+    def list_stations(self, cur):
+        """
+        Yield the stations of samples, seeking the next one on the primary key
+        instead of scanning every row
+        By: Nguyen Anh Thu Mai
+        """
+        station_id = cur.execute("select min(station_id) from samples").fetchone()[0]
+        while station_id is not None:
+            yield station_id
+            station_id = cur.execute("select min(station_id) from samples where station_id > ?",
+                                     (station_id,)).fetchone()[0]
+
+    def open_writer(self, path, file_format):
+        """
+        Return a writer of a format to a file, standard output when path is None
+        By: Nguyen Anh Thu Mai
+        """
+        if file_format in ("parquet", "arrow"):
+            if path is None:
+                raise ValueError(f"{file_format} needs an output file")
+            return ArrowWriter(path, file_format)
+
+        file = open(path, "w", newline="", encoding="utf-8") if path else sys.stdout
+        return CsvWriter(file) if file_format == "csv" else NdjsonWriter(file)
+
+    def export(self, path, file_format="csv", start=None, end=None, stations=None, by_year=False):
+        """
+        Export the samples to path, or to path/year=YYYY/samples.<format> for
+        every year when by_year is set. Return the number of rows of every file written
+        By: Nguyen Anh Thu Mai
+        """
+        if file_format not in EXTENSIONS:
+            raise ValueError(f"unknown format {file_format}, expected one of {', '.join(EXTENSIONS)}")
+        if by_year and not path:
+            raise ValueError("an output directory is needed to export by year")
+
+        files = {}
+        writer = current = None
+        try:
+            for rows in self.read_chunks(start, end, stations):
+                if not by_year:
+                    if writer is None:
+                        writer = self.open_writer(path, file_format)
+                    writer.write(rows)
+                    files[path] = files.get(path, 0) + len(rows)
+                    continue
+
+                # Rows come in date order, so one year file is open at a time
+                while rows:
+                    year = rows[0][1][:4]
+                    count = next((i for i, row in enumerate(rows) if row[1][:4] != year), len(rows))
+                    if year != current:
+                        if writer is not None:
+                            writer.close()
+                            writer = None
+                        current = year
+                        file_path = os.path.join(path, f"year={year}", f"samples.{EXTENSIONS[file_format]}")
+                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                        writer = self.open_writer(file_path, file_format)
+                    writer.write(rows[:count])
+                    files[file_path] = files.get(file_path, 0) + count
+                    rows = rows[count:]
+
+            # An empty export still writes a file with the header or schema
+            if writer is None and not by_year:
+                writer = self.open_writer(path, file_format)
+        finally:
+            if writer is not None:
+                writer.close()
+        return files
@@ -4,38 +4,96 @@ By: Ha Phuong Le
 """
 from datetime import datetime
 import logging
-from dateutil.relativedelta import relativedelta
-from scrape_weather import WeatherScraper
-from db_operations import DBOperations
-from plot_operations import PlotOperations
+from bulk_csv import BULK_URL
+from ingest_pipeline import IngestPipeline
+from scrape_weather import BASE_URL
+from response_cache import ResponseCache
+from http_client import HttpSession
+from db_operations import DBOperations, DEFAULT_STATION
+from metrics import METRICS
 
 class WeatherProcessor:
     """
     Prompt user for weather process selection and execute all the tasks
     By: Ha Phuong Le
     """
-    def __init__(self):
+    def __init__(self, database="weather.sqlite", workers=8, base_url=BASE_URL, cache_dir="http_cache",
+                 stations=(DEFAULT_STATION,), rate=5.0, parse_processes=0, source="html", bulk_url=BULK_URL,
+                 snapshot_dir=None):
         """
         Initialize the attributes
         By: Ha Phuong Le
         """
         try:
+            # Share keep-alive connections and a limit of rate requests per second
+            self.session = HttpSession(rate=rate, burst=max(1, workers))
+
+            # Keep downloaded pages on disk unless no cache directory is given
+            self.cache = ResponseCache(cache_dir, session=self.session) if cache_dir else None
+
+            # Report the request and cache counters with the metrics of the run
+            METRICS.collect("http", self.session.stats)
+            if self.cache is not None:
+                METRICS.collect("cache", self.cache.stats)
+
             # Scrape weather data
             self.today = datetime.now()
-            self.scraper = WeatherScraper(self.today)
+            self.base_url = base_url
+
+            # Download monthly HTML pages, or yearly bulk CSV files from bulk_url
+            self.source = source
+            self.bulk_url = bulk_url
+
+            # Stations to download, the first one is plotted
+            self.stations = list(stations)
+
+            # Number of months downloaded at the same time, shared by all stations
+            self.workers = max(1, workers)
+
+            # Number of processes parsing pages, 0 parses them on one thread
+            self.parse_processes = max(0, parse_processes)
+
+            # Number of months written to the db in one transaction
+            self.batch_months = 12
+
+            # Number of times months that failed to download are tried again
+            self.retry_rounds = 3
 
-            # Initialize database
-            self.database = DBOperations("weather.sqlite")
+            # (station_id, month) months given up on, and stations whose
+            # history stopped on failed pages, over every download of the processor
+            self.given_up = []
+            self.stopped = []
+
+            # Initialize database, a SQLite file or a PartitionedDB
+            self.database = DBOperations(database) if isinstance(database, str) else database
             self.database.initialize_db()
+            self.database.add_stations(self.stations)
+
+            # Plot operator, created when the first chart is drawn
+            self._plot = None
 
-            # Access plot operator
-            self.plot = PlotOperations()
+            # Weather data of every station loaded for plotting, reloaded after the db changes
+            self.datasets = {}
+
+            # Directory of the memory-mapped snapshots plotting reads, kept up to date after ingest
+            self.snapshot_dir = snapshot_dir
 
             # Create log file
             logging.basicConfig(filename='errors.log', filemode='w', level=logging.ERROR)
         except Exception as exception:
             logging.error(f"WeatherProcessor:__init__: {exception}")
 
+    @property
+    def plot(self):
+        """
+        Return the plot operator. matplotlib is only imported for commands that draw charts
+        By: Nguyen Anh Thu Mai
+        """
+        if self._plot is None:
+            from plot_operations import PlotOperations
+            self._plot = PlotOperations()
+        return self._plot
+
     def get_weather(self):
         """
         Present user with a menu of choices and get the user selection
@@ -56,34 +114,75 @@ class WeatherProcessor:
         except Exception as exception:
             logging.error(f"WeatherProcessor:get_weather: {exception}")
 
-    def get_fullset(self):
+    def pipeline(self):
         """
-        Download a full set of weather data
+        Return an ingest pipeline that downloads with the session and cache of the processor
         By: Ha Phuong Le
         """
-        try:
-            # Delete existing db
-            self.database.purge_data()
+        return IngestPipeline(self.database, self.base_url, self.cache, self.session, self.workers,
+                              self.batch_months, self.retry_rounds, parse_processes=self.parse_processes,
+                              source=self.source, bulk_url=self.bulk_url)
 
-            # Load new data
-            print("\nScraping weather data from the website...")
-            self.database.initialize_db()
-            self.scraper.load_data()
-
-            while self.scraper.available_date:
-                try:
-                    # Save data to database
-                    self.database.save_data(self.scraper.weather)
+    def run_pipeline(self, *args, **kwargs):
+        """
+        Run an ingest pipeline, keep the months it gave up on and return it with its counts
+        By: Ha Phuong Le
+        """
+        pipeline = self.pipeline()
+        counts = pipeline.run(*args, **kwargs)
+        self.given_up.extend(pipeline.given_up)
+        self.stopped.extend(pipeline.stopped)
+        if not pipeline.complete:
+            print(f"\n{len(pipeline.given_up)} months could not be downloaded"
+                  + (f", stations {', '.join(map(str, pipeline.stopped))} stopped on failed pages."
+                     if pipeline.stopped else "."))
+        return pipeline, counts
+
+    @property
+    def complete(self):
+        """
+        Return whether every download of the processor got all of its months
+        By: Ha Phuong Le
+        """
+        return not self.given_up and not self.stopped
 
-                    # Load data from the next page
-                    self.today -= relativedelta(months=1)
+    def get_fullset(self, stations=None):
+        """
+        Download a full set of weather data, for all stations of the processor
+        or for the given stations only. A full set of all stations is loaded
+        into a shadow table with a checkpoint per month, so an interrupted or
+        incomplete download resumes where it stopped and the current data stays
+        readable until a run gets every month. Other stations in db are kept
+        By: Ha Phuong Le
+        """
+        try:
+            self.database.initialize_db()
 
-                    self.scraper = WeatherScraper(self.today)
-                    self.scraper.load_data()
-                except Exception as exception:
-                    logging.error(f"WeatherProcessor:get_fullset:loop {exception}")
+            rebuild = stations is None
+            finished = self.database.begin_rebuild() if rebuild else set()
+            if finished:
+                print(f"\nResuming the download, {len(finished)} months already saved.")
 
-            print("\nDownloading completed.")
+            # Download, parse and save the months of every station at the same time
+            print("\nScraping weather data from the website...")
+            pipeline, (inserted, skipped) = self.run_pipeline(self.today, stations or self.stations, finished,
+                                                              checkpoints=rebuild)
+            print("\n" + "\n".join(pipeline.report()))
+
+            # Keep the old data and the months saved so far until a run gets every month
+            if rebuild and not pipeline.complete:
+                print("\nThe current data is kept, download again to resume.")
+                return inserted, skipped
+
+            # Replace the old data now that the download is complete
+            if rebuild and not self.database.finish_rebuild(self.stations):
+                print("\nThe downloaded data could not be swapped in, download again to retry.")
+                return None
+
+            self.datasets = {}
+            self.refresh_snapshots(stations or self.stations)
+            print(f"\nDownloading completed. {inserted} days saved, {skipped} skipped.")
+            return inserted, skipped
         except Exception as exception:
             logging.error(f"WeatherProcessor:get_fullset: {exception}")
 
@@ -93,36 +192,84 @@ class WeatherProcessor:
         By: Ha Phuong Le
         """
         try:
-            # Get the latest date of data in db
-            print("\nChecking the latest date of weather data...")
-            db_date = self.database.get_latest_date()
+            inserted = skipped = 0
+
+            # Find the months that are missing in db for every station
+            print("\nChecking the missing months of weather data...")
+            missing = {station_id: self.database.get_missing_months((self.today.year, self.today.month), station_id)
+                       for station_id in self.stations}
+
+            # Download the whole history of stations without data
+            new_stations = [station_id for station_id, months in missing.items() if months is None]
+            if new_stations:
+                inserted, skipped = self.get_fullset(new_stations)
+
+            # Update the stations that have data
+            jobs = [(datetime(year, month, 1), station_id)
+                    for station_id, months in missing.items() if months
+                    for year, month in months]
+            if jobs:
+                print(f"\nScraping {len(jobs)} months of weather data from the website...")
+
+                # Pages that fall back to another month have no data to save
+                _, counts = self.run_pipeline(jobs=jobs)
+                inserted, skipped = inserted + counts[0], skipped + counts[1]
+                self.datasets = {}
+                self.refresh_snapshots(self.stations)
+                print(f"\n{counts[0]} days saved, {counts[1]} skipped.")
 
-            # Create a new db if not exists
-            if db_date is None:
-                self.get_fullset()
-            # Update current db if exists
-            else:
-                latest_date = datetime.strptime(db_date, "%Y-%m-%d")
+            print("\nUpdating completed.")
+            return inserted, skipped
+        except Exception as exception:
+            logging.error(f"WeatherProcessor:update_weather: {exception}")
 
-                # Update data
-                print("\nScraping weather data from the website...")
-                self.scraper.load_data()
+    def refresh_snapshots(self, stations):
+        """
+        Append the new days of the stations to their snapshots, if snapshots are kept
+        By: Nguyen Anh Thu Mai
+        """
+        if not self.snapshot_dir:
+            return
+        try:
+            from weather_snapshot import WeatherSnapshot
 
-                while self.today > latest_date:
-                    try:
-                        # Save new data to database
-                        self.database.save_data(self.scraper.weather)
+            snapshot = WeatherSnapshot(self.snapshot_dir, self.database)
+            for station_id in stations:
+                snapshot.refresh(station_id)
+        except Exception as exception:
+            logging.error(f"WeatherProcessor:refresh_snapshots: {exception}")
 
-                        self.today -= relativedelta(months=1)
+    def get_dataset(self, station_id=None):
+        """
+        Return the weather data of a station as a dataset, loading it on first
+        use: mapped from its snapshot if snapshots are kept, read from db otherwise
+        By: Nguyen Anh Thu Mai
+        """
+        from weather_dataset import WeatherDataset
 
-                        self.scraper = WeatherScraper(self.today)
-                        self.scraper.load_data()
-                    except Exception as exception:
-                        logging.error(f"WeatherProcessor:update_weather:loop: {exception}")
+        station_id = station_id or self.stations[0]
+        if station_id not in self.datasets:
+            if self.snapshot_dir:
+                from weather_snapshot import WeatherSnapshot
+                self.datasets[station_id] = WeatherSnapshot(self.snapshot_dir, self.database).dataset(station_id)
+            else:
+                self.datasets[station_id] = WeatherDataset.from_database(self.database, station_id=station_id)
+        return self.datasets[station_id]
 
-            print("\nUpdating completed.")
-        except Exception as exception:
-            logging.error(f"WeatherProcessor:update_weather: {exception}")
+    def boxplot_data(self, from_year, to_year, station_id=None):
+        """
+        Return the mean temperatures of a range of years at a station grouped by month
+        By: Ha Phuong Le
+        """
+        return self.get_dataset(station_id).between(f"{from_year}-01-01", f"{to_year}-12-31").by_month()
+
+    def lineplot_data(self, month_year, station_id=None):
+        """
+        Return the days and mean temperatures of a month at a station
+        By: Ha Phuong Le
+        """
+        month = self.get_dataset(station_id).month(month_year.year, month_year.month)
+        return month.days, month.mean
 
     def get_boxplot(self):
         """
@@ -154,28 +301,13 @@ class WeatherProcessor:
                 except ValueError:
                     to_year = input("Enter to year as YYYY: ")
 
-            # Populate dictionary of weather data
-            mydict = {}
-            for i in range(1, 13):
-                mydict[i] = []
-
-            while from_year.strftime("%Y") <= to_year.strftime("%Y"):
-                try:
-                    mean = self.database.fetch_data(from_year.strftime("%Y-%m-%d"))
-
-                    if mean is not None:
-                        mydict[int(from_year.strftime("%-m"))].append(mean)
-
-                    from_year += relativedelta(days=1)
-
-                except Exception as exception:
-                    logging.error(f"WeatherProcessor:get_boxplot:whileloop: {exception}")
+            # Read the monthly summaries of the range
+            stats = self.database.fetch_box_stats(int(title_start), int(title_end), self.stations[0])
 
             # Generate box plot
-            self.plot.display_box_plot(mydict, title_start, title_end)
+            self.plot.display_box_stats(stats, title_start, title_end)
 
             print("\nThe box plot is generated successfully.")
-            self.get_choice()
 
         except Exception as exception:
             logging.error(f"WeatherProcessor:get_boxplot: {exception}")
@@ -198,49 +330,35 @@ class WeatherProcessor:
 
             # Populate dictionary of weather data
             title_month = month_year.strftime("%B, %Y")
-            month = (month_year.strftime("%-m"),)
-            dates = []
-            means = []
-
-            while month_year.strftime("%-m") == month[0]:
-                try:
-                    mean = self.database.fetch_data(month_year.strftime("%Y-%m-%d"))
-
-                    if mean is not None:
-                        dates.append(month_year.strftime("%-d"))
-                        means.append(mean)
-
-                    month_year += relativedelta(days=1)
-
-                except Exception as exception:
-                    logging.error(f"WeatherProcessor:get_lineplot:whileloop: {exception}")
+            dates, means = self.lineplot_data(month_year)
 
             # Generate line plot
             self.plot.display_line_plot(dates, means, title_month)
 
             print("\nThe line plot is generated successfully.")
-            self.get_choice()
 
         except Exception as exception:
             logging.error(f"WeatherProcessor:get_lineplot: {exception}")
 
     def get_choice(self):
         """
-        Prompt user to continue with boxplot, lineplot or exit
+        Prompt user to continue with boxplot, lineplot or exit until they exit
         By: Ha Phuong Le
         """
         try:
-            print("\nPlot another chart?")
-            user_choice = input("Enter 'B' for boxplot, 'L' for lineplot, or 'E' to exit: ")
-            while user_choice not in ('B', 'L', 'E'):
-                user_choice = input("Enter 'B', 'L' or 'E': ")
-
-            if user_choice == "B":
-                self.get_boxplot()
-            if user_choice == "L":
-                self.get_lineplot()
-            if user_choice == "E":
-                print("\nGoodbye!\n")
+            while True:
+                print("\nPlot another chart?")
+                user_choice = input("Enter 'B' for boxplot, 'L' for lineplot, or 'E' to exit: ")
+                while user_choice not in ('B', 'L', 'E'):
+                    user_choice = input("Enter 'B', 'L' or 'E': ")
+
+                if user_choice == "B":
+                    self.get_boxplot()
+                if user_choice == "L":
+                    self.get_lineplot()
+                if user_choice == "E":
+                    print("\nGoodbye!\n")
+                    break
         except Exception as exception:
             logging.error(f"WeatherProcessor:get_choice: {exception}")
 
@@ -250,5 +368,6 @@ if __name__ == "__main__":
         weather_processor = WeatherProcessor()
         weather_processor.get_weather()
         weather_processor.get_boxplot()
+        weather_processor.get_choice()
     except Exception as exception:
         logging.error(f"main: {exception}")
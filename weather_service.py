@@ -0,0 +1,393 @@
+"""
+Create a read-only HTTP service answering JSON queries on the weather data.
+By: Ha Phuong Le
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from db_operations import DBOperations, DEFAULT_STATION
+from dbcm import DBCM
+from metrics import Metrics
+
+# Daily ranges longer than this many days are streamed instead of cached
+STREAM_DAYS = 400
+
+# Rows sent in one chunk of a streamed response
+CHUNK_ROWS = 500
+
+class QueryCache:
+    """
+    Keep the bodies of the latest answered queries, least recently used
+    first, and forget them all when the data version of the db changes
+    By: Ha Phuong Le
+    """
+    def __init__(self, max_entries=512):
+        """
+        Initialize the attributes
+        By: Ha Phuong Le
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """
+        Return the cached body of a query, or None
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = version
+
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, version, body):
+        """
+        Cache the body of a query answered at a data version
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            if version != self.version or not self.max_entries:
+                return
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Return the counters of the cache
+        By: Ha Phuong Le
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                    "entries": len(self.entries), "version": self.version}
+
+class QueryError(Exception):
+    """
+    Raised for a query with missing or invalid parameters
+    By: Ha Phuong Le
+    """
+
+class PooledHTTPServer(HTTPServer):
+    """
+    Handle requests on a fixed pool of threads, so every thread keeps its own
+    pooled read-only db connection between requests
+    By: Ha Phuong Le
+    """
+    def __init__(self, address, handler, database, threads=8):
+        """
+        Initialize the server and its pool of threads
+        By: Ha Phuong Le
+        """
+        super().__init__(address, handler)
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=threads, initializer=self.open_connection)
+
+    def open_connection(self):
+        """
+        Open the db connection of a pool thread so it can never write
+        By: Ha Phuong Le
+        """
+        DBCM.connect(self.database).execute("pragma query_only=1")
+
+    def process_request(self, request, client_address):
+        """
+        Hand a connection to the pool of threads
+        By: Ha Phuong Le
+        """
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """
+        Handle a connection on a pool thread
+        By: Ha Phuong Le
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """
+        Stop the pool of threads and close the socket
+        By: Ha Phuong Le
+        """
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answer GET requests of the service with JSON
+    By: Ha Phuong Le
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """
+        Route a request to its query and record its latency
+        By: Ha Phuong Le
+        """
+        start = time.perf_counter()
+        service = self.server.service
+        parts = urlsplit(self.path)
+        endpoint = parts.path.rstrip("/") or "/"
+        self.streaming = False
+        try:
+            params = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+            query = service.routes.get(endpoint)
+            if query is None:
+                self.send_json(404, {"error": f"unknown endpoint {endpoint}"})
+                endpoint = "unknown"
+            else:
+                query(self, params)
+        except QueryError as exception:
+            self.send_json(400, {"error": str(exception)})
+        except Exception as exception:
+            logging.error(f"QueryHandler:do_GET: {exception}")
+            if self.streaming:
+                # Part of the body is sent: close the connection without the
+                # last chunk so the client sees the response was cut short
+                self.close_connection = True
+            else:
+                self.send_json(500, {"error": "internal error"})
+        finally:
+            service.metrics.observe("request_seconds", time.perf_counter() - start, endpoint=endpoint)
+
+    def send_json(self, status, value=None, body=None):
+        """
+        Send a complete JSON response
+        By: Ha Phuong Le
+        """
+        body = body if body is not None else json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, parts):
+        """
+        Send a JSON response made of parts as they are produced, with chunked
+        encoding. The last chunk is only sent once every part was produced
+        By: Ha Phuong Le
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.streaming = True
+        for part in parts:
+            data = part.encode("utf-8")
+            if data:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        """
+        Keep request logging out of the error log and the console
+        By: Ha Phuong Le
+        """
+
+class WeatherService:
+    """
+    Serve the daily samples, monthly summaries and latest dates of the
+    stations in a db over HTTP. Small answers are cached until ingest writes
+    new rows, large daily ranges are streamed row by row
+    By: Ha Phuong Le
+    """
+    def __init__(self, database="weather.sqlite", host="127.0.0.1", port=8080, threads=8, cache_size=512):
+        """
+        Initialize the attributes and bind the server
+        By: Ha Phuong Le
+        """
+        try:
+            self.database = DBOperations(database) if isinstance(database, str) else database
+            self.cache = QueryCache(cache_size)
+            self.metrics = Metrics()
+            self.metrics.collect("cache", self.cache.stats)
+            self.routes = {"/stations": self.stations,
+                           "/daily": self.daily,
+                           "/monthly": self.monthly,
+                           "/latest": self.latest,
+                           "/metrics": self.report}
+
+            self.server = PooledHTTPServer((host, port), QueryHandler, self.database.database, threads)
+            self.server.service = self
+        except Exception as exception:
+            logging.error(f"WeatherService:__init__: {exception}")
+            raise
+
+    @property
+    def url(self):
+        """
+        Return the address the service listens on
+        By: Ha Phuong Le
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        """
+        Answer requests until shutdown is called
+        By: Ha Phuong Le
+        """
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        """
+        Stop answering requests
+        By: Ha Phuong Le
+        """
+        self.server.shutdown()
+
+    def cached(self, handler, key, answer):
+        """
+        Send the cached body of a query, or answer it and cache the body
+        By: Ha Phuong Le
+        """
+        version = self.database.get_data_version()
+        body = self.cache.get(key, version)
+        if body is None:
+            body = json.dumps(answer()).encode("utf-8")
+            self.cache.put(key, version, body)
+        handler.send_json(200, body=body)
+
+    @staticmethod
+    def station(params):
+        """
+        Return the station of a query, the default station if none is given
+        By: Ha Phuong Le
+        """
+        try:
+            return int(params.get("station", DEFAULT_STATION))
+        except ValueError:
+            raise QueryError("station must be a number")
+
+    @staticmethod
+    def day(params, name):
+        """
+        Return a required YYYY-MM-DD parameter of a query as a date
+        By: Ha Phuong Le
+        """
+        try:
+            return date.fromisoformat(params[name])
+        except KeyError:
+            raise QueryError(f"{name} is required")
+        except ValueError:
+            raise QueryError(f"{name} must be a date as YYYY-MM-DD")
+
+    @staticmethod
+    def year(params, name):
+        """
+        Return a required YYYY parameter of a query
+        By: Ha Phuong Le
+        """
+        try:
+            return int(params[name])
+        except KeyError:
+            raise QueryError(f"{name} is required")
+        except ValueError:
+            raise QueryError(f"{name} must be a year as YYYY")
+
+    def stations(self, handler, params):
+        """
+        GET /stations: the stations in db
+        By: Ha Phuong Le
+        """
+        self.cached(handler, ("stations",), lambda: [{"station": station_id, "name": name}
+                                                     for station_id, name in self.database.get_stations()])
+
+    def daily(self, handler, params):
+        """
+        GET /daily?start=YYYY-MM-DD&end=YYYY-MM-DD&station=ID: the daily
+        samples of a station between two dates
+        By: Ha Phuong Le
+        """
+        station_id = self.station(params)
+        start, end = self.day(params, "start"), self.day(params, "end")
+        if start > end:
+            raise QueryError("start must not be after end")
+
+        def rows():
+            for sample_date, max_temp, min_temp, avg_temp in self.database.fetch_range(
+                    start.isoformat(), end.isoformat(), station_id):
+                yield {"date": sample_date, "max": max_temp, "min": min_temp, "mean": avg_temp}
+
+        if (end - start).days < STREAM_DAYS:
+            self.cached(handler, ("daily", station_id, start, end), lambda: list(rows()))
+            return
+
+        def parts():
+            yield "["
+            batch = []
+            for count, row in enumerate(rows()):
+                batch.append(("," if count else "") + json.dumps(row))
+                if len(batch) >= CHUNK_ROWS:
+                    yield "".join(batch)
+                    batch = []
+            yield "".join(batch) + "]"
+
+        handler.send_stream(parts())
+
+    def monthly(self, handler, params):
+        """
+        GET /monthly?from=YYYY&to=YYYY&station=ID: the days, mean, min, max and
+        standard deviation of the mean temperatures of every month in a range of years
+        By: Ha Phuong Le
+        """
+        station_id = self.station(params)
+        from_year, to_year = self.year(params, "from"), self.year(params, "to")
+        names = ("year", "month", "days", "mean", "min", "max", "std")
+        self.cached(handler, ("monthly", station_id, from_year, to_year),
+                    lambda: [dict(zip(names, row))
+                             for row in self.database.fetch_monthly_stats(from_year, to_year, station_id)])
+
+    def latest(self, handler, params):
+        """
+        GET /latest?station=ID: the latest date with data of a station
+        By: Ha Phuong Le
+        """
+        station_id = self.station(params)
+        self.cached(handler, ("latest", station_id),
+                    lambda: {"station": station_id, "date": self.database.get_latest_date(station_id)})
+
+    def report(self, handler, params):
+        """
+        GET /metrics?format=json|prometheus: the latency histograms of the
+        endpoints and the cache counters
+        By: Ha Phuong Le
+        """
+        if params.get("format") == "prometheus":
+            body = self.metrics.to_prometheus().encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/plain; version=0.0.4")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        else:
+            handler.send_json(200, self.metrics.to_json())
@@ -0,0 +1,185 @@
+"""
+Create a class to keep memory-mapped binary snapshots of the daily samples of the stations.
+By: Nguyen Anh Thu Mai
+"""
+from collections import namedtuple
+import logging
+import mmap
+import os
+import struct
+import numpy as np
+from db_operations import DBOperations, DEFAULT_STATION, day_number
+from weather_dataset import WeatherDataset
+
+# File layout: the header, then the days as int64 days since 1970-01-01 and
+# the max, min and mean temperatures as float64, each a contiguous array of
+# capacity values of which the first count are used, sorted by date
+MAGIC = b"WXSNAP01"
+HEADER = struct.Struct("<8sqqqqq")
+HEADER_SIZE = 64
+
+# Days of room a new file has at least, so updates append in place
+MIN_CAPACITY = 1024
+
+Header = namedtuple("Header", ("station_id", "count", "capacity", "version", "rewrite"))
+
+def epoch_days(numbers):
+    """
+    Return YYYYMMDD day numbers as days since 1970-01-01
+    By: Nguyen Anh Thu Mai
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    months = ((numbers // 10000 - 1970) * 12 + numbers // 100 % 100 - 1).astype("datetime64[M]")
+    return (months.astype("datetime64[D]") + numbers % 100 - 1).astype(np.int64)
+
+def load_snapshot(path):
+    """
+    Map a snapshot file into memory and return it as a dataset whose arrays
+    are read-only views of the file
+    By: Nguyen Anh Thu Mai
+    """
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, _, count, capacity, _, _ = HEADER.unpack_from(mapped)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a snapshot")
+    arrays = [np.frombuffer(mapped, dtype=np.int64 if index == 0 else np.float64, count=count,
+                            offset=HEADER_SIZE + index * 8 * capacity) for index in range(4)]
+    return WeatherDataset.views(arrays[0].view("datetime64[D]"), *arrays[1:])
+
+class WeatherSnapshot:
+    """
+    Write the daily samples of every station to a file of fixed layout that
+    plotting and analysis map into memory instead of reading the db. Ranges
+    of dates are sliced by binary search on views of the mapped file, so
+    loading takes the same time however long the history is and processes
+    mapping the same file share its pages. A snapshot is brought up to date
+    after ingest by appending the new days, or rewritten when older days changed
+    By: Nguyen Anh Thu Mai
+    """
+    def __init__(self, directory="snapshots", database="weather.sqlite"):
+        """
+        Initialize the attributes
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            self.directory = directory
+            self.database = DBOperations(database) if isinstance(database, str) else database
+        except Exception as exception:
+            logging.error(f"WeatherSnapshot:__init__: {exception}")
+
+    def path(self, station_id=DEFAULT_STATION):
+        """
+        Return the file of the snapshot of a station
+        By: Nguyen Anh Thu Mai
+        """
+        return os.path.join(self.directory, f"{station_id}.snap")
+
+    def header(self, station_id=DEFAULT_STATION):
+        """
+        Return the header of the snapshot of a station, or None if there is no valid one
+        By: Nguyen Anh Thu Mai
+        """
+        try:
+            with open(self.path(station_id), "rb") as file:
+                magic, *values = HEADER.unpack(file.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+        header = Header(*values)
+        return header if magic == MAGIC and header.station_id == station_id else None
+
+    def read_rows(self, station_id, after=0):
+        """
+        Return the days after a YYYYMMDD day of a station in db as days since
+        1970-01-01 and the max, min and mean temperatures
+        By: Nguyen Anh Thu Mai
+        """
+        rows = self.database.fetch_days(station_id, after)
+        values = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        return epoch_days(values[:, 0]), [np.ascontiguousarray(values[:, column]) for column in (1, 2, 3)]
+
+    def versions(self):
+        """
+        Return the data and rewrite versions of db a snapshot is written at
+        By: Nguyen Anh Thu Mai
+        """
+        return self.database.get_data_version(), self.database.get_data_version("rewrite_version")
+
+    def write(self, station_id=DEFAULT_STATION, versions=None):
+        """
+        Write the whole snapshot of a station to a new file and swap it in,
+        so readers keep the file they mapped. Return the number of days
+        By: Nguyen Anh Thu Mai
+        """
+        versions = versions or self.versions()
+        days, columns = self.read_rows(station_id)
+        count = len(days)
+        capacity = max(MIN_CAPACITY, 2 * count)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(station_id)
+        with open(path + ".tmp", "wb") as file:
+            # The unused room of the arrays stays a hole in the file
+            file.truncate(HEADER_SIZE + 4 * 8 * capacity)
+            file.write(HEADER.pack(MAGIC, station_id, count, capacity, *versions))
+            for index, values in enumerate((days, *columns)):
+                file.seek(HEADER_SIZE + index * 8 * capacity)
+                file.write(values.tobytes())
+        os.replace(path + ".tmp", path)
+        return count
+
+    def update(self, station_id=DEFAULT_STATION):
+        """
+        Bring the snapshot of a station up to date with db. Days after the
+        last one in the file are appended in place, the count is written
+        after them so readers never see a partial day. The file is rewritten
+        if it is missing, full, or days before its last one may have changed.
+        Return the number of days written
+        By: Nguyen Anh Thu Mai
+        """
+        # Read the versions first: changes made while updating leave them stale
+        versions = self.versions()
+        header = self.header(station_id)
+        if header is None or not header.count or header.rewrite != versions[1]:
+            return self.write(station_id, versions)
+
+        with open(self.path(station_id), "r+b") as file:
+            file.seek(HEADER_SIZE + (header.count - 1) * 8)
+            last = np.frombuffer(file.read(8), dtype=np.int64).view("datetime64[D]")[0]
+            last = day_number(str(last))
+
+            if self.database.count_days(station_id, last) != header.count:
+                return self.write(station_id, versions)
+
+            days, columns = self.read_rows(station_id, last)
+            count = header.count + len(days)
+            if count > header.capacity:
+                return self.write(station_id, versions)
+
+            for index, values in enumerate((days, *columns)):
+                file.seek(HEADER_SIZE + (index * header.capacity + header.count) * 8)
+                file.write(values.tobytes())
+            file.flush()
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, station_id, count, header.capacity, *versions))
+        return len(days)
+
+    def refresh(self, station_id=DEFAULT_STATION):
+        """
+        Update the snapshot of a station unless the db has not changed since it was written
+        By: Nguyen Anh Thu Mai
+        """
+        header = self.header(station_id)
+        if header is None or (header.version, header.rewrite) != self.versions():
+            self.update(station_id)
+
+    def dataset(self, station_id=DEFAULT_STATION, refresh=True):
+        """
+        Map the snapshot of a station into memory and return it as a dataset
+        whose arrays are read-only views of the file, refreshing it first
+        By: Nguyen Anh Thu Mai
+        """
+        if refresh:
+            self.refresh(station_id)
+        return load_snapshot(self.path(station_id))